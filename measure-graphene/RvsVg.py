@@ -5,19 +5,28 @@ import time
 import pickle
 from datetime import datetime
 
-from nanonisTCP import nanonisTCP
-from nanonisTCP.Bias import Bias
-from nanonisTCP.UserOut import UserOut
-from nanonisTCP.Signals import Signals
-from nanonisTCP.LockIn  import LockIn
+from ramp import ramp_to_voltage
+from acquisition import sample_variance
+from session import NanonisSession
+from sweep import AdaptiveGrid
+from storage import RunWriter
+from demod import PhaseTracker, optimal_phase, rotate
+from live_view import LiveView
+from planner import sweep_model, predict, print_plan
 
 try:
     from pymeasure.instruments.keithley import Keithley2400
 except:
     from pymeasure.instruments.keithley import Keithley2400
 
-IP   = '130.194.165.179'
-NTCP = nanonisTCP(IP,6503)
+simulate = False    # Run against the offline simulator (simulator.py) instead of the instruments
+
+IP      = '130.194.165.179'
+PORT    = 6503
+if(simulate):
+    from simulator import simulated_setup
+    IP, PORT, Keithley2400 = simulated_setup()
+session = NanonisSession(IP,PORT)
 
 kth = Keithley2400("GPIB::1")
 
@@ -29,63 +38,187 @@ Vgf = 1.0       # Final gate voltage (V)
 dVg = 25e-3     # Gate voltage step size (V)
 dt  = 0.2       # Time to wait before changing gate voltage by dVg (s)
 
+adaptiveVg  = 0     # Refine the gate voltage points around the resistance peak
+NCoarse     = 21    # Number of points in the first (uniform) pass when adaptiveVg is on
+NMax        = 61    # Total gate voltage point budget when adaptiveVg is on
+adaptiveTol = 0.01  # Stop refining once no interval deviates more than this fraction of the Rg range
+
 ts  = 0.5       # Time to settle before sampling
-ns  = 5         # Number of samples
+adaptiveSettle = 0  # Move on once the signal has converged (ts becomes the upper limit)
+settleTol = 1e-3    # Converged when the ratio varies less than this over the settle window
+ns  = 5         # Number of samples (the saved variance is NaN with 1)
 ds  = 0.02      # Time to wait between samples
+adaptiveNs = 0  # Average until the standard error of the ratio reaches semTol (ns is then the minimum)
+semTol = 1e-4   # Target standard error of the mean of the ratio
+nsMax  = 50     # Maximum number of samples per point when adaptiveNs is on
 
 Rb = 100e3      # Resistor value (used in calculation only) (ohm)
 
 useLockin = 0
 
-bias    = Bias(NTCP)
-userOut = UserOut(NTCP)
-signals = Signals(NTCP)
-lockin  = LockIn(NTCP)
+ratio_signal = 31  # Index (or name) of the signal giving the flake/resistor voltage ratio
+dmodX_signal = 'LI Demod 1 X (V)'   # Name of the lock-in X signal
+dmodY_signal = 'LI Demod 1 Y (V)'   # Name of the lock-in Y signal
+
+softwareLockin  = 0         # Demodulate one oscilloscope block of the raw signal per point instead of polling X and Y
+lockinHarmonics = (1, 2)    # Harmonics of the lock-in frequency to demodulate (the first gives dmx/dmy)
+lockinBandwidth = None      # Software lock-in filter bandwidth (Hz), None averages the whole block
+osciSignalSlot  = 0         # Signals Manager slot of the raw lock-in input (oscilloscope channel A)
+osciRefSlot     = 1         # Signals Manager slot of the lock-in modulation (oscilloscope channel B)
+
+trace = 0       # Record every instrument call to <run>.trace.json (open in ui.perfetto.dev)
+livePlot = 0    # Plot every point as it arrives, in a separate window (see live_view.py)
+
+if(trace):
+    # Record every instrument call (see tracing.py)
+    from tracing import Tracer
+    tracer = Tracer()
+    tracer.instrument_session(session)
+    kth = tracer.keithley(kth)
+    ramp_to_voltage = tracer.wrap(ramp_to_voltage)
+
+bias    = session.bias
+userOut = session.userOut
+signals = session.signals
+lockin  = session.lockin
 
 compliance_current = 100e-6
 kth.apply_voltage(voltage_range=5,compliance_current=compliance_current)
-kth.ramp_to_voltage(0,10*abs(int(kth.source_voltage/dVg)),dt/2)
+ramp_to_voltage(kth,0,10*abs(int(kth.source_voltage/dVg)),dt/2)
 # kth.enable_source()
 
-dmodX_idx = 86
-dmodY_idx = 87
 if(useLockin):
     lockin.ModOnOffSet(modulator_number=1, lockin_onoff=1)
-    dmodX = signals.ValGet(dmodX_idx)
-    dmoxY = signals.ValGet(dmodY_idx)
+    dmodX, dmodY = session.read([dmodX_signal, dmodY_signal])[0]
+
+    if(softwareLockin):
+        lockinFreq = lockin.ModPhasFreqGet(1)
+        session.osci.ChsSet(osciSignalSlot, osciRefSlot)
+        session.osci.Run()
 
 # %%
 # Step 1: ramp gate voltage to initial bias, Vgi
-kth.ramp_to_voltage(Vgi,10*int(abs(Vgi/dVg)),dt/2)
+print_plan(predict(sweep_model('RvsVg.py',globals())),run_name)   # Predicted run time (see planner.py)
+ramp_to_voltage(kth,Vgi,10*int(abs(Vgi/dVg)),dt/2)
 
 # %%
 # Step 2: Sweep the gate voltage while measuring the flake resistance
+# Parameters are written to the run directory up front and every point is
+# written as it arrives, so nothing is lost if the run is interrupted
+experiment = {
+    "Vb"  : Vb,         # Bias across the resistor + flake (V)
+    "Vgi" : Vgi,        # Initial gate voltage (V) 
+    "Vgf" : Vgf,        # Final gate voltage (V)
+    "dVg" : dVg,        # Gate voltage step size (V)
+    "dt"  : dt,         # Time to wait before changing gate voltage by dVg (s)
+    "adaptiveVg"  : adaptiveVg,  # Gate voltage points refined around features?
+    "NCoarse"     : NCoarse,     # Points in the first pass (adaptiveVg)
+    "NMax"        : NMax,        # Gate voltage point budget (adaptiveVg)
+    "adaptiveTol" : adaptiveTol, # Refinement stopping threshold (adaptiveVg)
+
+    "ts"  : ts,         # Time to settle before sampling
+    "ns"  : ns,         # Number of samples
+    "ds"  : ds,         # Time to wait between samples
+    "adaptiveNs" : adaptiveNs, # Average until semTol instead of a fixed ns?
+    "semTol"     : semTol,     # Target standard error of the mean of the ratio
+    "nsMax"      : nsMax,      # Maximum number of samples per point
+    "adaptiveSettle" : adaptiveSettle, # Settle until converged instead of a fixed ts?
+    "settleTol"      : settleTol,      # Convergence tolerance on the ratio
+
+    "Rb"  : Rb,         # Resistor value (used in calculation only) (ohm)
+
+    "softwareLockin"  : softwareLockin,  # Lockin X/Y demodulated from the raw signal?
+    "lockinHarmonics" : lockinHarmonics, # Harmonics demodulated (softwareLockin)
+    "lockinBandwidth" : lockinBandwidth, # Filter bandwidth (softwareLockin)
+}
+
+time_string = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S').replace(':','-')
+run = RunWriter(time_string + '_' + run_name, experiment)
+if(trace): tracer.dump_on_exit(run.path + ".trace.json")
+
 N  = int((Vgf - Vgi)/dVg) + 1
 vg = np.linspace(Vgi,Vgf,N)
+vgPoints = vg
+if(adaptiveVg):
+    grid = AdaptiveGrid(Vgi,Vgf,n_coarse=NCoarse,n_max=NMax,tol=adaptiveTol,dV_min=dVg/10)
+    vgPoints = grid
+    vg = np.zeros(max(NCoarse,NMax))     # The coarse pass is measured in full even if it exceeds NMax
 Rg = np.zeros_like(vg)
 dmx = np.zeros_like(vg)
 dmy = np.zeros_like(vg)
-for n,Vg in enumerate(vg):
-    kth.ramp_to_voltage(Vg,10,dt/2)
+settleTimes = np.zeros_like(vg)
+Rg_var = np.zeros_like(vg)              # Variance of Rg samples at each point
+nsamples = np.zeros_like(vg, dtype=int) # Number of samples averaged at each point
+harmonics = np.zeros((len(vg), 4, len(lockinHarmonics)))    # X, Y, R and phase at each harmonic (softwareLockin)
+phaseTracker = PhaseTracker()           # Lock-in phase maximising X over the points so far
+if(livePlot):
+    live = LiveView([['Rg'], ['X', 'Y']] if useLockin else [['Rg']], xlim=(Vgi,Vgf), title=run.path)
+session.refresh_signals()   # Signal indexes as of this sweep
+Vprev = Vgi     # Gate voltage before each move
+for n,Vg in enumerate(vgPoints):
+    vg[n] = Vg
+    # 10 steps per dVg (and at least 10), so the long moves of the refinement
+    # passes keep to the same slew rate as the initial ramp
+    ramp_to_voltage(kth,Vg,max(10*int(round(abs(Vg - Vprev)/dVg)),10),dt/2)
+    Vprev = Vg
 
-    time.sleep(ts)
+    if(adaptiveSettle):
+        settleTimes[n] = session.settle([ratio_signal],tolerance=settleTol,timeout=ts)
+    else:
+        time.sleep(ts)
+        settleTimes[n] = ts
 
-    R_ratio = 0
-    for s in range(ns):
-        time.sleep(ds)
-        
-        R_ratio += signals.ValGet(31,wait_for_newest_data=True)/ns
-    
-    Rg[n] = Rb*R_ratio
+    # Sample the resistance ratio (and lockin X/Y) together in one request
+    channels = [ratio_signal]
+    if(useLockin and not softwareLockin): channels += [dmodX_signal, dmodY_signal]
+    if(adaptiveNs):
+        tol = [semTol] + [np.inf]*(len(channels) - 1)   # Only the ratio sets the number of samples
+        samples, variance, nsamples[n] = session.average(channels, tol, ns_min=ns, ns_max=nsMax, ds=ds)
+    else:
+        samples  = session.read(channels, ns=ns, ds=ds)
+        variance = sample_variance(samples)
+        samples  = samples.mean(axis=0)
+        nsamples[n] = ns
+
+    Rg[n] = Rb*samples[0]
+    Rg_var[n] = Rb**2*variance[0]
+
+    if(useLockin and softwareLockin):
+        harmonics[n] = session.demodulate(lockinFreq, lockinHarmonics, lockinBandwidth)
+        dmx[n], dmy[n] = harmonics[n,:2,0]
+    elif(useLockin):
+        dmx[n] = samples[1]
+        dmy[n] = samples[2]
+    if(useLockin): phaseTracker.add(dmx[n],dmy[n])
+
+    run.append({"vg"  : Vg,                 # Gate voltage
+                "Rg"  : Rg[n],              # Resistance
+                "Rg_var"   : Rg_var[n],     # Variance of the Rg samples
+                "nsamples" : nsamples[n],   # Number of samples averaged
+                "dmx" : dmx[n],             # Lockin signal x-channel
+                "dmy" : dmy[n],             # Lockin signal y-channel
+                "harmonics" : harmonics[n], # Software lockin X, Y, R, phase at each harmonic
+                "lockinPhase" : phaseTracker.phase, # Optimal lockin phase so far (deg)
+                "settleTime" : settleTimes[n]}) # Time spent settling (s)
+
+    if(livePlot): live.add(Vg=Vg, Rg=Rg[n], X=dmx[n], Y=dmy[n])
+    if(adaptiveVg): grid.add(Vg,Rg[n])
 
-    if(useLockin):
-        dmx[n] = signals.ValGet(dmodX_idx)
-        dmy[n] = signals.ValGet(dmodY_idx)
+if(adaptiveVg):
+    # Trim to the points actually measured and put them in gate voltage order
+    order = np.argsort(vg[:n+1])
+    vg, Rg, dmx, dmy = vg[order], Rg[order], dmx[order], dmy[order]
+    settleTimes, Rg_var, nsamples = settleTimes[order], Rg_var[order], nsamples[order]
+    harmonics = harmonics[order]
     
-kth.ramp_to_voltage(0,10*int(abs(Vgf/dVg)),dt/2)
+if(livePlot): live.close()
+ramp_to_voltage(kth,0,10*int(abs(Vgf/dVg)),dt/2)
 
 # kth.disable_source()
-NTCP.close_connection()
+session.close()
+run.finish()
+if(trace): tracer.dump()
+print("Total settle time: %.1f s (fixed ts would take %.1f s)" % (np.sum(settleTimes),ts*len(vg)))
 
 plt.figure()
 if(not useLockin):
@@ -104,28 +237,34 @@ if(useLockin):
     plt.plot(vg,dmy_norm,label="dmodY")
     plt.plot(vg,dmxy_norm, label="dmxy", linestyle='dashed')
 
+    # X and Y rotated to the phase that puts the most signal in X
+    lockinPhase = optimal_phase(dmx,dmy)
+    dmxRot, dmyRot = rotate(dmx,dmy,lockinPhase)
+    dmxRot_norm = dmxRot - np.min(dmxRot)
+    dmxRot_norm /= np.max(dmxRot_norm)
+    plt.plot(vg,dmxRot_norm,label="dmodX at %.0f deg" % lockinPhase)
+    plt.legend()
+
 plt.show()
 # %%
 # Save the experiment
-experiment = {
-    "Vb"  : Vb,         # Bias across the resistor + flake (V)
-    "Vgi" : Vgi,        # Initial gate voltage (V) 
-    "Vgf" : Vgf,        # Final gate voltage (V)
-    "dVg" : dVg,        # Gate voltage step size (V)
-    "dt"  : dt,         # Time to wait before changing gate voltage by dVg (s)
-
-    "ts"  : ts,         # Time to settle before sampling
-    "ns"  : ns,         # Number of samples
-    "ds"  : ds,         # Time to wait between samples
-
-    "Rb"  : Rb,         # Resistor value (used in calculation only) (ohm)
+experiment.update({
+    "settleTimes" : settleTimes,    # Time spent settling at each gate voltage (s)
 
     "vg"  : vg,         # Gate voltage (x axis)
     "Rg"  : Rg,         # Resistance (y axis)
+    "Rg_var"   : Rg_var,   # Variance of the Rg samples at each point
+    "nsamples" : nsamples, # Number of samples averaged at each point
 
     "dmx" : dmx,        # Lockin signal x-channel
     "dmy" : dmy,        # Lockin signal y-channel
-}
+    "harmonics" : harmonics, # Software lockin X, Y, R, phase at each harmonic
+})
+if(useLockin):
+    experiment.update({
+        "lockinPhase" : lockinPhase, # Phase maximising the in-phase signal (deg)
+        "dmxRot" : dmxRot,  # Lockin x-channel rotated by lockinPhase
+        "dmyRot" : dmyRot,  # Lockin y-channel rotated by lockinPhase
+    })
 
-time_string = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S').replace(':','-')
-pickle.dump(experiment,open(time_string + '_' + run_name + ".pk",'wb'))
\ No newline at end of file
+pickle.dump(experiment,open(run.path + ".pk",'wb'))
\ No newline at end of file
@@ -0,0 +1,84 @@
+# %%
+import numpy as np
+import matplotlib.pyplot as plt
+
+from session import NanonisSession
+from multi_sweep import Device, multi_sweep, ramp_all
+
+try:
+    from pymeasure.instruments.keithley import Keithley2400
+except:
+    from pymeasure.instruments.keithley import Keithley2400
+
+simulate = False    # Run against the offline simulator (simulator.py) instead of the instruments
+
+IP      = '130.194.165.179'
+PORT    = 6503
+if(simulate):
+    from simulator import simulated_setup
+    IP, PORT, Keithley2400 = simulated_setup(devices=2)
+session = NanonisSession(IP,PORT)
+
+# %%
+# R(Vg) of several devices on one chip at once (see multi_sweep.py). Every
+# device has its own Keithley and its own flake/resistor ratio signal; the
+# gates are ramped together and all the ratios are read in the same requests.
+# Each device is saved to its own run: <time>_<run_name> <device>
+run_name = "Grene-hBN-Grite STM 77K multi"
+Vb  = 50e-3     # Bias across the resistor + flake (V)
+dVg = 25e-3     # Gate voltage step size (V)
+dt  = 0.2       # Time to wait before changing gate voltage by dVg (s)
+
+ts  = 0.5       # Time to settle before sampling
+adaptiveSettle = 0  # Move on once every device has converged (ts becomes the upper limit)
+settleTol = 1e-3    # Converged when the ratios vary less than this over the settle window
+ns  = 5         # Number of samples (the saved variance is NaN with 1)
+ds  = 0.02      # Time to wait between samples
+
+Rb = 100e3      # Resistor value (used in calculation only) (ohm)
+
+#           name,   Keithley,   ratio signal (index or name),   Vgi,  Vgf
+devices = [["A",   "GPIB::1",  31,                             -1.0, 1.0],
+           ["B",   "GPIB::25", 32,                             -1.0, 1.0]]
+
+livePlot = 0    # Plot every point as it arrives, in a separate window (see live_view.py)
+
+compliance_current = 100e-6
+
+sweeps = []
+for name, resource, ratio_signal, Vgi, Vgf in devices:
+    kth = Keithley2400(resource)
+    kth.apply_voltage(voltage_range=5,compliance_current=compliance_current)
+    N  = int(round((Vgf - Vgi)/dVg)) + 1
+    sweeps.append(Device(name, kth, np.linspace(Vgi,Vgf,N), [ratio_signal], Rb=Rb, dt=dt,
+                         meta={"Vb" : Vb, "Vgi" : Vgi, "Vgf" : Vgf, "dVg" : dVg, "resource" : resource}))
+
+callback = None
+if(livePlot):
+    from live_view import LiveView
+    live = LiveView([[sweep.name for sweep in sweeps]], xlim=(min(d[3] for d in devices), max(d[4] for d in devices)))
+    callback = lambda device, point: live.add(**{"Vg" : point["vg"], device.name : point["Rg"]})
+
+# %%
+# Step 1: ramp every gate to its initial voltage, Vgi, at the same time
+ramp_all(sweeps, [sweep.vg[0] for sweep in sweeps], dVg)
+
+# %%
+# Step 2: Sweep all the gates together while measuring every flake
+results = multi_sweep(session, sweeps, ts=ts, ns=ns, ds=ds, settle_tol=settleTol if adaptiveSettle else None,
+                      run_name=run_name, experiment={"adaptiveSettle" : adaptiveSettle}, callback=callback)
+if(livePlot): live.close()
+
+ramp_all(sweeps, [0]*len(sweeps), dVg)
+session.close()
+
+stepTimes = max(results.values(), key=lambda result: len(result["vg"]))["stepTimes"]
+print("%d devices, %d steps in %.1f s" % (len(sweeps), len(stepTimes), np.sum(stepTimes)))
+
+plt.figure()
+for name, result in results.items():
+    plt.plot(result["vg"],result["Rg"],label=name)
+plt.xlabel("Vg (V)")
+plt.ylabel("Rg (ohm)")
+plt.legend()
+plt.show()
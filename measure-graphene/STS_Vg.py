@@ -5,91 +5,219 @@ import time
 import pickle
 from datetime import datetime
 
-from nanonisTCP import nanonisTCP
-from nanonisTCP.Bias import Bias
-from nanonisTCP.UserOut import UserOut
-from nanonisTCP.Signals import Signals
-from nanonisTCP.LockIn  import LockIn
-from nanonisTCP.BiasSpectr import BiasSpectr
+from ramp import ramp_to_voltage
+from session import NanonisSession
+from sweep import AdaptiveGrid
+from storage import RunWriter, resume_run, read_run, collect
+from pipeline import Pipeline
+from spectra import reduce_spectrum
+from spectrum_map import SpectrumMap
+from live_view import LiveView
+from planner import sweep_model, predict, print_plan, spectrum_time
 
 try:
     from pymeasure.instruments.keithley import Keithley2400
 except:
     from pymeasure.instruments.keithley import Keithley2400
 
-IP   = '130.194.165.179'
-# IP   = '127.0.0.1'
-NTCP = nanonisTCP(IP,6501)
+simulate = False    # Run against the offline simulator (simulator.py) instead of the instruments
+
+IP      = '130.194.165.179'
+# IP      = '127.0.0.1'
+PORT    = 6501
+if(simulate):
+    from simulator import simulated_setup
+    IP, PORT, Keithley2400 = simulated_setup()
+session = NanonisSession(IP,PORT)
 
 kth = Keithley2400("GPIB::1")
 
 # %%
 run_name = "Grene-hBN-Grite STS Vg -1V to 1V N21"
+resume   = ""   # Run directory of an interrupted run to continue ("" starts a new run)
 Vgi = -1        # Initial gate voltage (V) 
 Vgf = 1.0       # Final gate voltage (V)
 dVg = 25e-3     # Gate voltage step size (V)
 N   = 21        # Number of spectra to acquire between Vgi and Vgf
 dt  = 0.2       # Time to wait before changing gate voltage by dVg (s)
 
+adaptiveVg      = 0                     # Refine the gate voltage points where the lock-in amplitude changes most
+NMax            = 41                    # Total number of spectra when adaptiveVg is on (N is the first pass)
+adaptiveTol     = 0.01                  # Stop refining once no interval deviates more than this fraction of the range
+adaptiveChannel = 'LI Demod 1 X (A)'    # Spectrum channel whose mean amplitude drives the refinement
+
 ts  = 0.5       # Time to settle before sampling
+adaptiveSettle = 0              # Move on once the current has converged (ts becomes the upper limit)
+settleSignal   = 'Current (A)'  # Signal watched while settling
+settleTol      = 5e-12          # Converged when the current varies less than this over the settle window (A)
+
+sgPts  = 5      # Savitzky-Golay window for the dI/dV saved with each spectrum
+sgPoly = 1      # Savitzky-Golay polynomial order
 
 useLockin  = 1
 lockinAmp  = 10e-3
 lockinFreq = 980
 
-bias     = Bias(NTCP)
-userOut  = UserOut(NTCP)
-lockin   = LockIn(NTCP)
-biasSpec = BiasSpectr(NTCP)
+trace = 0       # Record every instrument call to <run>.trace.json (open in ui.perfetto.dev)
+livePlot = 0    # Show the (Vg, Vb) map growing, in a separate window (see live_view.py)
+
+if(trace):
+    # Record every instrument call (see tracing.py)
+    from tracing import Tracer
+    tracer = Tracer()
+    tracer.instrument_session(session)
+    kth = tracer.keithley(kth)
+    ramp_to_voltage = tracer.wrap(ramp_to_voltage)
+
+bias     = session.bias
+userOut  = session.userOut
+lockin   = session.lockin
+biasSpec = session.biasSpec
 
 compliance_current = 100e-6
 kth.apply_voltage(voltage_range=5,compliance_current=compliance_current)
-kth.ramp_to_voltage(0,10*abs(int(kth.source_voltage/dVg)),dt/10)
+ramp_to_voltage(kth,0,10*abs(int(kth.source_voltage/dVg)),dt/10)
 
 if(useLockin):
     lockin.ModAmpSet(1,lockinAmp)
     lockin.ModPhasFreqSet(1,lockinFreq)
     lockin.ModOnOffSet(modulator_number=1, lockin_onoff=1)
 # %%
-# Step 1: ramp gate voltage to initial bias, Vgi
-kth.ramp_to_voltage(Vgi,10*int(abs(Vgi/dVg)),dt)
-
-# %%
-# Step 2: Sweep the gate voltage and take a spectrum at each point
-# N  = int((Vgf - Vgi)/dVg)
-vg = np.linspace(Vgi,Vgf,N)
-spectra = []
+# Step 1: ramp gate voltage to initial bias, Vgi (or to the last completed
+# gate voltage when resuming an interrupted run)
+# Parameters are written to the run directory up front and every spectrum is
+# written as it arrives, so nothing is lost if the run is interrupted
 biasProps = biasSpec.PropsGet()
-for n,Vg in enumerate(vg):
-    kth.ramp_to_voltage(Vg,10,dt)
-    time.sleep(ts)
-
-    spectra.append(biasSpec.Start(get_data=True))
-    time.sleep(ts)
-    
-kth.ramp_to_voltage(0,10*int(abs(Vgf/dVg)),dt)
-
-# kth.disable_source()
-NTCP.close_connection()
-
-# %%
-# Save the experiment
+print_plan(predict(sweep_model('STS_Vg.py',globals()),{'t_spectrum' : spectrum_time(biasSpec)}),run_name)   # Predicted run time (see planner.py)
 experiment = {
     "Vgi" : Vgi,        # Initial gate voltage (V) 
     "Vgf" : Vgf,        # Final gate voltage (V)
+    "N"   : N,          # Number of spectra to acquire between Vgi and Vgf
     "dVg" : dVg,        # Gate voltage step size (V)
     "dt"  : dt,         # Time to wait before changing gate voltage by dVg (s)
 
     "ts"  : ts,         # Time to settle before sampling
 
+    "adaptiveVg"      : adaptiveVg,      # Gate voltage points refined around features?
+    "NMax"            : NMax,            # Spectrum budget (adaptiveVg)
+    "adaptiveTol"     : adaptiveTol,     # Refinement stopping threshold (adaptiveVg)
+    "adaptiveChannel" : adaptiveChannel, # Channel driving the refinement (adaptiveVg)
+    "adaptiveSettle" : adaptiveSettle, # Settle until converged instead of a fixed ts?
+    "settleTol"      : settleTol,      # Convergence tolerance on settleSignal
+
     "useLockin"  : useLockin,  # Lockin was used to aquire spectra?
     "lockinAmp"  : lockinAmp,  # Lockin amplitude
     "lockinFreq" : lockinFreq, # Lockin Frequency
 
-    "vg"       : vg,       # Gate voltage (x axis)
-    "spectra"  : spectra,  # Dictionary containing channels returned from bias spectroscopy experiment
     "biasProps": biasProps # Properties of the bias spectroscopy module during run
 }
 
-time_string = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S').replace(':','-')
-pickle.dump(experiment,open(time_string + '_' + run_name + ".pk",'wb'))
\ No newline at end of file
+points = []
+if(resume):
+    run, points, checkpoint = resume_run(resume, experiment)
+    print("Resuming",resume,"after",len(points),"spectra")
+else:
+    time_string = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S').replace(':','-')
+    run = RunWriter(time_string + '_' + run_name, experiment)
+if(trace): tracer.dump_on_exit(run.path + ".trace.json")
+
+if(len(points)):
+    Vg_last = checkpoint["vg"]
+    ramp_to_voltage(kth,Vg_last,max(10*int(abs(Vg_last/dVg)),2),dt)
+else:
+    ramp_to_voltage(kth,Vgi,10*int(abs(Vgi/dVg)),dt)
+
+# %%
+# Step 2: Sweep the gate voltage and take a spectrum at each point
+# N  = int((Vgf - Vgi)/dVg)
+vg = np.linspace(Vgi,Vgf,N)
+vgPoints = vg
+if(adaptiveVg):
+    grid = AdaptiveGrid(Vgi,Vgf,n_coarse=N,n_max=NMax,tol=adaptiveTol,dV_min=dVg)
+    vgPoints = grid
+
+# Each spectrum is written and then reduced (dI/dV, forward/backward average)
+# and added to the (Vg, Vb) map in the background while the gate is ramped and
+# settled for the next one. The map is rewritten to <run>.map.npz after every
+# spectrum
+rows   = max(N,NMax) if adaptiveVg else N   # The first pass is measured in full even if it exceeds NMax
+stsMap = SpectrumMap(rows)
+if(livePlot): live = LiveView([['map']], xlim=(Vgi,Vgf), rows=rows, title=run.path)
+def savePoint(point):
+    Vg, spectrum, settleTime = point
+    run.append({"vg"         : Vg,          # Gate voltage
+                "spectrum"   : spectrum,    # Channels returned from the bias spectroscopy experiment
+                "settleTime" : settleTime}) # Time spent settling (s)
+    run.checkpoint(vg=Vg)
+
+def mapPoint(point):
+    Vg, spectrum = point[:2]
+    row = stsMap.add(Vg,reduce_spectrum(spectrum,sg_pts=sgPts,sg_poly=sgPoly))
+    stsMap.save(run.path + ".map.npz")
+    if(livePlot): live.add(Vg=Vg, map=stsMap.maps[stsMap.channels[0]][row], bias=stsMap.bias)
+
+for point in points:
+    mapPoint((point["vg"],point["spectrum"]))
+
+session.refresh_signals()   # Signal indexes as of this sweep
+pipeline = Pipeline(savePoint,derive=mapPoint)
+Vprev = Vg_last if len(points) else Vgi     # Gate voltage before each move
+try:
+    for n,Vg in enumerate(vgPoints):
+        if(n < len(points)):
+            # Already acquired before the run was interrupted
+            if(adaptiveVg):
+                grid.add(Vg,np.mean(np.abs(points[n]["spectrum"]['data_dict'][adaptiveChannel])))
+            continue
+
+        # 10 steps per dVg (and at least 10), so the long moves of the
+        # refinement passes keep to the same slew rate as the initial ramp
+        ramp_to_voltage(kth,Vg,max(10*int(round(abs(Vg - Vprev)/dVg)),10),dt)
+        Vprev = Vg
+        if(adaptiveSettle):
+            settleTime = session.settle([settleSignal],tolerance=settleTol,timeout=ts)
+        else:
+            time.sleep(ts)
+            settleTime = ts
+
+        spectrum = biasSpec.Start(get_data=True)
+        pipeline.submit((Vg, spectrum, settleTime))
+
+        if(adaptiveVg):
+            grid.add(Vg,np.mean(np.abs(spectrum['data_dict'][adaptiveChannel])))
+except:
+    pipeline.close(raise_error=False)   # Write the queued points, then raise the loop's own error
+    raise
+else:
+    pipeline.close()
+finally:
+    if(livePlot): live.close()
+
+ramp_to_voltage(kth,0,10*int(abs(Vgf/dVg)),dt)
+
+# kth.disable_source()
+session.close()
+run.finish()
+if(trace): tracer.dump()
+
+# %%
+# Save the experiment
+experiment, points = read_run(run.path)
+vg          = collect(points,"vg")
+settleTimes = collect(points,"settleTime")
+spectra     = [point["spectrum"] for point in points]
+reduced     = [reduce_spectrum(spectrum,sg_pts=sgPts,sg_poly=sgPoly) for spectrum in spectra]
+if(adaptiveVg):
+    # Put the spectra in gate voltage order
+    order = np.argsort(vg)
+    vg, settleTimes = vg[order], settleTimes[order]
+    spectra = [spectra[i] for i in order]
+    reduced = [reduced[i] for i in order]
+print("Total settle time: %.1f s (fixed ts would take %.1f s)" % (np.sum(settleTimes),ts*len(vg)))
+
+experiment["vg"]          = vg          # Gate voltage (x axis)
+experiment["spectra"]     = spectra     # Dictionary containing channels returned from bias spectroscopy experiment
+experiment["reduced"]     = reduced     # Sweep-averaged channels and dI/dV of each spectrum
+experiment["settleTimes"] = settleTimes # Time spent settling at each gate voltage (s)
+
+pickle.dump(experiment,open(run.path + ".pk",'wb'))
\ No newline at end of file
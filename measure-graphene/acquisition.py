@@ -0,0 +1,203 @@
+"""
+Batched signal acquisition from Nanonis.
+
+Instead of one Signals.ValGet round-trip per channel per sample, every sample
+of every channel is read with a single Signals.ValsGet request, so channels
+such as lock-in X and Y are sampled at the same instant. Alternatively a whole
+block of samples can be pulled from the Oscilloscope 2-Channels buffer.
+
+All readers return a numpy array of shape (samples, channels).
+"""
+import time
+import numpy as np
+
+def ValsGet(NTCP, signal_indexes, wait_for_newest_data=True):
+    """
+    Returns the values of several signals in one request (Signals.ValsGet).
+
+    Parameters
+    ----------
+    NTCP                 : nanonisTCP connection
+    signal_indexes       : list of signal indexes to read
+    wait_for_newest_data : see Signals.ValGet
+
+    Returns
+    -------
+    signal_values : numpy array of values in the order of signal_indexes
+
+    """
+    num_signals = len(signal_indexes)
+
+    ## Make Header
+    hex_rep = NTCP.make_header('Signals.ValsGet', body_size=4 + 4*num_signals + 4)
+
+    ## Arguments
+    hex_rep += NTCP.to_hex(num_signals,4)
+    for signal_index in signal_indexes:
+        hex_rep += NTCP.to_hex(int(signal_index),4)
+    hex_rep += NTCP.to_hex(int(wait_for_newest_data),4)
+
+    NTCP.send_command(hex_rep)
+
+    response = NTCP.receive_response(4 + 4*num_signals)
+
+    num_values = NTCP.hex_to_int32(response[0:4])
+    signal_values = np.zeros(num_values)
+    for n in range(num_values):
+        signal_values[n] = NTCP.hex_to_float32(response[4 + 4*n:8 + 4*n])
+
+    return signal_values
+
+def read_channels(NTCP, signal_indexes, ns=1, ds=0, wait_for_newest_data=True):
+    """
+    Reads ns samples of every channel in signal_indexes, one batched request
+    per sample.
+
+    Parameters
+    ----------
+    NTCP           : nanonisTCP connection
+    signal_indexes : list of signal indexes to read
+    ns             : number of samples
+    ds             : time to wait between samples (s)
+
+    Returns
+    -------
+    samples : numpy array of shape (ns, len(signal_indexes))
+
+    """
+    samples = np.zeros((ns, len(signal_indexes)))
+    for s in range(ns):
+        if(ds > 0 and s > 0): time.sleep(ds)
+        samples[s] = ValsGet(NTCP, signal_indexes, wait_for_newest_data)
+
+    return samples
+
+def read_block(osci, dataToGet=1):
+    """
+    Pulls one block of samples from the Oscilloscope 2-Channels buffer. The
+    channels are the ones set with Osci2T.ChsSet (Signals Manager slots) and
+    the block length is set by the oscilloscope timebase.
+
+    Parameters
+    ----------
+    osci      : nanonisTCP.Osci2T module
+    dataToGet : 0 = current, 1 = next trigger, 2 = wait two triggers
+
+    Returns
+    -------
+    samples : numpy array of shape (samples, 2) for channels A and B
+    dt      : time between samples (s)
+
+    """
+    t0, dt, chA, chB = osci.DataGet(dataToGet)
+    return np.column_stack((chA, chB)), dt
+
+def settle(read, tolerance=None, timeout=1, window=5, ds=0, slope=None):
+    """
+    Samples a signal until it has converged instead of waiting a fixed time.
+
+    Parameters
+    ----------
+    read      : function returning one sample (a value or an array of channels)
+    tolerance : converged when the peak-to-peak of the last window samples is
+                below tolerance (per channel). None skips this check
+    timeout   : give up waiting after this long (s)
+    window    : number of samples the criteria are evaluated over
+    ds        : time to wait between samples (s)
+    slope     : converged when the fitted drift of the last window samples is
+                below slope (units/s). None skips this check
+
+    Returns
+    -------
+    settle_time : time spent settling (s)
+
+    """
+    t0 = time.perf_counter()
+    times  = []
+    values = []
+    while(True):
+        values.append(np.atleast_1d(read()))
+        times.append(time.perf_counter() - t0)
+        if(times[-1] >= timeout): break
+
+        if(len(values) >= window):
+            v = np.array(values[-window:])
+            converged = True
+            if(tolerance is not None):
+                converged &= np.all(np.ptp(v, axis=0) < tolerance)
+            if(slope is not None):
+                drift = np.polyfit(times[-window:], v, 1)[0]
+                converged &= np.all(np.abs(drift) < slope)
+            if(converged): break
+
+        if(ds > 0): time.sleep(ds)
+
+    return times[-1]
+
+def sample_variance(samples):
+    """
+    Sample variance (ddof=1) of each channel of an array of shape (samples,
+    channels). A single sample gives no spread: its variance is NaN, returned
+    without the warning numpy raises.
+    """
+    samples = np.asarray(samples)
+    if(len(samples) < 2): return np.full(samples.shape[1:], np.nan)
+    return samples.var(axis=0, ddof=1)
+
+class RunningStats:
+    """
+    Running mean and variance per channel using Welford's update. Below two
+    samples the variance is NaN (unknown) and the standard error infinite, so
+    average_until never stops on a single sample unless ns_max is 1.
+    """
+    def __init__(self, num_channels=1):
+        self.n    = 0
+        self.mean = np.zeros(num_channels)
+        self.M2   = np.zeros(num_channels)
+
+    def update(self, x):
+        self.n += 1
+        delta      = x - self.mean
+        self.mean += delta/self.n
+        self.M2   += delta*(x - self.mean)
+
+    def variance(self):
+        if(self.n < 2): return np.full_like(self.mean, np.nan)
+        return self.M2/(self.n - 1)
+
+    def sem(self):
+        if(self.n < 2): return np.full_like(self.mean, np.inf)
+        return np.sqrt(self.variance()/self.n)
+
+def average_until(read, sem_tol, ns_min=3, ns_max=100, ds=0):
+    """
+    Averages samples until the standard error of the mean of every channel
+    is below sem_tol, or until ns_max samples have been taken.
+
+    Parameters
+    ----------
+    read    : function returning one sample (a value or an array of channels)
+    sem_tol : target standard error of the mean (scalar or per channel)
+    ns_min  : minimum number of samples
+    ns_max  : maximum number of samples
+    ds      : time to wait between samples (s)
+
+    Returns
+    -------
+    mean     : mean of each channel
+    variance : sample variance of each channel (NaN if only one sample was
+               taken, i.e. ns_max = 1)
+    n        : number of samples taken
+
+    """
+    stats = None
+    while(True):
+        x = np.atleast_1d(read())
+        if(stats is None): stats = RunningStats(len(x))
+        stats.update(x)
+
+        if(stats.n >= ns_max): break
+        if(stats.n >= ns_min and np.all(stats.sem() < sem_tol)): break
+        if(ds > 0): time.sleep(ds)
+
+    return stats.mean, stats.variance(), stats.n
@@ -0,0 +1,197 @@
+"""
+Sweep benchmarks.
+
+Runs the sweep scripts against the offline simulator (simulator.py) at a set
+of configurations and reports throughput in points per minute. The time of
+every run is split into phases:
+    ramp      gate ramps (ramp.py helpers, NanonisSession.ramp_output)
+    settle    waiting at each gate voltage (NanonisSession.settle and any
+              time.sleep outside the other phases)
+    sample    signal reads (NanonisSession.read/average)
+    spectrum  bias spectra (BiasSpectr.Start)
+    other     everything else (setup, storage, plotting)
+and, within each phase, into the resource the time went to: sleep
+(time.sleep), gpib (Keithley bus), tcp (Nanonis requests) or python.
+
+Usage:
+    python benchmark.py [results.json]
+"""
+import io
+import os
+import sys
+import time
+import json
+import platform
+import tempfile
+import threading
+import subprocess
+import contextlib
+from datetime import datetime
+
+from nanonisTCP import nanonisTCP
+from nanonisTCP.BiasSpectr import BiasSpectr
+
+import ramp
+from session import NanonisSession
+from storage import RunWriter
+from simulator import Keithley2400Sim, run_script, SCRIPTS
+
+PHASES    = ['ramp', 'settle', 'sample', 'spectrum', 'other']
+RESOURCES = ['sleep', 'gpib', 'tcp', 'python']
+
+# Variations on the quick settings in simulator.SCRIPTS
+CONFIGS = {
+    'transport1.py'        : [{}, {'nVg': 21}, {'ns': 10}, {'dt': 0.2},
+                              {'keithley_step_size': 10e-3}, {'back_sweep': False}],
+    'RvsVg.py'             : [{}, {'dVg': 0.05}, {'ns': 10}, {'ts': 0.2}, {'dt': 0.05}],
+    'STS_Vg.py'            : [{}, {'N': 9}, {'ts': 0.2}, {'dt': 0.02}],
+    '../nanonis_STS_Vg.py' : [{}, {'dVg': 0.125}, {'ts': 0.2}, {'dt': 0.05}],
+}
+
+class PhaseTimer:
+    def __init__(self):
+        """
+        Accumulates the time spent in the main thread by (phase, resource).
+        Calls from other threads (the save pipeline, the simulator) are not
+        timed. Nested calls are attributed to the outermost phase and the
+        outermost resource, so a Keithley write counts as gpib even though
+        it sleeps, and a ramp counts as ramp even though it writes to the
+        Keithley.
+        """
+        self.thread = threading.current_thread()
+        self.totals = {phase : {resource : 0 for resource in RESOURCES} for phase in PHASES}
+        self.calls  = {resource : 0 for resource in RESOURCES}
+        self.points = 0
+
+        self.phase    = None
+        self.resource = None
+        self.t = time.perf_counter()
+
+    def mark(self):
+        t = time.perf_counter()
+        phase = self.phase or 'other'
+        if(self.phase is None and self.resource == 'sleep'): phase = 'settle'
+        self.totals[phase][self.resource or 'python'] += t - self.t
+        self.t = t
+
+    def wrap(self, func, phase=None, resource=None):
+        """
+        Returns func timed as the given phase and/or resource.
+        """
+        def timed(*args, **kwargs):
+            if(threading.current_thread() is not self.thread):
+                return func(*args, **kwargs)
+
+            outer = (self.phase, self.resource)
+            self.mark()
+            self.phase    = self.phase or phase
+            self.resource = self.resource or resource
+            if(resource and outer[1] is None): self.calls[resource] += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.mark()
+                self.phase, self.resource = outer
+        return timed
+
+    def result(self, elapsed):
+        self.mark()
+        phases    = {phase : sum(self.totals[phase].values()) for phase in PHASES}
+        resources = {resource : sum(self.totals[phase][resource] for phase in PHASES) for resource in RESOURCES}
+        points    = max(self.points, 1)
+        return {
+            "points"            : self.points,
+            "elapsed"           : elapsed,
+            "points_per_minute" : 60*self.points/elapsed,
+            "phases"            : phases,
+            "per_point"         : {phase : phases[phase]/points for phase in PHASES},
+            "resources"         : resources,
+            "calls"             : {resource : self.calls[resource] for resource in ['gpib', 'tcp']},
+            "breakdown"         : self.totals,
+        }
+
+def instrument(timer):
+    """
+    Patches the timed functions and returns a function that restores them.
+    """
+    patches = [
+        (ramp, 'ramp_gate_voltage', 'ramp', None),
+        (ramp, 'ramp_to_voltage', 'ramp', None),
+        (NanonisSession, 'ramp_output', 'ramp', None),
+        (NanonisSession, 'settle', 'settle', None),
+        (NanonisSession, 'read', 'sample', None),
+        (NanonisSession, 'average', 'sample', None),
+        (BiasSpectr, 'Start', 'spectrum', None),
+        (time, 'sleep', None, 'sleep'),
+        (Keithley2400Sim, '_bus', None, 'gpib'),
+        (nanonisTCP, 'send_command', None, 'tcp'),
+        (nanonisTCP, 'receive_response', None, 'tcp'),
+    ]
+
+    original = [(obj, name, obj.__dict__[name]) for obj, name, _, _ in patches]
+    for obj, name, phase, resource in patches:
+        setattr(obj, name, timer.wrap(getattr(obj, name), phase, resource))
+
+    append = RunWriter.append
+    def counted_append(run, point):
+        timer.points += 1
+        return append(run, point)
+    RunWriter.append = counted_append
+    original.append((RunWriter, 'append', append))
+
+    def restore():
+        for obj, name, func in original:
+            setattr(obj, name, func)
+    return restore
+
+def benchmark(script, config):
+    """
+    Runs one script against the simulator with the quick settings from
+    simulator.SCRIPTS updated by config, and returns its timing breakdown.
+    """
+    here  = os.path.dirname(os.path.abspath(__file__))
+    timer = PhaseTimer()
+    restore = instrument(timer)
+
+    t0 = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_script(os.path.join(here, script), simulate=True, **dict(SCRIPTS[script], **config))
+    finally:
+        elapsed = time.perf_counter() - t0
+        restore()
+
+    result = timer.result(elapsed)
+    result.update({"script" : os.path.basename(script), "config" : config})
+    return result
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+if __name__ == '__main__':
+    output = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else
+                             'benchmark_' + datetime.now().strftime("%Y%m%d_%H%M%S") + '.json')
+
+    import matplotlib.pyplot as plt
+    os.chdir(tempfile.mkdtemp())
+
+    results = []
+    for script, configs in CONFIGS.items():
+        for config in configs:
+            result = benchmark(script, config)
+            results.append(result)
+            plt.close('all')
+
+            split = ', '.join("%s %.2f" % (phase, t) for phase, t in result["per_point"].items())
+            print("%-18s %-30s %6.1f points/min  (s/point: %s)" % (result["script"], json.dumps(config),
+                                                                  result["points_per_minute"], split))
+
+    json.dump({"timestamp" : datetime.now().isoformat(),
+               "commit"    : git_commit(),
+               "python"    : platform.python_version(),
+               "results"   : results}, open(output, 'w'), indent=1)
+    print("Saved", output)
@@ -0,0 +1,89 @@
+"""
+Gaussian broadening by FFT.
+
+Curves are resampled onto a uniform grid fine enough for the narrowest
+sigma, padded with their edge values, convolved in Fourier space with the
+analytic transform of a unit-area Gaussian (for every sigma at once) and
+interpolated back onto the caller's grid, which may be non-uniform (e.g. the
+gate voltage grid obtained by mapping a uniform energy grid through
+V ~ E^2). This is O(N log N) instead of the O(N^2) of np.convolve, and does
+not pull the ends of the curve towards zero.
+
+Usage:
+    Cb = broaden(energy, Ctot, 1e-3)                    # one sigma
+    Cb = broaden(V, Ctot, np.linspace(0.5, 5, 50))      # (50, len(V))
+"""
+import numpy as np
+from scipy.fft import rfft, irfft, rfftfreq, next_fast_len
+
+def _linear_weights(x, x_new):
+    """
+    Indexes and weights interpolating a function of increasing x onto x_new.
+    """
+    k = np.clip(np.searchsorted(x, x_new) - 1, 0, len(x) - 2)
+    t = np.clip((x_new - x[k])/(x[k + 1] - x[k]), 0, 1)
+    return k, t
+
+def broaden(x, y, sigma, points_per_sigma=4, max_points=2**22, sigma_derivative=False):
+    """
+    Convolves y(x) with unit-area Gaussians of width sigma.
+
+    Parameters
+    ----------
+    x       : grid (points,), in any order and not necessarily uniform
+    y       : values (..., points). Leading axes are broadened together
+    sigma   : Gaussian standard deviation(s) in the units of x, a scalar or
+              an array of any shape
+    points_per_sigma : resolution of the uniform grid relative to the
+                       smallest sigma
+    max_points       : upper limit on the size of the uniform grid
+    sigma_derivative : also return the derivative of the broadened curve
+                       with respect to sigma (for fitting)
+
+    Returns
+    -------
+    y_broadened : numpy array of shape sigma.shape + y.shape
+    dy_dsigma   : same shape, only if sigma_derivative
+
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+
+    order = np.argsort(x)
+    xs, ys = x[order], y[..., order]
+
+    # Uniform grid resolving the narrowest Gaussian (and no coarser than the
+    # input grid on average)
+    span = xs[-1] - xs[0]
+    n    = int(min(max(np.ceil(span*points_per_sigma/np.min(sigma)) + 1, len(x)), max_points))
+    xu   = np.linspace(xs[0], xs[-1], n)
+    h    = xu[1] - xu[0]
+
+    k, t = _linear_weights(xs, xu)
+    yu   = ys[..., k]*(1 - t) + ys[..., k + 1]*t
+
+    # Pad with the edge values by 5 sigma to keep the circular convolution
+    # from wrapping around
+    pad = int(np.ceil(5*np.max(sigma)/h))
+    L   = next_fast_len(n + 2*pad, real=True)
+    right = L - n - pad
+    yp  = np.concatenate((np.repeat(yu[..., :1], pad, axis=-1), yu,
+                          np.repeat(yu[..., -1:], right, axis=-1)), axis=-1)
+
+    # Fourier transform of a unit-area Gaussian for every sigma
+    f = rfftfreq(L, h)
+    kernel = np.exp(-0.5*(2*np.pi*f*sigma[..., None])**2)
+    kernel = kernel.reshape(sigma.shape + (1,)*(y.ndim - 1) + (len(f),))
+
+    Y  = rfft(yp, axis=-1)
+    yb = irfft(Y*kernel, n=L, axis=-1)[..., pad:pad + n]
+
+    # Back onto the caller's grid
+    k, t = _linear_weights(xu, x)
+    if(not sigma_derivative):
+        return yb[..., k]*(1 - t) + yb[..., k + 1]*t
+
+    dkernel = -(2*np.pi*f)**2*sigma[..., None].reshape(sigma.shape + (1,)*y.ndim)*kernel
+    db = irfft(Y*dkernel, n=L, axis=-1)[..., pad:pad + n]
+    return yb[..., k]*(1 - t) + yb[..., k + 1]*t, db[..., k]*(1 - t) + db[..., k + 1]*t
@@ -0,0 +1,324 @@
+"""
+Capacitive current model and batch fitting of Ic(Vg).
+
+The graphene quantum capacitance Cq is in series with the geometric
+capacitance of the hBN/SiO2 stack, Cgeo. With the gate coupling alpha = Cgeo/e
+and the carrier density n = alpha*(Vg - V0), Cq/Cgeo = sqrt(|Vg - V0|/u0)
+where u0 = pi*hbar^2*vF^2*Cgeo/(4*e^3), so the measured capacitive current is
+
+    Ic(Vg) = amplitude * [Ctot/Cgeo broadened by a Gaussian of width sigma](Vg - V0)
+
+The unbroadened curve has an integrable cusp at the Dirac point that is much
+narrower than any realistic sigma, so it is averaged analytically over each
+cell of a uniform grid before being broadened by FFT (broadening.py). The
+Jacobian with respect to V0, dhBN, sigma and amplitude is analytic and comes
+out of the same FFT pass.
+
+fit_runs fits every RvsVg.py pickle in a directory (in parallel worker
+processes) and returns a table of V0, dhBN, sigma and amplitude with their
+standard errors, e.g. to follow the Dirac point shift across anneals:
+    python capacitance.py <directory> [table.csv]
+
+ensemble propagates the uncertainty in dhBN, dSiO2 and the two dielectric
+constants by Monte Carlo: thousands of samples of alpha, of the E -> Vg
+mapping and of the broadened total capacitance are evaluated at once as
+(samples x points) arrays and summarised as percentile bands.
+    bands = ensemble(np.linspace(-60, 60, 2001), sigma=1, dhBN=(15e-9, 5e-9))
+    plt.fill_between(bands['Vg'], *bands['Ctot'][[0, -1]])
+"""
+import os
+import sys
+import csv
+import glob
+import pickle
+import numpy as np
+from scipy.optimize import least_squares
+from concurrent.futures import ProcessPoolExecutor
+
+from broadening import broaden
+
+e    = 1.602176634e-19  # Elementary charge (C)
+hbar = 1.054571817e-34  # Reduced Planck constant (J s)
+eps0 = 8.8541878128e-12 # Vacuum permittivity (F/m)
+vF   = 1e6              # Fermi velocity (m/s)
+
+eps_hBN  = 3.5          # Dielectric constant of hBN
+eps_SiO2 = 3.9          # Dielectric constant of SiO2
+dSiO2    = 300e-9       # SiO2 thickness (m)
+
+PARAMETERS = ['V0', 'dhBN', 'sigma', 'amplitude']
+
+# Default (mean, standard deviation) of the stack parameters for ensemble
+UNCERTAINTIES = {'dhBN'     : (15e-9, 5e-9),
+                 'dSiO2'    : (dSiO2, 5e-9),
+                 'eps_hBN'  : (eps_hBN, 0.5),    # Between 3 and 4
+                 'eps_SiO2' : (eps_SiO2, 0.1)}
+
+def geometric_capacitance(dhBN, dSiO2=dSiO2, eps_hBN=eps_hBN, eps_SiO2=eps_SiO2):
+    """
+    Capacitance per unit area of the hBN/SiO2 stack (F/m^2).
+    """
+    return 1/(dhBN/(eps0*eps_hBN) + dSiO2/(eps0*eps_SiO2))
+
+def _dip_integral(u, u0):
+    # Integral from 0 to u of Cgeo/(Cgeo + Cq) = 1/(1 + sqrt(|u|/u0))
+    t = np.sqrt(np.abs(u)/u0)
+    return np.sign(u)*2*u0*(t - np.log1p(t))
+
+def _dip_integral_du0(u, u0):
+    t = np.sqrt(np.abs(u)/u0)
+    return np.sign(u)*(2*(t - np.log1p(t)) - t**2/(1 + t))
+
+def capacitive_current(Vg, V0, dhBN, sigma, amplitude, points=4096, jacobian=False):
+    """
+    Model capacitive current at the gate voltages Vg.
+
+    Parameters
+    ----------
+    Vg        : gate voltages (V)
+    V0        : Dirac point (V)
+    dhBN      : hBN thickness (m)
+    sigma     : Gaussian broadening in gate voltage (V)
+    amplitude : current far from the Dirac point (units of the measurement)
+    points    : minimum number of points in the uniform model grid
+    jacobian  : also return the derivatives with respect to V0, dhBN, sigma
+                and amplitude
+
+    Returns
+    -------
+    Ic : model current at Vg
+    J  : (len(Vg), 4) Jacobian, only if jacobian
+
+    """
+    Vg   = np.asarray(Vg, dtype=float)
+    Cgeo = geometric_capacitance(dhBN)
+    u0   = np.pi*hbar**2*vF**2*Cgeo/(4*e**3)
+
+    # Uniform grid in Vg - V0 reaching 6 sigma past the data, with the cusp
+    # averaged over every cell
+    lo, hi = np.min(Vg) - V0 - 6*sigma, np.max(Vg) - V0 + 6*sigma
+    n  = int(min(max(points, 8*(hi - lo)/sigma), 2**20))
+    u  = np.linspace(lo, hi, n)
+    h  = u[1] - u[0]
+    edges = np.concatenate(([u[0] - h/2], u + h/2))
+    shape = 1 - np.diff(_dip_integral(edges, u0))/h
+
+    if(not jacobian):
+        shape = broaden(u, shape, sigma, points_per_sigma=8)
+        return amplitude*np.interp(Vg - V0, u, shape)
+
+    dshape_du0 = -np.diff(_dip_integral_du0(edges, u0))/h
+    curves, dcurves_dsigma = broaden(u, np.array([shape, dshape_du0]), sigma,
+                                     points_per_sigma=8, sigma_derivative=True)
+    shape, dshape_du0 = curves
+    dshape_dsigma     = dcurves_dsigma[0]
+
+    # dCgeo/ddhBN = -Cgeo^2/(eps0*eps_hBN) and u0 is proportional to Cgeo
+    du0_ddhBN = -u0*Cgeo/(eps0*eps_hBN)
+
+    x  = Vg - V0
+    Ic = amplitude*np.interp(x, u, shape)
+    J  = np.column_stack((-amplitude*np.interp(x, u, np.gradient(shape, h)),
+                          amplitude*np.interp(x, u, dshape_du0)*du0_ddhBN,
+                          amplitude*np.interp(x, u, dshape_dsigma),
+                          np.interp(x, u, shape)))
+    return Ic, J
+
+def fit_Ic(Vg, Ic, V0=None, dhBN=15e-9, sigma=None, amplitude=None, bounds=None):
+    """
+    Least-squares fit of capacitive_current to a measured Ic(Vg).
+
+    Parameters
+    ----------
+    Vg, Ic : measured gate voltages and current
+    V0, dhBN, sigma, amplitude : initial guesses. None guesses from the data
+    bounds : dictionary of (lower, upper) bounds by parameter name
+
+    Returns
+    -------
+    result : dictionary with every parameter, its standard error
+             (parameter + '_err'), the reduced chi square ('chi2') and
+             whether the fit converged ('success')
+
+    """
+    Vg, Ic = np.asarray(Vg, dtype=float), np.asarray(Ic, dtype=float)
+    scale  = np.max(np.abs(Ic))
+    y      = Ic/scale
+    span   = np.ptp(Vg)
+
+    # The far-from-Dirac level sets the sign, the dip sets V0
+    if(amplitude is None): amplitude = scale*np.median(y[np.abs(y) >= np.percentile(np.abs(y), 75)])
+    if(V0 is None):    V0 = Vg[np.argmin(y*np.sign(amplitude))]
+    if(sigma is None): sigma = span/20
+
+    # Fit dhBN in nm and the amplitude normalised, so the parameters are O(1)
+    units = np.array([1, 1e-9, 1, scale])
+    limits = {'V0'        : (np.min(Vg) - span, np.max(Vg) + span),
+              'dhBN'      : (1e-9, 200e-9),
+              'sigma'     : (span/1e3, 2*span),
+              'amplitude' : (-np.inf, np.inf)}
+    limits.update(bounds or {})
+    lower = np.array([limits[p][0] for p in PARAMETERS])/units
+    upper = np.array([limits[p][1] for p in PARAMETERS])/units
+    p0    = np.clip(np.array([V0, dhBN, sigma, amplitude])/units, lower, upper)
+
+    def residuals(p):
+        return capacitive_current(Vg, *(p*units))/scale - y
+
+    def jacobian(p):
+        return capacitive_current(Vg, *(p*units), jacobian=True)[1]*units/scale
+
+    fit = least_squares(residuals, p0, jac=jacobian, bounds=(lower, upper), x_scale='jac')
+
+    dof  = max(len(y) - len(p0), 1)
+    chi2 = 2*fit.cost/dof
+    try:
+        cov = np.linalg.inv(fit.jac.T @ fit.jac)*chi2
+        err = np.sqrt(np.diag(cov))*units
+    except np.linalg.LinAlgError:
+        err = np.full(len(p0), np.nan)
+
+    result = {'success' : bool(fit.success), 'chi2' : float(chi2)}
+    for p, name in enumerate(PARAMETERS):
+        result[name]          = float(fit.x[p]*units[p])
+        result[name + '_err'] = float(err[p])
+    return result
+
+def ensemble(Vg, sigma=None, energy=None, samples=4000, percentiles=(2.5, 50, 97.5), seed=None, **uncertainties):
+    """
+    Monte Carlo propagation of the stack uncertainties through the
+    gate-coupling model, vectorised over samples.
+
+    Parameters
+    ----------
+    Vg          : uniform gate voltage grid (V) for the total capacitance
+    sigma       : Gaussian broadening in gate voltage (V). None: unbroadened
+    energy      : energies (eV) at which to map E -> Vg. None skips the mapping
+    samples     : number of Monte Carlo samples
+    percentiles : percentiles reported for every quantity
+    seed        : seed for the random generator
+    uncertainties : (mean, standard deviation) of any of dhBN, dSiO2,
+                    eps_hBN and eps_SiO2, overriding UNCERTAINTIES. Samples
+                    are normal, clipped at 1% of the mean
+
+    Returns
+    -------
+    bands : dictionary with
+            'alpha'   : (percentiles,) gate coupling (carriers/m^2/V)
+            'Cgeo'    : (percentiles,) geometric capacitance (F/m^2)
+            'Vg'      : the gate voltage grid
+            'Ctot'    : (percentiles, len(Vg)) total capacitance (F/m^2)
+            'energy'  : the energies, if given
+            'V'       : (percentiles, len(energy)) gate voltage putting the
+                        Fermi level at each energy, if energy is given
+            'samples' : dictionary of the sampled stack parameters and alpha
+
+    """
+    rng = np.random.default_rng(seed)
+    parameters = dict(UNCERTAINTIES)
+    parameters.update(uncertainties)
+
+    drawn = {}
+    for name, (mean, std) in parameters.items():
+        drawn[name] = np.maximum(rng.normal(mean, std, samples), 0.01*mean)
+
+    Cgeo  = geometric_capacitance(drawn['dhBN'], drawn['dSiO2'], drawn['eps_hBN'], drawn['eps_SiO2'])
+    alpha = Cgeo/e
+    u0    = np.pi*hbar**2*vF**2*Cgeo/(4*e**3)
+    drawn['alpha'] = alpha
+
+    bands = {'alpha' : np.percentile(alpha, percentiles),
+             'Cgeo'  : np.percentile(Cgeo, percentiles),
+             'samples' : drawn}
+
+    # Ctot = Cgeo*Cq/(Cgeo + Cq) for every sample at once, averaged over the
+    # cells of the uniform grid so the cusp at the Dirac point is not aliased
+    Vg = np.asarray(Vg, dtype=float)
+    h  = Vg[1] - Vg[0]
+    edges = np.concatenate(([Vg[0] - h/2], Vg + h/2))
+    Ctot  = Cgeo[:, None]*(1 - np.diff(_dip_integral(edges[None, :], u0[:, None]), axis=1)/h)
+    if(sigma):
+        Ctot = broaden(Vg, Ctot, sigma)
+    bands['Vg']   = Vg
+    bands['Ctot'] = np.percentile(Ctot, percentiles, axis=0)
+
+    if(energy is not None):
+        # n = (E/hbar vF)^2/pi and Vg = n/alpha, signed by the carrier type
+        energy = np.asarray(energy, dtype=float)
+        n = (energy*e/(hbar*vF))**2/np.pi
+        V = np.sign(energy)*n[None, :]/alpha[:, None]
+        bands['energy'] = energy
+        bands['V']      = np.percentile(V, percentiles, axis=0)
+
+    return bands
+
+def fit_file(filename, x_key='vg', y_key='dmx', **kwargs):
+    """
+    Fits the Ic(Vg) stored in one pickle (by default an RvsVg.py run, with
+    the lock-in X channel as Ic).
+    """
+    experiment = pickle.load(open(filename, 'rb'))
+    Vg = np.asarray(experiment[x_key], dtype=float)
+    Ic = np.asarray(experiment[y_key], dtype=float)
+
+    keep = np.isfinite(Vg) & np.isfinite(Ic)
+    result = {'file' : os.path.basename(filename)}
+    try:
+        result.update(fit_Ic(Vg[keep], Ic[keep], **kwargs))
+    except Exception as error:
+        result.update({'success' : False, 'error' : repr(error)})
+    return result
+
+def fit_runs(files, x_key='vg', y_key='dmx', workers=None, **kwargs):
+    """
+    Fits many pickles in parallel worker processes.
+
+    Parameters
+    ----------
+    files   : list of pickles, or a directory (every .pk and .pkl in it)
+    workers : number of processes (default: one per CPU). 1 fits in this
+              process. On Windows, call this from under
+              if __name__ == '__main__' when using more than one process
+
+    Returns
+    -------
+    table : list of result dictionaries (see fit_Ic), one per file, in file
+            name order (i.e. acquisition order for timestamped runs)
+
+    """
+    if(isinstance(files, str)):
+        files = glob.glob(os.path.join(files, '*.pk')) + glob.glob(os.path.join(files, '*.pkl'))
+    files = sorted(files, key=os.path.basename)
+
+    if(workers == 1):
+        return [fit_file(f, x_key, y_key, **kwargs) for f in files]
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(fit_file, f, x_key, y_key, **kwargs) for f in files]
+        return [future.result() for future in futures]
+
+def write_table(table, filename):
+    """
+    Writes fit_runs results to a csv file.
+    """
+    columns = ['file', 'success', 'chi2']
+    for name in PARAMETERS: columns += [name, name + '_err']
+    columns += sorted(set(key for row in table for key in row) - set(columns))
+
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(table)
+
+if __name__ == '__main__':
+    path   = sys.argv[1] if len(sys.argv) > 1 else '.'
+    output = sys.argv[2] if len(sys.argv) > 2 else os.path.join(path, 'Ic_fits.csv')
+
+    table = fit_runs(path)
+    write_table(table, output)
+    for row in table:
+        if(row['success']):
+            print("%-70s V0 = %7.3f +/- %.3f V, dhBN = %5.1f nm, sigma = %.3f V" % (row['file'], row['V0'], row['V0_err'], row['dhBN']*1e9, row['sigma']))
+        else:
+            print("%-70s failed %s" % (row['file'], row.get('error', '')))
+    print("Saved", output)
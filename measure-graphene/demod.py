@@ -0,0 +1,189 @@
+"""
+Software lock-in.
+
+Demodulates a buffered block of a raw signal (e.g. from the Oscilloscope
+2-Channels, see acquisition.read_block) at the lock-in frequency and any
+number of its harmonics in one vectorised pass. The low-pass filter is a
+cascade of order RC stages with the given bandwidth, applied as a weighting
+of the block, so one block read gives the output the hardware demodulator
+would settle to, plus the 2f, 3f... components.
+
+If the modulation itself is recorded alongside the signal (e.g. on the
+second oscilloscope channel) it is used as the phase reference, otherwise
+phases are relative to the start of the block.
+
+Amplitudes follow the Nanonis demodulator convention: a signal
+A*sin(2*pi*f*t + phi) gives R = A, X = A*cos(phi), Y = A*sin(phi).
+
+optimal_phase finds the rotation of X/Y (over a whole sweep, or many sweeps
+at once) that puts as much of the signal as possible in phase, so the phase
+no longer has to be picked by hand. PhaseTracker does the same point by point
+during acquisition.
+"""
+import numpy as np
+from scipy.special import gammaincc
+
+def filter_weights(n, dt, bandwidth=None, order=1):
+    """
+    Weights applied to the mixed-down samples of a block.
+
+    Parameters
+    ----------
+    n         : number of samples in the block
+    dt        : time between samples (s)
+    bandwidth : -3 dB bandwidth of the low-pass filter (Hz). None averages the
+                whole block uniformly
+    order     : number of RC stages
+
+    Returns
+    -------
+    weights : numpy array of n weights summing to 1. The last sample is the
+              most recent
+
+    """
+    if(bandwidth is None): return np.full(n, 1/n)
+
+    # Time constant giving a -3 dB point at bandwidth for order stages
+    tau = np.sqrt(2**(1/order) - 1)/(2*np.pi*bandwidth)
+
+    # Impulse response of order cascaded RC stages, integrated over each
+    # sample period, looking back from the end of the block
+    edges   = np.arange(n + 1)[::-1]*dt/tau
+    weights = np.diff(gammaincc(order, edges))
+
+    return weights/np.sum(weights)
+
+def demodulate(samples, dt, frequency, harmonics=(1,), bandwidth=None, order=1, reference=None):
+    """
+    Demodulates every channel of a block of samples at every harmonic.
+
+    Parameters
+    ----------
+    samples   : numpy array of shape (samples,) or (samples, channels)
+    dt        : time between samples (s)
+    frequency : lock-in frequency (Hz)
+    harmonics : harmonics of frequency to demodulate at
+    bandwidth : low-pass filter bandwidth (Hz). None averages the whole
+                block, trimmed to a whole number of periods
+    order     : low-pass filter order
+    reference : the modulation sampled alongside samples (shape (samples,)).
+                Phases are measured relative to it. None measures them
+                relative to the start of the block
+
+    Returns
+    -------
+    X, Y, R, phase : numpy arrays of shape (len(harmonics), channels) or
+                     (len(harmonics),) for a single channel. phase in degrees
+
+    """
+    samples   = np.asarray(samples, dtype=float)
+    single    = samples.ndim == 1
+    samples   = samples.reshape(len(samples), -1)
+    harmonics = np.atleast_1d(harmonics)
+
+    if(reference is not None):
+        # Demodulate the reference with the signal so both see the same filter
+        samples = np.column_stack((samples, reference))
+
+    n = len(samples)
+    if(bandwidth is None):
+        # A whole number of periods rejects the other harmonics exactly
+        periods = int(n*dt*frequency)
+        if(periods > 0): n = int(round(periods/(dt*frequency)))
+        samples = samples[-n:]
+
+    t = np.arange(n)*dt
+    w = filter_weights(n, dt, bandwidth, order)
+    samples = samples - np.sum(w[:,None]*samples, axis=0)
+
+    # (harmonics, samples) references mixed with (samples, channels)
+    mixer = 2*w*np.exp(-2j*np.pi*frequency*np.outer(harmonics, t))
+    Z = 1j*(mixer @ samples)
+
+    if(reference is not None):
+        # Rotate harmonic h by h times the reference phase at the fundamental,
+        # whichever harmonics were asked for
+        ref = 1j*np.sum(2*w*np.exp(-2j*np.pi*frequency*t)*samples[:, -1])
+        rotation = np.exp(-1j*harmonics*np.angle(ref))
+        Z = Z[:, :-1]*rotation[:, None]
+
+    X, Y = Z.real, Z.imag
+    R, phase = np.abs(Z), np.rad2deg(np.angle(Z))
+
+    if(single): return X[:,0], Y[:,0], R[:,0], phase[:,0]
+    return X, Y, R, phase
+
+def optimal_phase(X, Y, centre=False, axis=-1):
+    """
+    Phase rotation maximising the in-phase signal (equivalently, minimising
+    the quadrature) over a sweep: the principal axis of the X/Y points.
+
+    Parameters
+    ----------
+    X, Y   : lock-in X and Y, any shape. NaNs are ignored, so sweeps of
+             different lengths can be stacked NaN-padded
+    centre : subtract the mean first, maximising the variation of the
+             in-phase signal along the sweep rather than its magnitude (e.g.
+             to reject a constant crosstalk background)
+    axis   : sweep axis. The other axes are independent sweeps
+
+    Returns
+    -------
+    phase : numpy array (degrees) in (-180, 180]. Rotating by it (see rotate)
+            leaves the in-phase signal positive on average
+
+    """
+    X, Y = np.asarray(X, dtype=float), np.asarray(Y, dtype=float)
+    if(centre):
+        X = X - np.nanmean(X, axis=axis, keepdims=True)
+        Y = Y - np.nanmean(Y, axis=axis, keepdims=True)
+    return _phase(np.nansum(X*X, axis=axis), np.nansum(Y*Y, axis=axis), np.nansum(X*Y, axis=axis),
+                  np.nansum(X, axis=axis), np.nansum(Y, axis=axis))
+
+def _phase(Sxx, Syy, Sxy, Sx, Sy):
+    theta = 0.5*np.arctan2(2*Sxy, Sxx - Syy)
+
+    # The principal axis is only defined modulo 180 degrees
+    flip  = Sx*np.cos(theta) + Sy*np.sin(theta) < 0
+    theta = np.where(flip, theta + np.pi, theta)
+    return np.rad2deg(np.angle(np.exp(1j*theta)))
+
+def rotate(X, Y, phase):
+    """
+    Rotates lock-in X/Y by phase (degrees, broadcast against X and Y), so a
+    signal at that phase ends up entirely in X.
+
+    Returns
+    -------
+    X, Y : in-phase and quadrature components after the rotation
+
+    """
+    c, s = np.cos(np.deg2rad(phase)), np.sin(np.deg2rad(phase))
+    return X*c + Y*s, Y*c - X*s
+
+class PhaseTracker:
+    """
+    Running optimal_phase for use during acquisition: keeps the sums over
+    the points so far, so each update is O(1).
+    """
+    def __init__(self):
+        self.sums = np.zeros(5)    # Sxx, Syy, Sxy, Sx, Sy
+
+    def add(self, X, Y):
+        """
+        Adds one or more points. NaNs are skipped.
+        """
+        X, Y = np.ravel(X).astype(float), np.ravel(Y).astype(float)
+        keep = np.isfinite(X) & np.isfinite(Y)
+        X, Y = X[keep], Y[keep]
+        self.sums += [np.sum(X*X), np.sum(Y*Y), np.sum(X*Y), np.sum(X), np.sum(Y)]
+
+    @property
+    def phase(self):
+        """
+        Optimal phase (degrees) over the points added so far.
+        """
+        return float(_phase(*self.sums))
+
+    def rotate(self, X, Y):
+        return rotate(X, Y, self.phase)
@@ -7,6 +7,8 @@ Created on Tue Aug 13 16:11:47 2024
 import numpy as np
 import matplotlib.pyplot as plt
 
+from broadening import broaden
+
 pi = np.pi
 e = 1.6e-19
 hbar = 4.14e-15/(2*pi)
@@ -34,19 +36,10 @@ Cox_uFcm2 = Cox * 1e6 * 1e-4
 Ctot_uFcm2 = 1 / ( 1/(Cox_uFcm2) + 1/(Cqm_uFcm2) )
 
 
-# Function to create a Gaussian
-def gaussian(x, mu, sigma):
-    return np.exp(-(x - mu)**2 / (2 * sigma**2))
-
-
 sigma = 1e-3
-gaussian_broadening = gaussian(energy, 0, sigma)
 
-# Normalize Gaussian to ensure total area is 1
-gaussian_broadening /= np.sum(gaussian_broadening)
-
-# Convolve total capacitance with Gaussian
-Ctot_broadened = np.convolve(Ctot_uFcm2, gaussian_broadening, mode='same')
+# Convolve total capacitance with a unit-area Gaussian (FFT, see broadening.py)
+Ctot_broadened = broaden(energy, Ctot_uFcm2, sigma)
 
 
 plt.plot(energy,Ctot_uFcm2)
@@ -61,36 +54,25 @@ dhBN       = 15e-9   # hBN thicknesn gs
 dSiO2      = 300e-9  # SiO2 thickness
 unc        = 5e-9    # Uncertainty in dhBN
 
-# Constants
-hbar = 6.5821e-16
-eps0 = 1.85e-12
-pi   = np.pi
-e    = 1.6e-19
-gv   = 2
-
-# Calculate the capacitance based on all of the constants
-C  = 1/(dhBN/(eps0*eps_hBN) + dSiO2/(eps0*eps_SiO2))
-Cl = 1/((dhBN+unc)/(eps0*eps_hBN) + dSiO2/(eps0*eps_SiO2))  # Lower-bound error
-Cu = 1/((dhBN-unc)/(eps0*eps_hBN) + dSiO2/(eps0*eps_SiO2))  # Lower-bound error
+# Propagate the uncertainty in every stack parameter (not just dhBN) by Monte
+# Carlo: percentile bands of alpha, of the E -> V mapping and of the broadened
+# capacitance (see capacitance.ensemble). The central curve and its bands all
+# come from this one model (SI constants)
+from capacitance import ensemble
+bands = ensemble(np.linspace(-100, 100, 4001), sigma=1, energy=energy,
+                 dhBN=(dhBN, unc), dSiO2=(dSiO2, 5e-9),
+                 eps_hBN=(eps_hBN, 0.5), eps_SiO2=(eps_SiO2, 0.1))
 
-# Calculate the gate-coupling constant, alpha
-alpha   = C/e
-alpha_l = Cl/e
-alpha_u = Cu/e
+# Gate-coupling constant, alpha (median), with its 95% interval
+alpha_l, alpha, alpha_u = bands['alpha']
+print("alpha = %.3g (%.3g to %.3g) /m^2/V" % (alpha, alpha_l, alpha_u))
 
-sqrt = energy/(hbar * vF)
-V = sqrt**2 / (pi * alpha)
-V[energy<0] = -V[energy<0]
-
-sigma = 1
-gaussian_broadening = gaussian(V, 0, sigma)
-
-# Normalize Gaussian to ensure total area is 1
-gaussian_broadening /= np.sum(gaussian_broadening)
-
-# Convolve total capacitance with Gaussian
-Ctot_broadened = np.convolve(Ctot_uFcm2, gaussian_broadening, mode='same')
+# Gate voltage putting the Fermi level at each energy
+V = bands['V'][1]
 
+# Total capacitance broadened by a Gaussian of 1 V in gate voltage (uF/cm^2)
 plt.figure()
-plt.plot(V,Ctot_broadened)
-plt.xlim([-100,100])
\ No newline at end of file
+plt.fill_between(bands['Vg'], bands['Ctot'][0]*1e2, bands['Ctot'][-1]*1e2, alpha=0.3)
+plt.plot(bands['Vg'], bands['Ctot'][1]*1e2)
+plt.xlim([-100,100])
+plt.show()
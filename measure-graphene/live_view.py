@@ -0,0 +1,248 @@
+"""
+Live plotting for sweeps.
+
+The plot runs in its own process (a separate Python interpreter started with
+subprocess, so the sweep script is never re-imported and the GUI has its own
+main thread). The sweep hands points to LiveView.add, which only puts them
+on a queue; a sender thread forwards whatever has queued up to the viewer in
+one message, so neither a slow window nor a closed one can hold up the
+measurement loop.
+
+The viewer redraws at most fps times per second and only redraws the artists
+that changed (blitting), doing a full redraw only when the axes have to be
+rescaled.
+
+Usage:
+    live = LiveView([['Rg'], ['X', 'Y']], xlim=(Vgi, Vgf))
+    ...for each gate voltage...
+    live.add(Vg=Vg, Rg=Rg, X=dmx, Y=dmy)
+    live.close()        # The window stays open until closed
+
+For a growing (Vg, Vb) map, add a 'map' panel and send each row with its bias
+grid:
+    live = LiveView([['map']], xlim=(Vgi, Vgf), rows=N)
+    live.add(Vg=Vg, map=dIdV_row, bias=bias)
+"""
+import os
+import sys
+import time
+import queue
+import secrets
+import threading
+import subprocess
+import numpy as np
+from multiprocessing.connection import Listener, Client
+
+class LiveView:
+    def __init__(self, panels, x='Vg', xlim=None, rows=None, fps=10, title=None, backend=None):
+        """
+        Starts the viewer process.
+
+        Parameters
+        ----------
+        panels  : list of panels, each a list of the keys plotted against x
+                  in it, or ['map'] for the (x, bias) map
+        x       : key of the x axis
+        xlim    : x range. None follows the data
+        rows    : number of map rows across xlim (the map panel needs both)
+        fps     : maximum redraws per second
+        title   : window title
+        backend : matplotlib backend for the viewer. None uses this process'
+                  backend unless it is non-interactive or inline, in which
+                  case matplotlib picks one
+
+        """
+        if(backend is None):
+            import matplotlib
+            backend = matplotlib.get_backend()
+            if('inline' in backend.lower() or backend.lower() in ['pdf', 'ps', 'svg', 'cairo']): backend = None
+
+        self.config = {'panels' : panels, 'x' : x, 'xlim' : xlim, 'rows' : rows,
+                       'fps' : fps, 'title' : title, 'backend' : backend}
+        self.queue  = queue.Queue()
+        self.dropped = False    # Set if the viewer went away; points are then discarded
+
+        authkey = secrets.token_bytes(16)
+        self.listener = Listener(('localhost', 0), authkey=authkey)
+        self.process  = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                          str(self.listener.address[1]), authkey.hex()])
+
+        self.sender = threading.Thread(target=self._send, daemon=True)
+        self.sender.start()
+
+    def _send(self):
+        try:
+            connection = self.listener.accept()
+            connection.send(self.config)
+            while(True):
+                batch = [self.queue.get()]
+                while(True):
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                closing = batch[-1] is None
+                points  = [point for point in batch if point is not None]
+                if(points): connection.send(points)
+                if(closing): break
+            connection.send(None)
+            connection.close()
+        except (OSError, EOFError):
+            self.dropped = True
+        finally:
+            self.listener.close()
+
+    def add(self, **point):
+        """
+        Queues one point (x and any plotted keys) for the viewer. Never blocks.
+        """
+        if(not self.dropped): self.queue.put(point)
+
+    def close(self, timeout=5):
+        """
+        Sends everything still queued and disconnects. The window stays open.
+        """
+        self.queue.put(None)
+        self.sender.join(timeout)
+
+class _Viewer:
+    def __init__(self, config):
+        import matplotlib
+        if(config['backend']): matplotlib.use(config['backend'])
+        import matplotlib.pyplot as plt
+        self.plt = plt
+
+        self.config = config
+        self.x      = config['x']
+        self.data   = {}
+        self.lines  = {}
+        self.image  = None
+        self.scaled = set()     # Axes whose limits have been set from the data
+        self.map    = None
+        self.bias   = None
+
+        panels = config['panels']
+        self.fig, axes = plt.subplots(1, len(panels), figsize=(5*len(panels), 4), squeeze=False)
+        self.axes = list(axes[0])
+        if(config['title']): self.fig.canvas.manager.set_window_title(config['title'])
+
+        for ax, keys in zip(self.axes, panels):
+            ax.set_xlabel(self.x)
+            if(keys == ['map']):
+                self.map_ax = ax
+                ax.set_ylabel('bias')
+                continue
+            for key in keys:
+                self.lines[key], = ax.plot([], [], marker='.', label=key, animated=True)
+            if(config['xlim']): ax.set_xlim(config['xlim'])
+            ax.legend(loc='upper right')
+
+        self.fig.tight_layout()
+        self.background = None
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+        plt.show(block=False)
+        self.fig.canvas.draw()
+
+    def _on_draw(self, event):
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_artists()
+
+    def _artists(self):
+        return list(self.lines.values()) + ([self.image] if self.image is not None else [])
+
+    def _draw_artists(self):
+        for artist in self._artists():
+            artist.axes.draw_artist(artist)
+
+    def add(self, points):
+        for point in points:
+            for key, value in point.items():
+                if(key in [self.x, 'map', 'bias']): continue
+                x, y = self.data.setdefault(key, ([], []))
+                x.append(point[self.x])
+                y.append(value)
+            if('map' in point): self._add_row(point)
+
+    def _add_row(self, point):
+        xlim, rows = self.config['xlim'], self.config['rows']
+        if(self.map is None):
+            self.bias = np.asarray(point['bias'])
+            self.map  = np.full((rows, len(self.bias)), np.nan)
+            self.image = self.map_ax.imshow(self.map.T, origin='lower', aspect='auto', animated=True,
+                                            extent=(xlim[0], xlim[1], self.bias[0], self.bias[-1]))
+            self.fig.canvas.draw()
+        row = int(round((point[self.x] - xlim[0])/(xlim[1] - xlim[0])*(rows - 1)))
+        self.map[min(max(row, 0), rows - 1)] = point['map']
+
+    def _limits_changed(self):
+        for key, line in self.lines.items():
+            if(key in self.data): line.set_data(*self.data[key])
+
+        # Grow the limits of any axes the data has left (or that has not
+        # been scaled yet) by 10% more than needed, so rescaling is rare
+        changed = False
+        for ax in set(line.axes for line in self.lines.values()):
+            x = np.concatenate([np.asarray(line.get_xdata(), dtype=float) for line in ax.lines])
+            y = np.concatenate([np.asarray(line.get_ydata(), dtype=float) for line in ax.lines])
+            finite = np.isfinite(x) & np.isfinite(y)
+            if(not np.any(finite)): continue
+            for (lo, hi), get, put, fixed in [((np.min(y[finite]), np.max(y[finite])), ax.get_ylim, ax.set_ylim, False),
+                                              ((np.min(x[finite]), np.max(x[finite])), ax.get_xlim, ax.set_xlim, bool(self.config['xlim']))]:
+                if(fixed): continue
+                current = get()
+                if(ax in self.scaled and current[0] <= lo and hi <= current[1]): continue
+                if(ax in self.scaled): lo, hi = min(lo, current[0]), max(hi, current[1])
+                margin = 0.1*((hi - lo) or abs(hi) or 1)
+                put(lo - margin, hi + margin)
+                changed = True
+            self.scaled.add(ax)
+
+        if(self.image is not None):
+            # The colour scale lives in the image, so it needs no full redraw
+            self.image.set_data(self.map.T)
+            if(np.any(np.isfinite(self.map))):
+                self.image.set_clim(np.nanmin(self.map), np.nanmax(self.map))
+        return changed
+
+    def redraw(self):
+        if(self._limits_changed() or self.background is None):
+            self.fig.canvas.draw()  # Recaptures the background via draw_event
+        else:
+            self.fig.canvas.restore_region(self.background)
+            self._draw_artists()
+            self.fig.canvas.blit(self.fig.bbox)
+        self.fig.canvas.flush_events()
+
+    def run(self, connection):
+        # Without a window (e.g. the Agg backend) there is nothing to keep
+        # open once the sweep has disconnected
+        window = self.fig.canvas.required_interactive_framework is not None
+        period = 1/self.config['fps']
+        connected = True
+        while(self.plt.fignum_exists(self.fig.number) and (connected or window)):
+            t0 = time.perf_counter()
+            changed = False
+            try:
+                while(connected and connection.poll()):
+                    points = connection.recv()
+                    if(points is None):
+                        connected = False
+                        break
+                    self.add(points)
+                    changed = True
+            except (OSError, EOFError):
+                connected = False
+
+            if(changed): self.redraw()
+            remaining = period - (time.perf_counter() - t0)
+            if(remaining > 0): self.fig.canvas.start_event_loop(remaining)
+
+def _main(port, authkey):
+    connection = Client(('localhost', port), authkey=bytes.fromhex(authkey))
+    config = connection.recv()
+    viewer = _Viewer(config)
+    viewer.run(connection)
+    connection.close()
+
+if __name__ == '__main__':
+    _main(int(sys.argv[1]), sys.argv[2])
@@ -0,0 +1,147 @@
+"""
+Lock-in phase optimisation over archives of runs.
+
+Loads the lock-in X/Y of every run in a directory (RvsVg.py 'dmx'/'dmy' or
+transport1.py 'dmodX_values'/'dmodY_values'), stacks them NaN-padded into one
+(runs x points) array and finds the phase of every run at once with
+demod.optimal_phase. The fitted phase and the rotated X/Y are written next to
+each source file (<file>.phase.npz), keyed by a hash of its contents, so
+reruns only process new runs.
+
+Usage:
+    python lockin_phase.py <directory> [table.csv] [--centre]
+
+    table = phase_runs(directory)
+    derived = load_phase(filename)  # vg, X, Y (rotated), phase
+"""
+import os
+import sys
+import csv
+import glob
+import pickle
+import numpy as np
+
+from demod import optimal_phase, rotate
+from transport_analysis import file_hash
+
+def load_xy(filename):
+    """
+    Reads the gate voltage and lock-in X/Y of a run.
+
+    Returns
+    -------
+    vg, X, Y : numpy arrays in measurement order
+
+    """
+    pk = pickle.load(open(filename, 'rb'))
+    if('dmodX_values' in pk):   # transport1.py
+        return (np.asarray(pk['Vg_range'], dtype=float),
+                np.asarray(pk['dmodX_values'], dtype=float),
+                np.asarray(pk['dmodY_values'], dtype=float))
+    return (np.asarray(pk['vg'], dtype=float),
+            np.asarray(pk['dmx'], dtype=float),
+            np.asarray(pk['dmy'], dtype=float))
+
+def cache_name(filename):
+    return filename + '.phase.npz'
+
+def _cached_row(filename, key):
+    try:
+        with np.load(cache_name(filename)) as f:
+            if(str(f['key']) != key): return None
+            return {'file'       : os.path.basename(filename),
+                    'phase'      : f['phase'].item(),
+                    'quadrature' : f['quadrature'].item()}
+    except (OSError, KeyError, ValueError):
+        return None
+
+def phase_runs(files, centre=False, write=True):
+    """
+    Finds the optimal lock-in phase of every run, vectorised across runs.
+
+    Parameters
+    ----------
+    files  : list of pickles, or a directory (every .pk and .pkl in it)
+    centre : see demod.optimal_phase
+    write  : write <file>.phase.npz for every run processed
+
+    Returns
+    -------
+    table : list of rows, one per file in file name order, with the phase
+            (degrees) and the fraction of the signal power left in
+            quadrature after rotating
+
+    """
+    if(isinstance(files, str)):
+        files = glob.glob(os.path.join(files, '*.pk')) + glob.glob(os.path.join(files, '*.pkl'))
+    files = sorted(files, key=os.path.basename)
+
+    keys  = [file_hash(f, ('phase', centre)) for f in files]
+    table = [_cached_row(f, k) if write else None for f, k in zip(files, keys)]
+
+    runs = {}
+    for n, row in enumerate(table):
+        if(row is not None): continue
+        try:
+            runs[n] = load_xy(files[n])
+        except Exception as error:
+            table[n] = {'file' : os.path.basename(files[n]), 'error' : repr(error)}
+    if(not runs): return table
+
+    # One NaN-padded (runs x points) stack for every stale run
+    width = max(len(vg) for vg, X, Y in runs.values())
+    X = np.full((len(runs), width), np.nan)
+    Y = np.full((len(runs), width), np.nan)
+    for r, (vg, x, y) in enumerate(runs.values()):
+        X[r, :len(x)], Y[r, :len(y)] = x, y
+
+    phase = optimal_phase(X, Y, centre=centre)
+    Xr, Yr = rotate(X, Y, phase[:, None])
+    with np.errstate(invalid='ignore'):
+        quadrature = np.nansum(Yr**2, axis=1)/np.nansum(Xr**2 + Yr**2, axis=1)
+
+    for r, (n, (vg, x, y)) in enumerate(runs.items()):
+        table[n] = {'file'       : os.path.basename(files[n]),
+                    'phase'      : float(phase[r]),
+                    'quadrature' : float(quadrature[r])}
+        if(not write): continue
+        tmp = cache_name(files[n]) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, key=keys[n], vg=vg, X=Xr[r, :len(x)], Y=Yr[r, :len(y)],
+                     phase=phase[r], quadrature=quadrature[r])
+        os.replace(tmp, cache_name(files[n]))
+
+    return table
+
+def load_phase(filename, centre=False):
+    """
+    Returns the derived data of a run (vg, rotated X and Y, phase),
+    processing it first if needed.
+    """
+    if(_cached_row(filename, file_hash(filename, ('phase', centre))) is None):
+        phase_runs([filename], centre)
+    with np.load(cache_name(filename)) as f:
+        return {k : f[k] for k in ['vg', 'X', 'Y', 'phase']}
+
+def write_table(table, filename):
+    """
+    Writes phase_runs results to a csv file.
+    """
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['file', 'phase', 'quadrature', 'error'])
+        writer.writeheader()
+        writer.writerows(table)
+
+if __name__ == '__main__':
+    args   = [a for a in sys.argv[1:] if a != '--centre']
+    path   = args[0] if len(args) > 0 else '.'
+    output = args[1] if len(args) > 1 else os.path.join(path, 'lockin_phase.csv')
+
+    table = phase_runs(path, centre='--centre' in sys.argv)
+    write_table(table, output)
+    for row in table:
+        if('error' in row):
+            print("%-70s failed %s" % (row['file'], row['error']))
+        else:
+            print("%-70s phase %7.1f deg, %.1f%% left in quadrature" % (row['file'], row['phase'], 100*row['quadrature']))
+    print("Saved", output)
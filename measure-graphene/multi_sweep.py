@@ -0,0 +1,162 @@
+"""
+Concurrent gate sweeps of several devices on one chip.
+
+Each device has its own gate source (a Keithley 2400) and its own Nanonis
+signal(s). The devices are stepped together: at every step all the gates are
+ramped at once, one thread per Keithley, then, once the slowest ramp is done
+and the gates have settled, the signals of every device are sampled together
+in the same batched Signals.ValsGet requests over the one shared Nanonis
+connection (only the main thread talks to Nanonis). A step therefore costs
+the slowest device's ramp plus one settle and one read, instead of the sum
+over devices. Devices may have different gate voltage points; a device with
+fewer points simply stops early.
+
+Every device is written to its own run (RunWriter directory plus a final
+<run>.pk pickle laid out like RvsVg.py's), so each can be resumed, plotted or
+analysed (transport_analysis.py) on its own.
+
+Usage:
+    devices = [Device("A", Keithley2400("GPIB::1"),  vgA, [31]),
+               Device("B", Keithley2400("GPIB::25"), vgB, [32])]
+    results = multi_sweep(session, devices, ts=0.5, ns=5, run_name="chip 3")
+"""
+import time
+import pickle
+import numpy as np
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from ramp import ramp_to_voltage
+from acquisition import sample_variance
+from storage import RunWriter
+
+class Device:
+    def __init__(self, name, keithley, vg, channels, Rb=None, dt=0.2, meta=None):
+        """
+        Parameters
+        ----------
+        name     : device name, appended to the run name
+        keithley : gate source (Keithley2400)
+        vg       : gate voltages to visit, in order (V)
+        channels : Nanonis signals (names or indexes) read at every point
+        Rb       : resistor (ohm). If given, Rg = Rb*(first channel) as in
+                   RvsVg.py
+        dt       : time per ramp step (s), as in RvsVg.py
+        meta     : further run parameters to record (e.g. {'Vb' : 50e-3})
+
+        """
+        self.name     = name
+        self.keithley = keithley
+        self.vg       = np.asarray(vg, dtype=float)
+        self.channels = list(channels)
+        self.Rb       = Rb
+        self.dt       = dt
+        self.meta     = dict(meta or {})
+
+    def ramp(self, Vg, steps=10):
+        ramp_to_voltage(self.keithley, Vg, steps, self.dt/2)
+
+def ramp_all(devices, targets, dV=None):
+    """
+    Ramps every device's gate to its target at the same time, one thread per
+    Keithley, in steps of about dV (default: 10 steps each).
+    """
+    with ThreadPoolExecutor(len(devices)) as pool:
+        ramps = []
+        for device, target in zip(devices, targets):
+            steps = 10 if dV is None else max(10*int(abs(target - device.keithley.source_voltage)/dV), 2)
+            ramps.append(pool.submit(device.ramp, target, steps))
+        for ramp in ramps: ramp.result()
+
+def multi_sweep(session, devices, ts=0.5, ns=5, ds=0.02, settle_tol=None, run_name="", experiment=None, callback=None):
+    """
+    Sweeps every device's gate concurrently, sampling all devices together.
+
+    Parameters
+    ----------
+    session    : NanonisSession shared by every device
+    devices    : list of Device
+    ts         : time to settle after each step (s), or the settling timeout
+                 if settle_tol is given
+    ns, ds     : number of samples per point and time between them (s)
+    settle_tol : settle until every device's signals converge to within this
+                 (see NanonisSession.settle) instead of waiting ts
+    run_name   : run name, each device's run is <time>_<run_name> <device>
+    experiment : parameters recorded in every device's run
+    callback   : function(device, point) called after each point is written
+                 (e.g. to feed a LiveView)
+
+    Returns
+    -------
+    results : dictionary of device name -> dictionary of the saved arrays
+
+    """
+    time_string = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S').replace(':','-')
+
+    # Every device's signals in one list, so one request samples all of them
+    channels, columns = [], []
+    for device in devices:
+        columns.append(slice(len(channels), len(channels) + len(device.channels)))
+        channels += device.channels
+
+    runs, results = [], []
+    for device in devices:
+        meta = dict(experiment or {})
+        meta.update(device.meta)
+        meta.update({"device" : device.name, "channels" : device.channels, "Rb" : device.Rb,
+                     "dt" : device.dt, "ts" : ts, "ns" : ns, "ds" : ds, "settleTol" : settle_tol})
+        runs.append(RunWriter(time_string + '_' + run_name + ' ' + device.name, meta))
+
+        n = len(device.vg)
+        results.append(dict(meta, vg=device.vg, means=np.full((n, len(device.channels)), np.nan),
+                            variances=np.full((n, len(device.channels)), np.nan),
+                            settleTimes=np.zeros(n), stepTimes=np.zeros(n)))
+
+    session.refresh_signals()   # Signal indexes as of this sweep
+    steps = max(len(device.vg) for device in devices)
+    with ThreadPoolExecutor(len(devices)) as pool:
+        for n in range(steps):
+            active = [d for d, device in enumerate(devices) if n < len(device.vg)]
+
+            # All the gates at once, one thread per Keithley
+            t0 = time.perf_counter()
+            ramps = [pool.submit(devices[d].ramp, devices[d].vg[n]) for d in active]
+            for ramp in ramps: ramp.result()
+
+            if(settle_tol is not None):
+                settleTime = session.settle(channels, tolerance=settle_tol, timeout=ts)
+            else:
+                time.sleep(ts)
+                settleTime = ts
+
+            # One synchronised reading of every device's signals
+            samples  = session.read(channels, ns=ns, ds=ds)
+            mean     = samples.mean(axis=0)
+            variance = sample_variance(samples)    # NaN with ns = 1
+            stepTime = time.perf_counter() - t0
+
+            for d in active:
+                device, result = devices[d], results[d]
+                result["means"][n]       = mean[columns[d]]
+                result["variances"][n]   = variance[columns[d]]
+                result["settleTimes"][n] = settleTime
+                result["stepTimes"][n]   = stepTime
+
+                point = {"vg"         : device.vg[n],           # Gate voltage
+                         "means"      : mean[columns[d]],       # Mean of each channel
+                         "variances"  : variance[columns[d]],   # Variance of each channel
+                         "settleTime" : settleTime}             # Time spent settling (s)
+                if(device.Rb is not None): point["Rg"] = device.Rb*mean[columns[d]][0]
+                runs[d].append(point)
+                runs[d].checkpoint(vg=device.vg[n])
+                if(callback is not None): callback(device, point)
+
+    output = {}
+    for device, run, result in zip(devices, runs, results):
+        if(device.Rb is not None):
+            result["Rg"]     = device.Rb*result["means"][:, 0]
+            result["Rg_var"] = device.Rb**2*result["variances"][:, 0]
+        run.finish()
+        pickle.dump(result, open(run.path + ".pk", 'wb'))
+        output[device.name] = result
+    return output
@@ -0,0 +1,83 @@
+"""
+Background processing for sweeps.
+
+Work handed to a Pipeline (serialising, reducing and writing the previous
+spectrum) runs in a worker thread while the main loop ramps and settles the
+gate for the next point, so the instrument never waits on Python
+post-processing. Items are processed in the order they were submitted.
+
+Each item is first persisted (process) and only then used for derived work
+(derive), so a failure in the derived work never costs the raw data: after
+the first error every later item is still persisted, and only its derived
+work is skipped.
+
+Usage:
+    pipeline = Pipeline(process, derive=derive)
+    for ...:
+        ...acquire...
+        pipeline.submit(item)
+    pipeline.close()
+
+If the loop fails, close with pipeline.close(raise_error=False) before
+re-raising, so the queued points are still written.
+"""
+import threading
+import queue
+
+class Pipeline:
+    def __init__(self, process, maxsize=0, derive=None):
+        """
+        Parameters
+        ----------
+        process : function called with each submitted item in a worker
+                  thread, to persist it. Called for every item, even after
+                  an error
+        maxsize : maximum number of items waiting (0 = unlimited). submit
+                  blocks when the queue is full
+        derive  : function called with each item after process (reduction,
+                  maps, plots). Skipped for every item after the first error
+
+        """
+        self.process = process
+        self.derive  = derive
+        self.queue   = queue.Queue(maxsize)
+        self.error   = None
+
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def _run(self):
+        while(True):
+            item = self.queue.get()
+            if(item is None): break
+            try:
+                self.process(item)
+                if(self.derive is not None and self.error is None): self.derive(item)
+            except Exception as e:
+                if(self.error is None): self.error = e
+
+    def _raise(self):
+        if(self.error is not None): raise self.error
+
+    def submit(self, item):
+        """
+        Queues an item for processing. Raises the first error from the worker
+        if processing failed; the item is queued (and persisted) regardless.
+        """
+        self.queue.put(item)
+        self._raise()
+
+    def close(self, raise_error=True):
+        """
+        Waits for every queued item to be processed and stops the worker.
+
+        Parameters
+        ----------
+        raise_error : re-raise the first error from the worker. Pass False
+                      when closing because of another exception, so that one
+                      propagates instead
+
+        """
+        self.queue.put(None)
+        self.worker.join()
+        if(raise_error): self._raise()
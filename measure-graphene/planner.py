@@ -0,0 +1,581 @@
+"""
+Run time estimates and ramp planning for gate sweeps.
+
+Every sweep script (transport1.py, RvsVg.py, STS_Vg.py and nanonis_STS_Vg.py)
+has a timing model built from the script's own parameters, either passed in
+by the script or read from it without running it. A sweep is the gate
+voltages it visits, in order; the ramps between them are timed with the same
+staircases the script makes (ramp.py, NanonisSession.ramp_output), and every
+point adds its settle time, the time taken to sample it and any spectrum.
+The model gives the exact ramp schedule the script will make (every
+staircase, its voltages and the delay per step) and the predicted wall-clock
+time. Given a
+maximum slew rate and step size it proposes the fastest setting of the
+script's ramp parameters within those limits, and the fastest schedule
+possible at all (equal steps, as few as the step limit allows, each held
+only as long as the slew limit needs).
+
+The time per sample, the fixed overhead per point and the time per spectrum
+can be calibrated on previous runs: every point of a run directory
+(storage.py) is written as it arrives, so the interval between two point
+files is the time that point took.
+
+Usage:
+    print_plan(predict(sweep_model('transport1.py', globals()), V0=Vg_current))
+
+    python planner.py transport1.py
+    python planner.py STS_Vg.py --connect --max-slew 0.2 --max-step 20e-3
+    python planner.py RvsVg.py --calibrate <run directory> ... --schedule
+"""
+import os
+import ast
+import argparse
+import numpy as np
+
+from ramp import ramp_schedule
+from sweep import snake
+from storage import read_run, point_files
+
+# Timings the models use unless calibrated (s)
+TIMING = {'t_sample'   : 0.05,  # per sample
+          't_point'    : 0.05,  # fixed overhead per point (instrument calls, saving)
+          't_spectrum' : None,  # per bias spectrum (None if unknown)
+          't_step'     : 0}     # overhead per ramp step on top of its delay
+
+def print_plan(plan, label="Sweep"):
+    """
+    Prints an estimate from predict().
+    """
+    total = plan['total']
+    spectrum = ", spectra %.0f s" % plan['spectrum'] if plan.get('spectrum') else ""
+    print("%s: %d points, estimated %s (ramp %.0f s, settle %.0f s, sample %.0f s%s, overhead %.0f s)"
+          % (label, plan['points'], format_time(total), plan['ramp'], plan['settle'], plan['sample'], spectrum, plan['overhead']))
+
+def format_time(seconds):
+    hours, rest = divmod(int(round(seconds)), 3600)
+    minutes, seconds = divmod(rest, 60)
+    if(hours): return "%d h %02d min" % (hours, minutes)
+    if(minutes): return "%d min %02d s" % (minutes, seconds)
+    return "%d s" % seconds
+
+# Staircases as made by ramp.py and session.py: (voltages, delay per step)
+def _linspace_ramp(V_start, V_end, steps, pause):
+    # ramp.ramp_to_voltage
+    return np.linspace(V_start, V_end, steps), pause
+
+def _staircase_ramp(V_start, V_end, step_size, delay):
+    # ramp.ramp_gate_voltage
+    return ramp_schedule(V_start, V_end, step_size), delay
+
+def _output_ramp(V_start, V_end, db, dt):
+    # NanonisSession.ramp_output
+    if(abs(V_end - V_start) < db): return np.array([V_end]), 0
+    vv = np.arange(V_start, V_end, np.sign(V_end - V_start)*db)
+    vv[-1] = V_end
+    return vv, dt
+
+def _recorded(point, key, default):
+    if(point is None or point.get(key) is None): return default
+    return point[key]
+
+class SweepModel:
+    """
+    Timing model of one sweep script, built from the script's parameters.
+
+    Subclasses give:
+        points()            gate voltages in the order they are measured (for
+                            adaptive grids the whole point budget)
+        move(V_start, V_end) ramp from one point to the next: (voltages, delay)
+        start(V0, V_first)  ramps from V0 to the first point: list of
+                            (V_start, voltages, delay)
+        end(V_last)         ramps back to 0 V after the last point, likewise
+        settle(point=None)  fixed waits at every point (s), using the settle
+                            time recorded in a run's point when given one
+    and, where they apply, samples() and wait(). delay names the parameter
+    the ramp delay is proportional to and step the one setting the ramp step
+    size (None when the script fixes the number of steps instead).
+    """
+    script  = None
+    delay   = None
+    step    = None
+    spectra = 0     # Bias spectra per point
+
+    def __init__(self, parameters):
+        self.p = parameters
+
+    def samples(self, point=None):
+        """
+        Samples read at every point and the wait between them (s).
+        """
+        return 0, 0
+
+    def wait(self):
+        """
+        Fixed waits once per run (s).
+        """
+        return 0
+
+class Transport1Sweep(SweepModel):
+    script = 'transport1.py'
+    delay  = 'keithley_step_delay'
+    step   = 'keithley_step_size'
+
+    def points(self):
+        p = self.p
+        if(p.get('map_mode')):
+            Vg = np.linspace(p['Vgi'], p['Vgf'], p['nVg'])
+            return Vg[snake(p['Vb_values'], Vg)[1]]
+        Vg = np.linspace(p['Vgi'], p['Vgf'], p['nVg_max'] if p.get('adaptive_vg') else p['nVg'])
+        if(p.get('back_sweep')): Vg = np.concatenate((Vg, Vg[::-1]))
+        return Vg
+
+    def move(self, V_start, V_end):
+        return _staircase_ramp(V_start, V_end, self.p['keithley_step_size'], self.p['keithley_step_delay'])
+
+    def start(self, V0, V_first):
+        return [(V0, *self.move(V0, V_first))]
+
+    def end(self, V_last):
+        return [(V_last, *self.move(V_last, 0))]
+
+    def settle(self, point=None):
+        return _recorded(point, 'settle_time', self.p['dt'])
+
+    def samples(self, point=None):
+        return _recorded(point, 'dmod_count', self.p['ns']), 0
+
+    def wait(self):
+        return 1    # After the ramp to Vgi
+
+class RvsVgSweep(SweepModel):
+    script = 'RvsVg.py'
+    delay  = 'dt'
+
+    def points(self):
+        p = self.p
+        N = max(p['NCoarse'], p['NMax']) if p.get('adaptiveVg') else int((p['Vgf'] - p['Vgi'])/p['dVg']) + 1
+        return np.linspace(p['Vgi'], p['Vgf'], N)
+
+    def move(self, V_start, V_end):
+        return _linspace_ramp(V_start, V_end, max(10*int(round(abs(V_end - V_start)/self.p['dVg'])), 10), self.p['dt']/2)
+
+    def start(self, V0, V_first):
+        dVg, pause = self.p['dVg'], self.p['dt']/2
+        return [(V0, *_linspace_ramp(V0, 0, 10*abs(int(V0/dVg)), pause)),
+                (0,  *_linspace_ramp(0, V_first, 10*int(abs(self.p['Vgi']/dVg)), pause))]
+
+    def end(self, V_last):
+        return [(V_last, *_linspace_ramp(V_last, 0, 10*int(abs(self.p['Vgf']/self.p['dVg'])), self.p['dt']/2))]
+
+    def settle(self, point=None):
+        return _recorded(point, 'settleTime', self.p['ts'])
+
+    def samples(self, point=None):
+        return _recorded(point, 'nsamples', self.p['ns']), self.p['ds']
+
+class STSVgSweep(SweepModel):
+    script  = 'STS_Vg.py'
+    delay   = 'dt'
+    spectra = 1
+
+    def points(self):
+        p = self.p
+        return np.linspace(p['Vgi'], p['Vgf'], max(p['N'], p['NMax']) if p.get('adaptiveVg') else p['N'])
+
+    def move(self, V_start, V_end):
+        return _linspace_ramp(V_start, V_end, max(10*int(round(abs(V_end - V_start)/self.p['dVg'])), 10), self.p['dt'])
+
+    def start(self, V0, V_first):
+        dVg, dt = self.p['dVg'], self.p['dt']
+        return [(V0, *_linspace_ramp(V0, 0, 10*abs(int(V0/dVg)), dt/10)),
+                (0,  *_linspace_ramp(0, V_first, 10*int(abs(self.p['Vgi']/dVg)), dt))]
+
+    def end(self, V_last):
+        return [(V_last, *_linspace_ramp(V_last, 0, 10*int(abs(self.p['Vgf']/self.p['dVg'])), self.p['dt']))]
+
+    def settle(self, point=None):
+        return _recorded(point, 'settleTime', self.p['ts'])
+
+class NanonisSTSVgSweep(SweepModel):
+    script  = 'nanonis_STS_Vg.py'
+    delay   = 'dt'
+    spectra = 1
+
+    def points(self):
+        p = self.p
+        return np.linspace(p['Vgi'], p['Vgf'], int((p['Vgf'] - p['Vgi'])/p['dVg']) + 1)
+
+    def move(self, V_start, V_end):
+        return _output_ramp(V_start, V_end, 0.01, self.p['dt'])
+
+    def start(self, V0, V_first):
+        return [(V0, *self.move(V0, 0)), (0, *self.move(0, V_first))]
+
+    def end(self, V_last):
+        return [(V_last, *self.move(V_last, 0))]
+
+    def settle(self, point=None):
+        return _recorded(point, 'settleTime', self.p['ts'])
+
+MODELS = {model.script : model for model in [Transport1Sweep, RvsVgSweep, STSVgSweep, NanonisSTSVgSweep]}
+
+def sweep_model(script, parameters):
+    """
+    Timing model of a sweep script (by file name) with the given parameters.
+    """
+    name = os.path.basename(script)
+    if(not name in MODELS):
+        raise Exception("No timing model for " + name + " (known: " + ", ".join(MODELS) + ")")
+    return MODELS[name](parameters)
+
+# Names a parameter expression may use besides earlier parameters
+_SAFE = {'int' : int, 'float' : float, 'abs' : abs, 'min' : min, 'max' : max, 'round' : round,
+         'len' : len, 'True' : True, 'False' : False, 'None' : None}
+
+def _evaluate(node, names):
+    for child in ast.walk(node):
+        if(isinstance(child, ast.Call)):
+            f = child.func
+            numpy = isinstance(f, ast.Attribute) and isinstance(f.value, ast.Name) and f.value.id == 'np'
+            if(not numpy and not (isinstance(f, ast.Name) and f.id in _SAFE)):
+                raise ValueError("call")
+        elif(isinstance(child, ast.Attribute)):
+            if(not (isinstance(child.value, ast.Name) and child.value.id == 'np')): raise ValueError("attribute")
+        elif(isinstance(child, ast.Name)):
+            if(not child.id in names and not child.id in _SAFE): raise ValueError(child.id)
+        elif(isinstance(child, (ast.Lambda, ast.NamedExpr, ast.ListComp, ast.GeneratorExp, ast.DictComp, ast.SetComp))):
+            raise ValueError("expression")
+    try:
+        return eval(compile(ast.Expression(node), '<parameters>', 'eval'), {'__builtins__' : _SAFE}, names)
+    except Exception as error:
+        raise ValueError(str(error))
+
+def read_parameters(script, overrides=None):
+    """
+    Reads the parameters assigned at the top level of a sweep script without
+    running it. Only values that are literals, or arithmetic and numpy calls
+    on earlier parameters, are read (anything that needs the instruments is
+    skipped), and only a name's first assignment counts.
+
+    Parameters
+    ----------
+    script    : path to the script
+    overrides : dictionary of parameters to use instead of the script's
+
+    Returns
+    -------
+    parameters : dictionary of parameter name -> value
+
+    """
+    overrides  = dict(overrides or {})
+    parameters = {}
+    names = {'np' : np}
+    for node in ast.parse(open(script).read()).body:
+        if(not isinstance(node, ast.Assign) or len(node.targets) != 1): continue
+        if(not isinstance(node.targets[0], ast.Name)): continue
+        name = node.targets[0].id
+        if(name in parameters): continue
+        if(name in overrides):
+            value = overrides[name]
+        else:
+            try:
+                value = _evaluate(node.value, names)
+            except ValueError:
+                continue
+        parameters[name] = names[name] = value
+
+    for name, value in overrides.items():
+        parameters.setdefault(name, value)
+    return parameters
+
+def schedule(sweep, V0=0, Vg=None):
+    """
+    The exact ramp schedule of a sweep.
+
+    Parameters
+    ----------
+    sweep : SweepModel
+    V0    : gate voltage before the run (V)
+    Vg    : gate voltages to visit instead of the sweep's own (e.g. to compare
+            another ordering of the same points)
+
+    Returns
+    -------
+    ramps : list of (label, V_start, voltages, delay) in the order the
+            ramps are made: 'start' to the first point, one 'point' ramp
+            per gate point and 'end' back to 0 V. Each voltage is held for
+            delay seconds
+
+    """
+    if(Vg is None): Vg = sweep.points()
+    ramps  = [('start', V_start, v, delay) for V_start, v, delay in sweep.start(V0, Vg[0])]
+    ramps += [('point', a, *sweep.move(a, b)) for a, b in zip(np.append(Vg[0], Vg[:-1]), Vg)]
+    ramps += [('end', V_start, v, delay) for V_start, v, delay in sweep.end(Vg[-1])]
+    return ramps
+
+def predict(sweep, timing=None, V0=0, ramps=None, Vg=None):
+    """
+    Predicts the wall-clock time of a sweep.
+
+    Parameters
+    ----------
+    sweep  : SweepModel
+    timing : timings to use instead of TIMING (e.g. from calibrate())
+    V0     : gate voltage before the run (V)
+    ramps  : ramp schedule to time instead of the sweep's own (see schedule())
+    Vg     : gate voltages to visit instead of the sweep's own
+
+    Returns
+    -------
+    plan : dictionary of the time spent ramping, settling, sampling, on
+           spectra and in overheads, the total (s) and the number of points
+
+    """
+    timing = dict(TIMING, **(timing or {}))
+    if(Vg is None): Vg = sweep.points()
+    if(ramps is None): ramps = schedule(sweep, V0, Vg)
+    n = len(Vg)
+    ns, ds = sweep.samples()
+
+    plan = {'points'   : n,
+            'ramp'     : sum(len(v)*(delay + timing['t_step']) for label, V_start, v, delay in ramps),
+            'settle'   : n*sweep.settle() + sweep.wait(),
+            'sample'   : n*(ns*timing['t_sample'] + max(ns - 1, 0)*ds),
+            'spectrum' : n*sweep.spectra*(timing['t_spectrum'] or 0),
+            'overhead' : n*timing['t_point']}
+    plan['total'] = plan['ramp'] + plan['settle'] + plan['sample'] + plan['spectrum'] + plan['overhead']
+    return plan
+
+def ramp_limits(ramps):
+    """
+    Largest step (V) and fastest slew rate (V/s) in a ramp schedule. Moves
+    made at once (no delay, e.g. ramp_output within one step) count towards
+    the step but not the slew rate.
+    """
+    step, slew = 0, 0
+    for label, V_start, voltages, delay in ramps:
+        if(len(voltages) == 0): continue
+        largest = np.max(np.abs(np.diff(np.append(V_start, voltages))))
+        step = max(step, largest)
+        if(delay > 0): slew = max(slew, largest/delay)
+    return step, slew
+
+def fastest_ramp(V_start, V_end, max_step, max_slew, min_delay=1e-3):
+    """
+    Fastest staircase from V_start to V_end within a step and slew limit:
+    equal steps, as few as max_step allows, each held for as long as
+    max_slew needs (but at least min_delay). The ramp then takes
+    max(|V_end - V_start|/max_slew, steps*min_delay).
+
+    Returns
+    -------
+    voltages : voltages to step through (ends at V_end)
+    delay    : time to hold each one (s)
+
+    """
+    dV = V_end - V_start
+    n  = int(np.ceil(abs(dV)/max_step - 1e-9))
+    if(n == 0): return np.array([]), 0
+    return V_start + dV*np.arange(1, n + 1)/n, max(abs(dV)/n/max_slew, min_delay)
+
+def fastest_schedule(sweep, max_step, max_slew, min_delay=1e-3, V0=0):
+    """
+    The sweep's schedule with every ramp replaced by fastest_ramp().
+    """
+    return [(label, V_start, *fastest_ramp(V_start, v[-1], max_step, max_slew, min_delay)) if len(v) else
+            (label, V_start, v, delay) for label, V_start, v, delay in schedule(sweep, V0)]
+
+def propose(sweep, max_step, max_slew, min_delay=1e-3, V0=0):
+    """
+    Fastest setting of the script's own ramp parameters within a step and
+    slew limit: the step size parameter (if the script has one) goes to
+    max_step and the delay parameter (if the script has one) is scaled until
+    the fastest step is at max_slew, or the shortest delay at min_delay.
+
+    Returns
+    -------
+    changes : dictionary of the ramp parameters to change and their values
+    model   : SweepModel with the proposed parameters
+
+    """
+    parameters = dict(sweep.p)
+    if(sweep.step is not None): parameters[sweep.step] = max_step
+    model = type(sweep)(parameters)
+
+    ramps  = schedule(model, V0)
+    delays = [delay for label, V_start, v, delay in ramps if len(v) and delay > 0]
+    step, slew = ramp_limits(ramps)
+    if(sweep.delay is not None and delays and slew > 0):
+        parameters[sweep.delay] = parameters[sweep.delay]*max(slew/max_slew, min_delay/min(delays))
+
+    changes = {name : parameters[name] for name in [sweep.step, sweep.delay] if name is not None}
+    return changes, type(sweep)(dict(parameters))
+
+def spectrum_time(biasSpec):
+    """
+    Duration of one bias spectrum with the Bias Spectroscopy module's
+    present settings (s): the Z averaging and initial settling, every point
+    of every sweep (settling plus integration, forward and backward), the
+    bias moving across the sweep at the maximum slew rate, then the end
+    settling and Z control time.
+
+    Parameters
+    ----------
+    biasSpec : nanonisTCP BiasSpectr module (NanonisSession.biasSpec)
+
+    """
+    props  = biasSpec.PropsGet()
+    timing = biasSpec.TimingGet()
+    limits = biasSpec.LimitsGet()
+
+    sweeps = max(props['num_sweeps'], 1)*(2 if props['back_sweep'] else 1)
+    slew   = 0
+    if(timing['maximum_slew_rate'] > 0):
+        slew = abs(limits['end_value'] - limits['start_value'])/timing['maximum_slew_rate']
+
+    return (timing['z_averaging_time'] + timing['initial_settling_time']
+            + sweeps*(props['num_points']*(timing['settling_time'] + timing['integration_time']) + slew)
+            + timing['end_settling_time'] + timing['z_control_time'])
+
+def _model_of(meta):
+    # Which script wrote a run, from its parameters
+    if('parameters' in meta): return Transport1Sweep
+    if('biasProps' in meta):  return STSVgSweep
+    if('gateChannel' in meta): return NanonisSTSVgSweep
+    if('Rb' in meta):         return RvsVgSweep     # RvsVg.py and RvsVg_multi.py
+    return None
+
+def calibrate(runs):
+    """
+    Measures the timings of previous runs. The interval between two points
+    being written is the time the later point took; what the model does not
+    account for (its ramp, settle time and waits between samples, as
+    recorded) is fitted as t_sample*samples + t_point for the sampling
+    scripts, or as t_spectrum for the spectroscopy ones. When every point
+    took the same number of samples the two cannot be told apart and it is
+    all put down to the samples.
+
+    Parameters
+    ----------
+    runs : run directories (storage.RunWriter), complete or not
+
+    Returns
+    -------
+    timing : dictionary of script name -> dictionary of timings to pass to
+             predict(), with the number of intervals they were fitted to
+
+    """
+    fits = {}
+    for path in runs:
+        meta, points = read_run(path)
+        model = _model_of(meta)
+        if(model is None or len(points) < 2): continue
+        sweep = model(meta.get('parameters', meta))
+
+        written = np.array([os.path.getmtime(os.path.join(path, 'points', f)) for f in point_files(path)])
+        Vg = [_recorded(point, 'vg', point.get('Vg')) for point in points]
+        for k in range(1, len(points)):
+            voltages, delay = sweep.move(Vg[k - 1], Vg[k])
+            ns, ds = sweep.samples(points[k])
+            modelled = len(voltages)*delay + sweep.settle(points[k]) + max(ns - 1, 0)*ds
+            fits.setdefault(model.script, []).append((written[k] - written[k - 1], written[k] - written[k - 1] - modelled, ns))
+
+    timing = {}
+    for script, rows in fits.items():
+        interval, residual, ns = np.array(rows).T
+        # Drop pauses (e.g. a run resumed later)
+        keep = interval < 3*np.median(interval)
+        residual, ns = residual[keep], ns[keep]
+
+        if(MODELS[script].spectra):
+            timing[script] = {'t_spectrum' : float(np.median(residual)), 't_point' : 0}
+        elif(np.ptp(ns) > 0):
+            t_sample, t_point = np.linalg.lstsq(np.stack((ns, np.ones_like(ns)), axis=1), residual, rcond=None)[0]
+            timing[script] = {'t_sample' : float(t_sample), 't_point' : float(t_point)}
+        else:
+            timing[script] = {'t_sample' : float(np.median(residual)/ns[0]), 't_point' : 0}
+        timing[script]['intervals'] = len(residual)
+    return timing
+
+def print_schedule(ramps):
+    """
+    Prints a ramp schedule, one line per ramp.
+    """
+    for label, V_start, voltages, delay in ramps:
+        if(len(voltages) == 0): continue
+        step = np.max(np.abs(np.diff(np.append(V_start, voltages))))
+        print("  %-5s %7.3f V -> %7.3f V  %4d steps of <= %6.1f mV, %6.3f s each  %7.2f s"
+              % (label, V_start, voltages[-1], len(voltages), step*1e3, delay, len(voltages)*delay))
+
+def _parse_value(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predicts how long a sweep script will take and plans its ramps.")
+    parser.add_argument('script', help="sweep script (" + ", ".join(MODELS) + ")")
+    parser.add_argument('--set', nargs='+', default=[], metavar='NAME=VALUE', help="parameters to use instead of the script's")
+    parser.add_argument('--V0', type=float, default=0, help="gate voltage before the run (V)")
+    parser.add_argument('--max-step', type=float, default=50e-3, help="largest gate step allowed (V)")
+    parser.add_argument('--max-slew', type=float, default=0.5, help="fastest gate slew rate allowed (V/s)")
+    parser.add_argument('--min-delay', type=float, default=1e-3, help="shortest time per ramp step (s)")
+    parser.add_argument('--calibrate', nargs='+', default=[], metavar='RUN', help="run directories to calibrate the timings on")
+    parser.add_argument('--spectrum-time', type=float, help="duration of one bias spectrum (s)")
+    parser.add_argument('--connect', action='store_true', help="read the spectrum duration from Nanonis (the script's IP and PORT)")
+    parser.add_argument('--schedule', action='store_true', help="print every ramp")
+    args = parser.parse_args(argv)
+
+    overrides  = dict((name, _parse_value(value)) for name, value in (item.split('=', 1) for item in args.set))
+    parameters = read_parameters(args.script, overrides)
+    sweep = sweep_model(args.script, parameters)
+    name  = sweep.script
+
+    timing = {}
+    if(args.calibrate):
+        fitted = calibrate(args.calibrate)
+        for script, fit in fitted.items():
+            print("Calibrated %s on %d intervals: " % (script, fit['intervals'])
+                  + ", ".join("%s = %.3f s" % (key, value) for key, value in fit.items() if key != 'intervals'))
+        if(not name in fitted): print("No runs of " + name + " to calibrate on, using the default timings")
+        timing.update(fitted.get(name, {}))
+        timing.pop('intervals', None)
+    if(sweep.spectra and args.connect):
+        from session import NanonisSession
+        session = NanonisSession(parameters['IP'], parameters['PORT'])
+        try:
+            timing['t_spectrum'] = spectrum_time(session.biasSpec)
+        finally:
+            session.close()
+    if(args.spectrum_time is not None): timing['t_spectrum'] = args.spectrum_time
+    if(sweep.spectra and timing.get('t_spectrum') is None):
+        print("Spectrum duration unknown (use --connect, --calibrate or --spectrum-time): spectra not included")
+    elif(sweep.spectra):
+        print("Spectrum duration %.2f s" % timing['t_spectrum'])
+
+    ramps = schedule(sweep, args.V0)
+    step, slew = ramp_limits(ramps)
+    print_plan(predict(sweep, timing, args.V0), name)
+    print("Ramps: steps of up to %.1f mV, slew rate up to %.3g V/s" % (step*1e3, slew))
+    if(args.schedule): print_schedule(ramps)
+
+    limits = "%.1f mV and %.3g V/s" % (args.max_step*1e3, args.max_slew)
+    if(step > args.max_step*(1 + 1e-9) or slew > args.max_slew*(1 + 1e-9)):
+        print("The present ramps exceed the limits of " + limits)
+
+    changes, model = propose(sweep, args.max_step, args.max_slew, args.min_delay)
+    proposed = schedule(model, args.V0)
+    step, slew = ramp_limits(proposed)
+    plan = predict(sweep, timing, args.V0, proposed)
+    print("Fastest within %s: %s" % (limits, ", ".join("%s = %.4g" % item for item in changes.items())))
+    print_plan(plan, "  " + name)
+    if(step > args.max_step*(1 + 1e-9)):
+        print("  (steps of %.1f mV still exceed the step limit: %s fixes the number of steps per ramp)" % (step*1e3, name))
+    if(args.schedule): print_schedule(proposed)
+
+    best = fastest_schedule(sweep, args.max_step, args.max_slew, args.min_delay, args.V0)
+    print_plan(predict(sweep, timing, args.V0, best), "  Equal-step ramps, each as fast as the limits allow")
+
+if __name__ == '__main__':
+    main()
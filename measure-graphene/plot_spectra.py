@@ -1,35 +1,37 @@
 # %%
-import os
-import nanonispy as nap
-from scipy.signal import savgol_filter as savgol
 import matplotlib.pyplot as plt
 import numpy as np
 
+from spectrum_store import SpectrumStore
+from spectra import derivative
+
 path = "C:/Users/jced0001/Development/Data/Device/Graphene device chris gate spectra/"
 sg_pts  = 5
 sg_poly = 1
 Vg = [0, -10, -20, -30, -40, -50, -55, -50, -40, -30, -20, -10, 0, 10, 20, 30, 40, 50, 55, 50, 40, 30, 20, 10, 0, -10, -20, -30, -40, -50, 0, 0, -30, 0]
-start = 19
-stop = 29
+start = 19      # First and last spectrum to plot, in file name order
+stop  = 29
+skip  = [28]    # Spectra to leave out, in file name order
 
-run = np.arange(start=start, stop=stop + 1)
-# run = range(len(Vg))
-I    = []
-Vb   = []
-dIdV = []
-offset = 0.4e-9
-files = os.listdir(path)
-plt.figure()
-for n,file in enumerate(files):
-    if(not n in run): continue
-    if(n == 28): continue
-    dat = nap.read.Spec(path + file).signals
-    Vb.append(dat['Bias calc (V)'])
-    I.append(dat['Current (A)'])
+# Parsed once, then memory-mapped on later runs (new files are added as they appear)
+store = SpectrumStore(path)
 
-    dV = Vb[-1][1] - Vb[-1][0]
-    dIdV.append(savgol(I[-1],sg_pts,sg_poly,deriv=1,delta=dV))
+# Attach the gate voltages to the file names they belong to (the hand-written
+# list is in file name order). If the gate voltage is recorded in the file
+# headers, pass its header key instead, e.g. gate='Output 8 (V)'. Reopening
+# only reads the index
+names = [store.files[i] for i in store.order('name')]
+store = SpectrumStore(path, gate=dict(zip(names, Vg)))
 
-    plt.plot(Vb[-1],dIdV[-1] + n*offset)
-    print(n,Vg[n],file)
+Vb    = store.channel('Bias calc (V)')
+I     = store.channel('Current (A)')
+dIdV  = derivative(I,Vb,sg_pts=sg_pts,sg_poly=sg_poly)   # Every spectrum in one call
+selected = [i for n,i in enumerate(store.order('name')) if start <= n <= stop and not n in skip]
+offset = 0.4e-9
+plt.figure()
+for k,i in enumerate(selected):
+    plt.plot(Vb[i],dIdV[i] + k*offset,label="Vg = %g V" % store.vg[i])
+    print(store.vg[i],store.files[i])
+plt.legend()
+plt.show()
 # %%
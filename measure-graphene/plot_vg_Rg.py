@@ -2,7 +2,7 @@
 import numpy as np
 import pickle
 import matplotlib.pyplot as plt
-from scipy.signal import savgol_filter as savgol
+from transport_analysis import load_analysis
 mplibColours = plt.rcParams['axes.prop_cycle'].by_key()['color']
 
 # Device on SiO2 - this is the same device that the capacitive current was measured on
@@ -18,19 +18,17 @@ ax1 = fig.add_subplot(1,2,1)
 ax2 = fig.add_subplot(1,2,2)
 ax3 = ax2.twinx()
 for f, file in enumerate(files):
-    pk    = pickle.load(open(file[1],'rb'))
-    label = file[0]
+    # Ig, dIg/dVg and the normalised Rg are cached next to the run (see
+    # transport_analysis.py, which also tabulates a whole directory of runs)
+    derived = load_analysis(file[1])
+    label   = file[0]
 
-    Vb = pk['Vb']
+    Vg = derived['vg']
+    Rg = derived['Rg']
+    Ig = derived['Ig']
 
-    Vg = pk['vg']
-    Rg = pk['Rg']
-    Ig = Vb/Rg
-    
-    dIgdVg = savgol(Ig,5,1,deriv=1,delta=abs(Vg[0] - Vg[1]))
-
-    Rg_norm  = Rg - np.min(Rg)
-    Rg_norm /= np.max(Rg_norm)
+    dIgdVg  = derived['dIgdVg']
+    Rg_norm = derived['Rg_norm']
     # plt.plot(Vg,Rg_norm,label=label)
     ax1.plot(Vg,Rg,label=label)
 
@@ -0,0 +1,97 @@
+"""
+Gate voltage ramps on a Keithley 2400.
+
+The staircase is computed up front and, when the instrument supports it,
+uploaded as a source list and triggered once so the instrument times each
+step itself. Instruments without list mode fall back to stepping the source
+from Python, one write and one sleep per step.
+"""
+import time
+import weakref
+import numpy as np
+
+LIST_MAX_POINTS = 100   # Maximum number of points in a Keithley 2400 source list
+
+_list_mode = weakref.WeakKeyDictionary()    # Instrument -> result of the list mode probe
+
+def ramp_schedule(V_start, V_end, step_size):
+    """
+    Returns the staircase of voltages used to go from V_start to V_end in
+    steps of at most step_size. The last point is always V_end.
+    """
+    step = step_size if V_end >= V_start else -step_size
+    # Rounded so float noise in the distance never adds a zero-length last step
+    n = int(np.ceil(round(abs(V_end - V_start)/step_size, 9)))
+    return np.append(V_start + step*np.arange(n), V_end)
+
+def has_list_mode(keithley):
+    """
+    True if the instrument can run a source list. The first call asks it for
+    the length of its source list; the answer is kept for later calls.
+    """
+    try:
+        return _list_mode[keithley]
+    except (KeyError, TypeError):
+        pass
+
+    try:
+        int(float(keithley.ask(":SOUR:LIST:VOLT:POIN?")))
+        supported = True
+    except Exception:
+        supported = False
+
+    try:
+        _list_mode[keithley] = supported
+    except TypeError:
+        pass    # Not weakly referenceable: probed again next time
+    return supported
+
+def run_ramp(keithley, voltages, delay, list_mode=None):
+    """
+    Steps the source through voltages, holding each one for delay seconds.
+
+    Parameters
+    ----------
+    keithley  : Keithley2400 (or anything with a source_voltage property)
+    voltages  : staircase of voltages to apply
+    delay     : time to hold each voltage (s)
+    list_mode : True uploads the staircase as a source list, False steps it
+                from Python, None picks list mode when it is available
+
+    """
+    if(len(voltages) == 0): return
+    if(list_mode is None): list_mode = has_list_mode(keithley)
+
+    if(not list_mode):
+        for V in voltages:
+            keithley.source_voltage = V
+            time.sleep(delay)
+        return
+
+    # Setting a source delay turns the auto delay off, so both are restored
+    trigger_count = keithley.ask(":TRIG:COUN?").strip()
+    source_delay  = keithley.ask(":SOUR:DEL?").strip()
+    auto_delay    = keithley.ask(":SOUR:DEL:AUTO?").strip()
+    for n in range(0, len(voltages), LIST_MAX_POINTS):
+        chunk  = voltages[n:n + LIST_MAX_POINTS]
+        points = ",".join("%.6g" % V for V in chunk)
+
+        keithley.write(":SOUR:VOLT:MODE LIST")
+        keithley.write(":SOUR:LIST:VOLT " + points)
+        keithley.write(":TRIG:COUN %d;:SOUR:DEL %g" % (len(chunk), delay))
+
+        # Go back to a fixed level at the last point as soon as the list ends
+        keithley.write(":INIT;*WAI;:SOUR:VOLT:MODE FIX;:SOUR:VOLT:LEV %.6g" % chunk[-1])
+        time.sleep(len(chunk)*delay)
+        keithley.ask("*OPC?")
+
+    keithley.write(":TRIG:COUN " + trigger_count + ";:SOUR:DEL " + source_delay + ";:SOUR:DEL:AUTO " + auto_delay)
+
+# Ramp the gate voltage applied via the Keithley
+def ramp_gate_voltage(keithley, V_start, V_end, step_size, delay, list_mode=None):
+    run_ramp(keithley, ramp_schedule(V_start, V_end, step_size), delay, list_mode)
+
+# Drop-in for Keithley2400.ramp_to_voltage: linear steps from the present voltage
+def ramp_to_voltage(keithley, target_voltage, steps=30, pause=20e-3, list_mode=None):
+    voltages = np.linspace(keithley.source_voltage, target_voltage, steps)
+    run_ramp(keithley, voltages, pause, list_mode)
@@ -0,0 +1,132 @@
+"""
+Shared Nanonis session.
+
+Opens the nanonisTCP connection once, keeps one handle per Nanonis module and
+resolves signal names (e.g. 'Output 8 (V)' or 'LI Demod 1 X (V)') to signal
+indexes through a cached map, so scripts no longer depend on hard-coded
+indexes and no longer dump the full signal list on every call.
+"""
+import time
+import numpy as np
+
+from nanonisTCP import nanonisTCP
+from nanonisTCP.Bias import Bias
+from nanonisTCP.UserOut import UserOut
+from nanonisTCP.Signals import Signals
+from nanonisTCP.LockIn  import LockIn
+from nanonisTCP.BiasSpectr import BiasSpectr
+from nanonisTCP.Osci2T import Osci2T
+
+from acquisition import read_channels, read_block, settle, average_until
+from demod import demodulate
+
+class NanonisSession:
+    def __init__(self, IP='127.0.0.1', PORT=6501, version=99999999):
+        self.NTCP = nanonisTCP(IP, PORT, version=version)
+
+        self.bias     = Bias(self.NTCP)
+        self.userOut  = UserOut(self.NTCP)
+        self.signals  = Signals(self.NTCP)
+        self.lockin   = LockIn(self.NTCP)
+        self.biasSpec = BiasSpectr(self.NTCP)
+        self.osci     = Osci2T(self.NTCP)
+
+        self.signal_names = None    # Signal list the index map was built from
+        self.signal_map   = {}      # Signal name -> signal index
+
+    def refresh_signals(self):
+        """
+        Re-reads the signal list from Nanonis and rebuilds the name -> index
+        map.
+        """
+        self.signal_names = self.signals.NamesGet()
+        self.signal_map   = {name : n for n,name in enumerate(self.signal_names)}
+
+    def signal_index(self, signal):
+        """
+        Returns the signal index for a signal name. Integers are assumed to be
+        indexes already and are returned as is. An unknown name triggers one
+        refresh of the map in case the signal list changed.
+
+        A known name is not checked against Nanonis again: if the slots may
+        have been reordered since the map was built (e.g. in the Signals
+        Manager between two sweeps on the same session), call
+        refresh_signals() first. The sweeps do so once at their start.
+        """
+        if(isinstance(signal, (int, np.integer))): return int(signal)
+
+        if(self.signal_names is None or not signal in self.signal_map):
+            self.refresh_signals()
+
+        if(not signal in self.signal_map):
+            raise Exception("Signal '" + signal + "' not found in the Nanonis signal list")
+
+        return self.signal_map[signal]
+
+    def InSlotSet(self, slot, RTSignalIndex):
+        """
+        Signals.InSlotSet through the session. Changing a slot changes the
+        signal list, so the cached map is dropped.
+        """
+        self.signals.InSlotSet(slot, RTSignalIndex)
+        self.signal_names = None
+
+    def read(self, signals, ns=1, ds=0, wait_for_newest_data=True):
+        """
+        Reads ns samples of the given signals (names or indexes) in batched
+        requests. Returns a numpy array of shape (ns, len(signals)).
+        """
+        signal_indexes = [self.signal_index(signal) for signal in signals]
+        return read_channels(self.NTCP, signal_indexes, ns, ds, wait_for_newest_data)
+
+    def average(self, signals, sem_tol, ns_min=3, ns_max=100, ds=0):
+        """
+        Averages the given signals until their standard error of the mean is
+        below sem_tol (see acquisition.average_until). Returns the mean,
+        variance and number of samples.
+        """
+        signal_indexes = [self.signal_index(signal) for signal in signals]
+        read = lambda: read_channels(self.NTCP, signal_indexes)[0]
+        return average_until(read, sem_tol, ns_min, ns_max, ds)
+
+    def settle(self, signals, tolerance=None, timeout=1, window=5, ds=0, slope=None):
+        """
+        Waits until the given signals converge (see acquisition.settle).
+        Returns the time spent settling (s).
+        """
+        signal_indexes = [self.signal_index(signal) for signal in signals]
+        read = lambda: read_channels(self.NTCP, signal_indexes)[0]
+        return settle(read, tolerance, timeout, window, ds, slope)
+
+    def demodulate(self, frequency, harmonics=(1,), bandwidth=None, order=1, dataToGet=1):
+        """
+        Software lock-in: pulls one block from the Oscilloscope 2-Channels and
+        demodulates channel A at the given harmonics of frequency, with the
+        modulation on channel B as the phase reference (see
+        demod.demodulate). Returns X, Y, R and phase (deg), one value per
+        harmonic.
+        """
+        samples, dt = read_block(self.osci, dataToGet)
+        return demodulate(samples[:,0], dt, frequency, harmonics, bandwidth, order, reference=samples[:,1])
+
+    def ramp_output(self, userOutput, value, dt=0.5, db=0.01):
+        """
+        Ramps a user output to value in steps of db, waiting dt between steps.
+        """
+        outputIndex = self.signal_index('Output ' + str(userOutput) + ' (V)')
+        startValue  = self.signals.ValGet(outputIndex, wait_for_newest_data=True)
+
+        if(abs(startValue - value) < db):
+            self.userOut.ValSet(userOutput, value)
+            return
+
+        vv = np.arange(startValue, value, np.sign(value - startValue)*db)
+        vv[-1] = value
+        for v in vv:
+            time.sleep(dt)
+            self.userOut.ValSet(userOutput, v)
+
+        self.userOut.ValSet(userOutput, value)
+
+    def close(self):
+        self.NTCP.close_connection()
@@ -0,0 +1,491 @@
+"""
+Offline stand-in for the Nanonis TCP server and the Keithley 2400.
+
+The Nanonis simulator is a local TCP server that speaks the subset of the
+Nanonis protocol used by the sweep scripts (Signals.NamesGet/ValGet/ValsGet,
+UserOut.ValSet, LockIn.Mod*, Osci2T, BiasSpectr.Start/PropsGet/TimingGet/
+LimitsGet). The Keithley stand-in supports the properties the scripts use plus
+the SCPI source-list commands used by ramp.py. Both drive one GrapheneModel, which gives a Dirac peak in
+R(Vg), lock-in X/Y across a series resistor, gate-dependent STS spectra, a
+settling transient after every gate step, and configurable noise and latency.
+
+To run a script offline set simulate = True in it. To run every sweep script
+end to end and print throughput:
+    python simulator.py
+"""
+import os
+import sys
+import ast
+import time
+import glob
+import struct
+import threading
+import socketserver
+import tempfile
+import numpy as np
+
+class GrapheneModel:
+    def __init__(self, VD=0.1, width=0.15, Rmax=5e3, Rc=500, Rb=100e3, R1=1e5,
+                 phase=15, noise=2e-3, tau=0.05, I0=100e-12, alpha=1e16, gate_output=8):
+        """
+        Parameters
+        ----------
+        VD, width   : Dirac point and width of the resistance peak (V)
+        Rmax, Rc    : peak and contact resistance (Ohm)
+        Rb          : resistor used for the ratio signal in RvsVg.py (Ohm)
+        R1          : series resistor read by the lock-in in transport1.py (Ohm)
+        phase       : lock-in phase of the current (deg)
+        noise       : relative noise, largest at the Dirac point
+        tau         : settling time constant after a gate step (s)
+        I0          : tunnelling current setpoint (A)
+        alpha       : gate coupling C/e (1/m^2/V), sets the Dirac point shift in STS
+        gate_output : user output that also drives the gate (nanonis_STS_Vg.py)
+
+        """
+        self.VD, self.width, self.Rmax, self.Rc = VD, width, Rmax, Rc
+        self.Rb, self.R1, self.phase = Rb, R1, phase
+        self.noise, self.tau, self.I0, self.alpha = noise, tau, I0, alpha
+        self.gate_output = gate_output
+
+        self.rng  = np.random.default_rng(0)
+        self.lock = threading.Lock()
+
+        self.Vg      = 0        # Gate voltage set
+        self.Vg_prev = 0        # Effective gate voltage when it was last set
+        self.t_gate  = 0        # Time it was last set
+
+        self.outputs   = {}     # User output values
+        self.lockinOn  = False
+        self.lockinAmp = 10e-3
+        self.lockinFrq = 977
+        self.osciChannels = [0, 1]
+
+        self.devices = []       # Further devices on the chip, read through 'Flake/resistor ratio 2', 3...
+
+    def set_gate(self, Vg):
+        with self.lock:
+            self.Vg_prev = self.gate()
+            self.Vg      = Vg
+            self.t_gate  = time.perf_counter()
+
+    def gate(self):
+        """
+        Effective gate voltage, relaxing exponentially towards the one set.
+        """
+        decay = np.exp(-(time.perf_counter() - self.t_gate)/self.tau)
+        return self.Vg + (self.Vg_prev - self.Vg)*decay
+
+    def Rg(self, Vg):
+        return self.Rc + self.Rmax/np.sqrt(1 + ((Vg - self.VD)/self.width)**2)
+
+    def noisy(self, value, Vg, scale=1):
+        sigma = self.noise*scale*(self.Rg(Vg) - self.Rc)/self.Rmax
+        return value + sigma*self.rng.normal()
+
+    def signal_names(self):
+        names = ['Signal ' + str(n) for n in range(128)]
+        names[0] = 'Current (A)'
+        names[1] = 'Bias (V)'
+        for n in range(8):
+            names[2 + n]  = 'Input '  + str(n + 1) + ' (V)'
+            names[10 + n] = 'Output ' + str(n + 1) + ' (V)'
+        names[30] = 'Gate (V)'
+        names[31] = 'Flake/resistor ratio'
+        for k in range(len(self.devices)):
+            names[32 + k] = 'Flake/resistor ratio ' + str(k + 2)
+        names[86] = 'LI Demod 1 X (V)'
+        names[87] = 'LI Demod 1 Y (V)'
+        return names
+
+    def signal_value(self, index):
+        Vg = self.gate()
+        if(index == 0):
+            return self.noisy(self.I0*(1 + 2*(Vg - self.Vg)), Vg, self.I0)
+        if(10 <= index < 18):
+            return self.outputs.get(index - 9, 0)
+        if(index == 30):
+            return Vg
+        if(index == 31):
+            return self.noisy(self.Rg(Vg)/self.Rb, Vg, self.Rmax/self.Rb)
+        if(32 <= index < 32 + len(self.devices)):
+            return self.devices[index - 32].signal_value(31)
+        if(index in (86, 87)):
+            V_R1 = 0
+            if(self.lockinOn): V_R1 = self.lockinAmp*self.R1/(self.R1 + self.Rg(Vg))
+            phase = np.deg2rad(self.phase)
+            value = V_R1*(np.cos(phase) if index == 86 else np.sin(phase))
+            return self.noisy(value, Vg, self.lockinAmp/100)
+        return 0
+
+    def osci_block(self, n=2000, dt=20e-6):
+        """
+        Raw voltage across the series resistor (channel A) and the lock-in
+        modulation (channel B), with a small second harmonic from the
+        non-linearity of the flake near the Dirac point.
+        """
+        Vg = self.gate()
+        t0 = time.perf_counter()
+        t  = t0 + np.arange(n)*dt
+        w  = 2*np.pi*self.lockinFrq*t
+
+        amp  = self.lockinAmp if self.lockinOn else 0
+        V_R1 = amp*self.R1/(self.R1 + self.Rg(Vg))
+        phase = np.deg2rad(self.phase)
+        chA  = V_R1*np.sin(w + phase) + 0.05*V_R1*(self.Rg(Vg) - self.Rc)/self.Rmax*np.sin(2*w + 2*phase)
+        chA += self.noise*amp*self.rng.normal(size=n)
+        chB  = amp*np.sin(w)
+        return t0, dt, chA, chB
+
+    def spectrum(self, num_points=101, Vb_range=(-0.3, 0.3), back_sweep=True):
+        """
+        Graphene spectrum at the present gate voltage: the LDOS is linear in
+        energy about a Dirac point that shifts with the gate.
+        """
+        Vg = self.gate()
+        n  = self.alpha*(Vg - self.VD)
+        ED = -np.sign(n)*6.582e-16*1e6*np.sqrt(np.pi*abs(n))
+
+        Vb   = np.linspace(Vb_range[0], Vb_range[1], num_points)
+        ldos = np.abs(Vb - ED) + 0.02
+        dIdV = self.I0/0.1*ldos
+        I    = np.cumsum(dIdV)*(Vb[1] - Vb[0])
+        I   -= np.interp(0, Vb, I)
+
+        data = {'Bias calc (V)'     : Vb,
+                'Current (A)'       : I + self.I0*self.noise*self.rng.normal(size=num_points),
+                'LI Demod 1 X (A)'  : dIdV*self.lockinAmp + self.I0*self.noise*self.rng.normal(size=num_points)}
+        if(back_sweep):
+            data['Current [bwd] (A)']      = I + self.I0*self.noise*self.rng.normal(size=num_points)
+            data['LI Demod 1 X [bwd] (A)'] = dIdV*self.lockinAmp + self.I0*self.noise*self.rng.normal(size=num_points)
+        return data
+
+def _recv_exact(conn, size):
+    data = b''
+    while(len(data) < size):
+        chunk = conn.recv(size - len(data))
+        if(not chunk): return None
+        data += chunk
+    return data
+
+def _string_array(strings):
+    body = b''
+    for string in strings:
+        body += struct.pack('>i', len(string)) + string.encode()
+    return struct.pack('>ii', len(body) + 4, len(strings)) + body
+
+class NanonisSimulator:
+    def __init__(self, model, IP='127.0.0.1', PORT=0, latency=1e-3, acq_period=20e-3,
+                 spectrum_time=0.5, num_points=101):
+        """
+        Parameters
+        ----------
+        model         : GrapheneModel
+        IP, PORT      : address to listen on (PORT=0 picks a free port)
+        latency       : time taken to answer every command (s)
+        acq_period    : signal acquisition period, Tap (s)
+        spectrum_time : duration of one bias spectrum (s)
+        num_points    : number of points in a bias spectrum
+
+        """
+        self.model = model
+        self.latency, self.acq_period = latency, acq_period
+        self.spectrum_time, self.num_points = spectrum_time, num_points
+        self.calls = {}     # Number of calls to each command
+
+        self.commands = {
+            'Signals.NamesGet'     : self.NamesGet,
+            'Signals.ValGet'       : self.ValGet,
+            'Signals.ValsGet'      : self.ValsGet,
+            'UserOut.ValSet'       : self.UserOutValSet,
+            'LockIn.ModOnOffSet'   : self.ModOnOffSet,
+            'LockIn.ModAmpSet'     : self.ModAmpSet,
+            'LockIn.ModPhasFreqSet': self.ModPhasFreqSet,
+            'LockIn.ModPhasFreqGet': self.ModPhasFreqGet,
+            'Osci2T.Run'           : self.OsciRun,
+            'Osci2T.ChsSet'        : self.OsciChsSet,
+            'Osci2T.ChsGet'        : self.OsciChsGet,
+            'Osci2T.DataGet'       : self.OsciDataGet,
+            'BiasSpectr.PropsGet'  : self.PropsGet,
+            'BiasSpectr.TimingGet' : self.TimingGet,
+            'BiasSpectr.LimitsGet' : self.LimitsGet,
+            'BiasSpectr.Start'     : self.Start,
+        }
+
+        simulator = self
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                simulator.serve(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((IP, PORT), Handler)
+        self.server.daemon_threads = True
+        self.IP, self.PORT = self.server.server_address
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def serve(self, conn):
+        while(True):
+            header = _recv_exact(conn, 40)
+            if(header is None): return
+            command   = header[:32].rstrip(b'\0').decode()
+            body_size = struct.unpack('>i', header[32:36])[0]
+            body      = _recv_exact(conn, body_size) if body_size else b''
+
+            self.calls[command] = self.calls.get(command, 0) + 1
+            time.sleep(self.latency)
+
+            if(command in self.commands):
+                response = self.commands[command](body) + struct.pack('>ii', 0, 0)
+            else:
+                message  = ('Command ' + command + ' is not simulated').encode()
+                response = struct.pack('>iii', 1, 0, len(message)) + message
+
+            conn.sendall(header[:32] + struct.pack('>i', len(response)) + bytes(4) + response)
+
+    def wait_for_data(self, wait_for_newest_data):
+        time.sleep(self.acq_period*(1.5 if wait_for_newest_data else 0.5))
+
+    def NamesGet(self, body):
+        return _string_array(self.model.signal_names())
+
+    def ValGet(self, body):
+        index, wait = struct.unpack('>iI', body)
+        self.wait_for_data(wait)
+        return struct.pack('>f', self.model.signal_value(index))
+
+    def ValsGet(self, body):
+        num = struct.unpack('>i', body[:4])[0]
+        indexes = struct.unpack('>%di' % num, body[4:4 + 4*num])
+        self.wait_for_data(struct.unpack('>I', body[4 + 4*num:])[0])
+        values = [self.model.signal_value(index) for index in indexes]
+        return struct.pack('>i%df' % num, num, *values)
+
+    def UserOutValSet(self, body):
+        index, value = struct.unpack('>if', body)
+        self.model.outputs[index] = value
+        if(index == self.model.gate_output): self.model.set_gate(value)
+        return b''
+
+    def ModOnOffSet(self, body):
+        self.model.lockinOn = bool(struct.unpack('>iI', body)[1])
+        return b''
+
+    def ModAmpSet(self, body):
+        self.model.lockinAmp = struct.unpack('>if', body)[1]
+        return b''
+
+    def ModPhasFreqSet(self, body):
+        self.model.lockinFrq = struct.unpack('>id', body)[1]
+        return b''
+
+    def ModPhasFreqGet(self, body):
+        return struct.pack('>d', self.model.lockinFrq)
+
+    def OsciRun(self, body):
+        return b''
+
+    def OsciChsSet(self, body):
+        self.model.osciChannels = list(struct.unpack('>ii', body))
+        return b''
+
+    def OsciChsGet(self, body):
+        return struct.pack('>ii', *self.model.osciChannels)
+
+    def OsciDataGet(self, body):
+        dataToGet = struct.unpack('>h', body)[0]
+        t0, dt, chA, chB = self.model.osci_block()
+        time.sleep(dataToGet*len(chA)*dt)
+        return struct.pack('>ddi', t0, dt, len(chA)) + struct.pack('>%dd' % (2*len(chA)), *chA, *chB)
+
+    def PropsGet(self, body):
+        response  = struct.pack('>hihi', 0, 1, 1, self.num_points)
+        response += _string_array([])
+        response += _string_array(['Bias calc (V)'])
+        response += struct.pack('>ii', 0, 0)    # autosave, save dialog
+        return response
+
+    def TimingGet(self, body):
+        # Timings that add up to spectrum_time: one forward and one backward
+        # sweep of num_points, all of it integration
+        integration = self.spectrum_time/(2*self.num_points)
+        return struct.pack('>8f', 0, 0, 0, 1e3, 0, integration, 0, 0)
+
+    def LimitsGet(self, body):
+        return struct.pack('>ff', -0.3, 0.3)
+
+    def Start(self, body):
+        get_data = struct.unpack('>I', body[:4])[0]
+        time.sleep(self.spectrum_time)
+        if(not get_data):
+            return b''                          # error block only
+
+        data = self.model.spectrum(self.num_points)
+        response  = _string_array(list(data))
+        response += struct.pack('>ii', len(data), self.num_points)
+        for channel in data.values():
+            response += struct.pack('>%df' % self.num_points, *channel)
+        response += struct.pack('>i', 0)        # no parameters
+        return response
+
+class Keithley2400Sim:
+    """
+    Stand-in for pymeasure's Keithley2400 driving the model's gate.
+    """
+    def __init__(self, model, resource="GPIB::1", latency=2e-3):
+        self.model   = model
+        self.latency = latency
+        self.voltage = 0
+        self.calls   = 0
+        self.trigger_count = 1
+        self.source_delay  = 1e-3
+        self.auto_delay    = True
+        self.list   = []
+        self.thread = None
+
+    def _bus(self):
+        self.calls += 1
+        time.sleep(self.latency)
+
+    @property
+    def source_voltage(self):
+        self._bus()
+        return self.voltage
+
+    @source_voltage.setter
+    def source_voltage(self, V):
+        self._bus()
+        self.voltage = V
+        self.model.set_gate(V)
+
+    @property
+    def current(self):
+        self._bus()
+        return 1e-12*self.voltage
+
+    def apply_voltage(self, voltage_range=None, compliance_current=0.1):
+        self._bus()
+
+    def enable_source(self):
+        self._bus()
+
+    def disable_source(self):
+        self._bus()
+
+    def ramp_to_voltage(self, target_voltage, steps=30, pause=20e-3):
+        for V in np.linspace(self.source_voltage, target_voltage, steps):
+            self.source_voltage = V
+            time.sleep(pause)
+
+    def _run_list(self, voltages, delay):
+        for V in voltages:
+            self.voltage = V
+            self.model.set_gate(V)
+            time.sleep(delay)
+
+    def write(self, command):
+        self._bus()
+        for cmd in command.split(';'):
+            name, _, value = cmd.strip().partition(' ')
+            if(name == ':SOUR:LIST:VOLT'):
+                self.list = [float(V) for V in value.split(',')]
+            elif(name == ':TRIG:COUN'):
+                self.trigger_count = int(value)
+            elif(name == ':SOUR:DEL'):
+                self.source_delay = float(value)
+                self.auto_delay   = False
+            elif(name == ':SOUR:DEL:AUTO'):
+                self.auto_delay = value.strip().upper() in ['1', 'ON']
+            elif(name == ':SOUR:VOLT:LEV'):
+                self.wait()
+                self.voltage = float(value)
+                self.model.set_gate(self.voltage)
+            elif(name == ':INIT'):
+                voltages = self.list[:self.trigger_count]
+                self.thread = threading.Thread(target=self._run_list, args=(voltages, self.source_delay))
+                self.thread.start()
+
+    def wait(self):
+        if(self.thread is not None): self.thread.join()
+
+    def ask(self, command):
+        self._bus()
+        if(command == ':TRIG:COUN?'): return str(self.trigger_count)
+        if(command == ':SOUR:DEL?'):  return str(self.source_delay)
+        if(command == ':SOUR:DEL:AUTO?'): return str(int(self.auto_delay))
+        if(command == ':SOUR:LIST:VOLT:POIN?'): return str(len(self.list))
+        if(command == '*OPC?'):
+            self.wait()
+            return '1'
+        return '0'
+
+def simulated_setup(model=None, latency=1e-3, acq_period=20e-3, spectrum_time=0.5,
+                    num_points=101, gpib_latency=2e-3, devices=1):
+    """
+    Starts a Nanonis simulator on a free local port.
+
+    devices > 1 puts further devices on the chip (Dirac points 0.1 V apart).
+    Each new Keithley resource drives the next device's gate, and device k is
+    read through the 'Flake/resistor ratio k' signal.
+
+    Returns
+    -------
+    IP, PORT     : address to pass to NanonisSession
+    Keithley2400 : class-like factory for Keithleys driving the same model
+
+    """
+    if(model is None): model = GrapheneModel()
+    model.devices = [GrapheneModel(VD=model.VD + 0.1*k) for k in range(1, devices)]
+    gates = {}
+    simulator = NanonisSimulator(model, latency=latency, acq_period=acq_period,
+                                 spectrum_time=spectrum_time, num_points=num_points)
+
+    def Keithley2400(resource="GPIB::1"):
+        if(not resource in gates): gates[resource] = ([model] + model.devices)[min(len(gates), len(model.devices))]
+        return Keithley2400Sim(gates[resource], resource, gpib_latency)
+
+    Keithley2400.simulator = simulator
+    return simulator.IP, simulator.PORT, Keithley2400
+
+def run_script(path, **overrides):
+    """
+    Runs a sweep script with some of its top-level parameters replaced, e.g.
+    run_script('transport1.py', simulate=True, nVg=5). Returns the script's
+    globals once it has finished.
+    """
+    path = os.path.abspath(path)
+    tree = ast.parse(open(path).read(), path)
+    for node in tree.body:
+        if(isinstance(node, ast.Assign) and len(node.targets) == 1
+           and isinstance(node.targets[0], ast.Name) and node.targets[0].id in overrides):
+            value = ast.parse(repr(overrides[node.targets[0].id]), mode='eval').body
+            node.value = ast.fix_missing_locations(ast.copy_location(value, node.value))
+
+    import matplotlib
+    matplotlib.use('Agg')
+
+    script_globals = {'__name__' : '__main__', '__file__' : path}
+    exec(compile(tree, path, 'exec'), script_globals)
+    return script_globals
+
+# Quick settings so every script finishes in seconds
+SCRIPTS = {
+    'transport1.py'        : dict(Vgi=-0.5, Vgf=0.5, nVg=11, dt=0.05, ns=3, keithley_step_delay=0.005),
+    'RvsVg.py'             : dict(Vgi=-0.5, Vgf=0.5, dVg=0.1, dt=0.01, ts=0.05, ns=3, ds=0),
+    'RvsVg_multi.py'       : dict(dVg=0.1, dt=0.01, ts=0.05, ns=3, ds=0),
+    'STS_Vg.py'            : dict(Vgi=-0.5, Vgf=0.5, N=5, dVg=0.1, dt=0.005, ts=0.05),
+    '../nanonis_STS_Vg.py' : dict(Vgi=-0.5, Vgf=0.5, dVg=0.25, dt=0.01, ts=0.05),
+}
+
+if __name__ == '__main__':
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+
+    os.chdir(tempfile.mkdtemp())
+    for script, overrides in SCRIPTS.items():
+        t0 = time.perf_counter()
+        run_script(os.path.join(here, script), simulate=True, **overrides)
+        elapsed = time.perf_counter() - t0
+
+        run_dir = max((d for d in glob.glob('*') if os.path.isdir(d)), key=os.path.getmtime)
+        points  = len(glob.glob(os.path.join(run_dir, 'points', '*.pk')))
+        print("%-22s %3d points in %6.2f s (%.2f points/s)" % (os.path.basename(script), points, elapsed, points/elapsed))
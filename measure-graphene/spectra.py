@@ -0,0 +1,199 @@
+"""
+Processing of bias spectra returned by BiasSpectr.Start(get_data=True).
+
+Nanonis names backward sweep channels like their forward channel with a
+' [bwd]' tag before the unit, e.g. 'Current (A)' and 'Current [bwd] (A)'.
+
+derivative() differentiates whole stacks of spectra (or any curves) along
+their last axis in one call, with Savitzky-Golay smoothing or a regularised
+(Tikhonov) derivative.
+"""
+import functools
+import numpy as np
+import scipy.linalg
+from scipy.signal import savgol_filter as savgol
+
+def bwd_name(channel):
+    """
+    Returns the name of the backward sweep of a channel.
+    """
+    name, unit = channel.rsplit(' (', 1)
+    return name + ' [bwd] (' + unit
+
+def average_sweeps(data_dict):
+    """
+    Averages every channel with its backward sweep. Channels without a
+    backward sweep are returned as they are.
+    """
+    averaged = {}
+    for channel, data in data_dict.items():
+        if('[bwd]' in channel): continue
+        bwd = data_dict.get(bwd_name(channel)) if ' (' in channel else None
+        averaged[channel] = data if bwd is None else (data + bwd)/2
+
+    return averaged
+
+def interp_matrix(x, x_new):
+    """
+    Matrix W such that W @ y interpolates y(x) linearly onto x_new.
+    """
+    order = np.argsort(x)
+    xs = x[order]
+    k  = np.clip(np.searchsorted(xs, x_new) - 1, 0, len(x) - 2)
+    t  = (x_new - xs[k])/(xs[k + 1] - xs[k])
+
+    W = np.zeros((len(x_new), len(x)))
+    rows = np.arange(len(x_new))
+    W[rows, order[k]]      = 1 - t
+    W[rows, order[k + 1]] += t
+    return W
+
+def _interp_rows(x, y, x_new):
+    """
+    Interpolates every row of y(x) onto the same row of x_new, with one search
+    over all rows: cubic through the four nearest points (linear below four
+    points), so resampling a curve adds no kinks to its derivative. x_new
+    must lie within the range of its row of x.
+    """
+    rows, m = x.shape
+    order = np.argsort(x, axis=-1)
+    xs = np.take_along_axis(x, order, -1)
+    ys = np.take_along_axis(np.broadcast_to(y, x.shape), order, -1)
+
+    # Map row r onto [2r, 2r + 1] so the rows stay apart in one sorted array
+    lo, span = xs[:, :1], xs[:, -1:] - xs[:, :1]
+    offset = 2*np.arange(rows)[:, None]
+    k = np.searchsorted(((xs - lo)/span + offset).ravel(), ((x_new - lo)/span + offset).ravel())
+    k = np.clip(k.reshape(x_new.shape) - m*np.arange(rows)[:, None] - 1, 0, m - 2)
+
+    # Lagrange polynomial through the points around each interval
+    p = min(m, 4)
+    k = np.clip(k - (p - 2)//2, 0, m - p)
+    xk = np.stack([np.take_along_axis(xs, k + i, -1) for i in range(p)])
+    yk = np.stack([np.take_along_axis(ys, k + i, -1) for i in range(p)])
+    y_new = np.zeros(x_new.shape)
+    for i in range(p):
+        basis = np.ones(x_new.shape)
+        for j in range(p):
+            if(j != i): basis *= (x_new - xk[j])/(xk[i] - xk[j])
+        y_new += basis*yk[i]
+    return y_new
+
+@functools.lru_cache(maxsize=8)
+def _regularised_factor(m, lam):
+    # Trapezoidal cumulative integral on a unit grid: (A @ d)[k] = y[k] - y[0]
+    A = np.tril(np.ones((m, m)))
+    A[:, 0] = 0.5
+    A[np.arange(m), np.arange(m)] = 0.5
+    A[0] = 0
+
+    # Penalise the curvature of the derivative
+    D = np.diff(np.eye(m), 2, axis=0)
+    return A, scipy.linalg.cho_factor(A.T @ A + lam*D.T @ D)
+
+def _derivative_unit(y, method, sg_pts, sg_poly, lam):
+    """
+    Derivative of every row of y along a unit-spaced grid.
+    """
+    if(method == 'savgol'):
+        return savgol(y, sg_pts, sg_poly, deriv=1, axis=-1)
+
+    if(method == 'regularised'):
+        A, factor = _regularised_factor(y.shape[-1], lam)
+        return scipy.linalg.cho_solve(factor, A.T @ (y - y[:, :1]).T).T
+
+    raise Exception("Unknown derivative method '" + method + "'")
+
+def _derivative_shared(y, x, method, sg_pts, sg_poly, lam):
+    """
+    Derivative of every row of y on one shared grid x.
+    """
+    dx = np.diff(x)
+    if(np.allclose(dx, dx[0])):
+        return _derivative_unit(y, method, sg_pts, sg_poly, lam)/dx[0]
+
+    # Non-uniform grid (e.g. adaptive gate points): differentiate on a
+    # uniform grid over the same range and interpolate back
+    x  = np.broadcast_to(x, y.shape)
+    xu = np.broadcast_to(np.linspace(np.min(x), np.max(x), x.shape[-1]), y.shape)
+    d  = _derivative_unit(_interp_rows(x, y, xu), method, sg_pts, sg_poly, lam)/(xu[0, 1] - xu[0, 0])
+    return _interp_rows(xu, d, x)
+
+def derivative(y, x, method='savgol', sg_pts=5, sg_poly=1, lam=1e-2, y_bwd=None):
+    """
+    Smoothed numerical derivative dy/dx of a stack of curves in one
+    vectorised call.
+
+    Parameters
+    ----------
+    y       : numpy array of shape (curves, points) or (points,)
+    x       : grid, either shared (points,) or one per curve (curves, points).
+              Non-uniform grids are resampled onto a uniform one
+    method  : 'savgol' (Savitzky-Golay) or 'regularised' (Tikhonov: the
+              derivative whose integral best matches y, with its curvature
+              penalised by lam)
+    sg_pts, sg_poly : Savitzky-Golay window length and polynomial order
+    lam     : regularisation strength on a unit-spaced grid
+    y_bwd   : backward sweeps of y, averaged with y before differentiating
+
+    NaN padding (e.g. shorter spectra in a SpectrumStore) only spoils the
+    ends of a curve with 'savgol', but the whole curve with 'regularised'.
+
+    Returns
+    -------
+    dydx : numpy array the shape of y
+
+    """
+    y = np.asarray(y, dtype=float)
+    if(y_bwd is not None): y = (y + np.asarray(y_bwd, dtype=float))/2
+
+    single = y.ndim == 1
+    y = np.atleast_2d(y)
+    x = np.asarray(x, dtype=float)
+
+    if(x.ndim == 1):
+        dydx = _derivative_shared(y, x, method, sg_pts, sg_poly, lam)
+    else:
+        dx = np.diff(x, axis=-1)
+        if(np.allclose(dx, dx[:, :1])):
+            # Uniform grids that only differ in spacing or offset
+            dydx = _derivative_unit(y, method, sg_pts, sg_poly, lam)/dx[:, :1]
+        else:
+            # Non-uniform grids: resample every curve onto a uniform grid over
+            # its own range, differentiate them all and interpolate back
+            lo, hi = np.min(x, axis=-1, keepdims=True), np.max(x, axis=-1, keepdims=True)
+            xu = lo + (hi - lo)*np.linspace(0, 1, x.shape[-1])
+            dydx = _derivative_unit(_interp_rows(x, y, xu), method, sg_pts, sg_poly, lam)/(xu[:, 1:2] - xu[:, :1])
+            dydx = _interp_rows(xu, dydx, x)
+
+    return dydx[0] if single else dydx
+
+def reduce_spectrum(spectrum, bias_channel='Bias calc (V)', current_channel='Current (A)', sg_pts=5, sg_poly=1):
+    """
+    Averages forward and backward sweeps and computes a smoothed numerical
+    dI/dV.
+
+    Parameters
+    ----------
+    spectrum        : dictionary returned by BiasSpectr.Start(get_data=True)
+    bias_channel    : sweep channel (the first channel if not found)
+    current_channel : channel to differentiate
+    sg_pts, sg_poly : Savitzky-Golay window length and polynomial order
+
+    Returns
+    -------
+    reduced : dictionary with 'bias', 'channels' (sweep-averaged data) and
+              'dIdV' (None if current_channel was not acquired)
+
+    """
+    channels = average_sweeps(spectrum['data_dict'])
+    if(not bias_channel in channels): bias_channel = list(channels)[0]
+
+    Vb = channels[bias_channel]
+    dIdV = None
+    if(current_channel in channels):
+        dIdV = derivative(channels[current_channel],Vb,sg_pts=sg_pts,sg_poly=sg_poly)
+
+    return {"bias"     : Vb,
+            "channels" : channels,
+            "dIdV"     : dIdV}
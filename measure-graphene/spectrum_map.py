@@ -0,0 +1,143 @@
+"""
+Gate voltage x bias maps built from bias spectra.
+
+A SpectrumMap holds one preallocated (gate points x bias points) array per
+channel and fills one row per spectrum as it arrives, resampling it onto a
+common bias grid with a precomputed interpolation matrix (shared by every
+spectrum on the same sweep grid). It can be saved after every row as one
+compact .npz file, so a map can be plotted live during a sweep and loaded
+later without going back to the list of spectrum dictionaries.
+
+Usage:
+    sts_map = SpectrumMap(N)
+    ...for each gate voltage...
+    sts_map.add(Vg, reduce_spectrum(spectrum))
+    sts_map.save('run.map.npz')
+
+    vg, bias, maps = load_map('run.map.npz')
+    plt.pcolormesh(bias, vg, maps['dIdV'])
+"""
+import os
+import numpy as np
+
+from spectra import interp_matrix
+
+class SpectrumMap:
+    def __init__(self, num_rows, bias=None, channels=None, dtype=np.float32):
+        """
+        Parameters
+        ----------
+        num_rows : number of gate points to allocate (e.g. N, or NMax for an
+                   adaptive sweep)
+        bias     : common bias grid. None uses the grid of the first spectrum
+        channels : channels to map. None maps dI/dV and every channel of the
+                   reduced spectra
+        dtype    : data type of the maps
+
+        """
+        self.num_rows = num_rows
+        self.bias     = None if bias is None else np.sort(np.asarray(bias, dtype=float))
+        self.channels = channels
+        self.dtype    = dtype
+
+        self.vg   = np.full(num_rows, np.nan)
+        self.maps = {}
+        self.n    = 0
+
+        self._grid = None   # Sweep grid the cached interpolation matrix maps from
+        self._W    = None
+
+    def _allocate(self, reduced):
+        if(self.bias is None): self.bias = np.sort(reduced["bias"])
+        if(self.channels is None):
+            self.channels = [c for c in reduced["channels"] if not np.array_equal(reduced["channels"][c], reduced["bias"])]
+            if(reduced["dIdV"] is not None): self.channels = ["dIdV"] + self.channels
+
+        for channel in self.channels:
+            self.maps[channel] = np.full((self.num_rows, len(self.bias)), np.nan, dtype=self.dtype)
+
+    def add(self, Vg, reduced, row=None):
+        """
+        Resamples one spectrum onto the bias grid and writes it as a row.
+
+        Parameters
+        ----------
+        Vg      : gate voltage of the spectrum
+        reduced : spectrum as returned by spectra.reduce_spectrum
+        row     : row to write (default: the next one)
+
+        Returns
+        -------
+        row : the row written
+
+        """
+        if(not self.maps): self._allocate(reduced)
+        if(row is None): row = self.n
+
+        if(self._grid is None or not np.array_equal(self._grid, reduced["bias"])):
+            self._grid = np.array(reduced["bias"])
+            self._W    = interp_matrix(self._grid, self.bias)
+
+        # Every channel in one product, (channels x sweep points) -> bias grid
+        values = np.array([reduced["dIdV"] if c == "dIdV" else reduced["channels"][c] for c in self.channels])
+        values = values @ self._W.T
+
+        # Only interpolate, never extrapolate past the sweep
+        outside = (self.bias < np.min(self._grid)) | (self.bias > np.max(self._grid))
+        values[:, outside] = np.nan
+
+        for c, channel in enumerate(self.channels):
+            self.maps[channel][row] = values[c]
+        self.vg[row] = Vg
+        self.n = max(self.n, row + 1)
+        return row
+
+    def result(self):
+        """
+        Returns the filled rows in gate voltage order.
+
+        Returns
+        -------
+        vg   : gate voltages (rows)
+        bias : bias grid (columns)
+        maps : dictionary of channel -> 2D array (gate x bias)
+
+        """
+        filled = np.flatnonzero(~np.isnan(self.vg))
+        order  = filled[np.argsort(self.vg[filled], kind='stable')]
+        return self.vg[order], self.bias, {channel : m[order] for channel, m in self.maps.items()}
+
+    def save(self, filename):
+        """
+        Writes the map (in gate voltage order) to a .npz file, replacing it
+        atomically so it can be read while the sweep is running.
+        """
+        vg, bias, maps = self.result()
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, vg=vg, bias=bias, channels=np.array(list(maps)), **{'map_' + str(c) : m for c, m in enumerate(maps.values())})
+        os.replace(tmp, filename)
+
+    @classmethod
+    def from_points(cls, vg, reduced, bias=None, channels=None, dtype=np.float32):
+        """
+        Builds a map from lists of gate voltages and reduced spectra, e.g. the
+        'vg' and 'reduced' entries of an STS_Vg.py pickle.
+        """
+        sts_map = cls(len(vg), bias, channels, dtype)
+        for Vg, spectrum in zip(vg, reduced):
+            sts_map.add(Vg, spectrum)
+        return sts_map
+
+def load_map(filename):
+    """
+    Reads a map written by SpectrumMap.save.
+
+    Returns
+    -------
+    vg, bias, maps : as SpectrumMap.result
+
+    """
+    with np.load(filename) as f:
+        maps = {str(channel) : f['map_' + str(c)] for c, channel in enumerate(f['channels'])}
+        return f['vg'], f['bias'], maps
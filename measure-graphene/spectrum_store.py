@@ -0,0 +1,249 @@
+"""
+Indexed, memory-mapped store for directories of Nanonis .dat spectra.
+
+The first time a directory is opened every .dat file is parsed (in parallel,
+with numpy's C text reader) and the data are written to one stacked float64
+array in a cache directory:
+    data.f8     spectra x channels x points, NaN padded
+    index.json  channel names and, for every spectrum, its file name, size,
+                modification time, timestamp, gate voltage, length and header
+
+Later opens memory-map the array and read the index, so nothing is parsed
+again. Files added to the directory since the last index are parsed and
+appended; if a file has been modified or removed, or a new file has different
+channels or more points, the store is rebuilt.
+
+Usage:
+    store = SpectrumStore(path)
+    Vb   = store.channel('Bias calc (V)')   # (spectra, points)
+    I    = store.channel('Current (A)')
+    vg   = store.vg
+
+Spectra are indexed in the order they were added to the store, which is not
+necessarily file name order after an update (a new file may sort before old
+ones). Select and label spectra with order() and vg rather than by position.
+"""
+import os
+import json
+import numpy as np
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+def read_dat(filename):
+    """
+    Reads a Nanonis .dat spectrum, like nanonispy.read.Spec but faster.
+
+    Returns
+    -------
+    header  : dictionary of header entries (strings)
+    signals : dictionary of channel name -> numpy array
+
+    """
+    with open(filename) as f:
+        head, _, body = f.read().partition('[DATA]')
+
+    header = {}
+    for line in head.splitlines():
+        key, _, value = line.rstrip('\t').partition('\t')
+        if(key): header[key] = value
+
+    lines   = body.strip().splitlines()
+    columns = lines[0].split('\t')
+    data    = np.loadtxt(lines[1:], delimiter='\t', ndmin=2)
+    return header, {channel : data[:, c] for c, channel in enumerate(columns)}
+
+def _timestamp(header, filename):
+    for key in ['Saved Date', 'Date']:
+        try:
+            return datetime.strptime(header[key].strip(), '%d.%m.%Y %H:%M:%S').timestamp()
+        except (KeyError, ValueError):
+            pass
+    return os.path.getmtime(filename)
+
+class SpectrumStore:
+    def __init__(self, path, gate=None, cache=None, workers=None):
+        """
+        Opens (and updates) the store for a directory of .dat spectra.
+
+        Parameters
+        ----------
+        path    : directory of .dat files
+        gate    : how to find the gate voltage of each spectrum: a header key
+                  (e.g. 'Output 8 (V)'), a dictionary {file name : Vg}, a
+                  function f(file name, header) returning Vg, or None (NaN)
+        cache   : directory for the stacked array and index (default
+                  path/.spectrum_store)
+        workers : number of parse threads (default: set by concurrent.futures)
+
+        """
+        self.path    = path
+        self.gate    = gate
+        self.cache   = cache or os.path.join(path, '.spectrum_store')
+        self.workers = workers
+        os.makedirs(self.cache, exist_ok=True)
+
+        self.index = {'channels' : [], 'points' : 0, 'files' : []}
+        self.data  = np.zeros((0, 0, 0))
+
+        filename = os.path.join(self.cache, 'index.json')
+        if(os.path.exists(filename)):
+            self.index = json.load(open(filename))
+            self.update()
+        else:
+            self.rebuild()
+
+    def update(self):
+        """
+        Brings the store up to date with the directory. Returns the number of
+        spectra parsed.
+        """
+        on_disk = {}
+        for f in sorted(os.listdir(self.path)):
+            if(not f.endswith('.dat')): continue
+            stat = os.stat(os.path.join(self.path, f))
+            on_disk[f] = (stat.st_size, stat.st_mtime)
+
+        # Anything changed or removed means rebuilding from scratch
+        for entry in self.index['files']:
+            if(on_disk.get(entry['name']) != (entry['size'], entry['mtime'])):
+                return self.rebuild()
+
+        known = set(entry['name'] for entry in self.index['files'])
+        new   = [f for f in on_disk if not f in known]
+        if(new):
+            parsed = self._parse([os.path.join(self.path, f) for f in new])
+            channels = list(self.index['channels'])
+            points   = self.index['points']
+            for header, signals in parsed:
+                if(not points and not channels):
+                    channels = list(signals)
+                    points   = max(len(v) for v in signals.values())
+                if(list(signals) != channels or max(len(v) for v in signals.values()) > points):
+                    return self.rebuild()
+
+            self.index['channels'] = channels
+            self.index['points']   = points
+            self._append(new, on_disk, parsed)
+
+        self._open()
+        return len(new)
+
+    def rebuild(self):
+        """
+        Re-parses every spectrum in the directory.
+        """
+        files = sorted(f for f in os.listdir(self.path) if f.endswith('.dat'))
+        parsed = self._parse([os.path.join(self.path, f) for f in files])
+
+        channels = []
+        for header, signals in parsed:
+            channels += [c for c in signals if not c in channels]
+        points = max([len(v) for _, signals in parsed for v in signals.values()], default=0)
+
+        on_disk = {}
+        for f in files:
+            stat = os.stat(os.path.join(self.path, f))
+            on_disk[f] = (stat.st_size, stat.st_mtime)
+
+        self.index = {'channels' : channels, 'points' : points, 'files' : []}
+        open(os.path.join(self.cache, 'data.f8'), 'wb').close()
+        self._append(files, on_disk, parsed)
+
+        self._open()
+        return len(files)
+
+    def _parse(self, filenames):
+        if(len(filenames) < 8 or self.workers == 1):
+            return [read_dat(f) for f in filenames]
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(read_dat, filenames))
+
+    def _gate(self, name, header):
+        if(self.gate is None): return np.nan
+        if(callable(self.gate)): return float(self.gate(name, header))
+        if(isinstance(self.gate, dict)): return float(self.gate.get(name, np.nan))
+        try:
+            return float(header[self.gate])
+        except (KeyError, ValueError):
+            return np.nan
+
+    def _append(self, names, on_disk, parsed):
+        self.data = None    # Release the memory map before resizing the file
+        channels, points = self.index['channels'], self.index['points']
+        block = np.full((len(parsed), len(channels), points), np.nan)
+        for n, (name, (header, signals)) in enumerate(zip(names, parsed)):
+            for c, channel in enumerate(channels):
+                if(channel in signals):
+                    block[n, c, :len(signals[channel])] = signals[channel]
+
+            filename = os.path.join(self.path, name)
+            self.index['files'].append({'name'      : name,
+                                        'size'      : on_disk[name][0],
+                                        'mtime'     : on_disk[name][1],
+                                        'timestamp' : _timestamp(header, filename),
+                                        'vg'        : self._gate(name, header),
+                                        'points'    : max(len(v) for v in signals.values()),
+                                        'header'    : header})
+
+        # Drop anything written after the last index (an interrupted update)
+        # before appending, then write the index that covers the new rows
+        data = os.path.join(self.cache, 'data.f8')
+        row  = 8*len(channels)*points
+        with open(data, 'r+b') as f:
+            f.truncate((len(self.index['files']) - len(parsed))*row)
+            f.seek(0, os.SEEK_END)
+            f.write(block.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        tmp = os.path.join(self.cache, 'index.json.tmp')
+        json.dump(self.index, open(tmp, 'w'))
+        os.replace(tmp, os.path.join(self.cache, 'index.json'))
+
+    def _open(self):
+        # The gate voltages follow the gate argument this store was opened with
+        for entry in self.index['files']:
+            entry['vg'] = self._gate(entry['name'], entry['header'])
+
+        shape = (len(self.index['files']), len(self.index['channels']), self.index['points'])
+        if(0 in shape):
+            self.data = np.zeros(shape)
+            return
+        self.data = np.memmap(os.path.join(self.cache, 'data.f8'), dtype='float64', mode='r', shape=shape)
+
+    def __len__(self):
+        return len(self.index['files'])
+
+    @property
+    def channels(self):
+        return self.index['channels']
+
+    @property
+    def files(self):
+        return [entry['name'] for entry in self.index['files']]
+
+    @property
+    def timestamps(self):
+        return np.array([entry['timestamp'] for entry in self.index['files']])
+
+    @property
+    def vg(self):
+        return np.array([entry['vg'] for entry in self.index['files']])
+
+    @property
+    def lengths(self):
+        return np.array([entry['points'] for entry in self.index['files']], dtype=int)
+
+    def channel(self, name):
+        """
+        Returns one channel of every spectrum, shape (spectra, points).
+        """
+        return self.data[:, self.channels.index(name)]
+
+    def order(self, key='timestamp'):
+        """
+        Returns the spectrum indexes sorted by 'timestamp', 'vg' or 'name'.
+        """
+        values = {'timestamp' : self.timestamps, 'vg' : self.vg, 'name' : self.files}[key]
+        return np.argsort(values, kind='stable')
@@ -0,0 +1,128 @@
+"""
+Streaming, crash-safe storage for sweeps.
+
+A run is a directory:
+    meta.pk            run parameters, written before the first point
+    points/000000.pk   one pickle per gate point, written as it arrives
+    ...
+    checkpoint.pk      index and state of the last completed point
+
+Every file is written to a temporary name, flushed to disk and then renamed,
+so a crash, a Ctrl-C or a dropped connection never leaves a half-written
+point and everything acquired so far can be read back, even while the run is
+still going.
+"""
+import os
+import pickle
+import numpy as np
+
+def _write_atomic(filename, obj):
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+class RunWriter:
+    def __init__(self, path, meta):
+        """
+        Creates the run directory and writes the run parameters up front.
+
+        Parameters
+        ----------
+        path : run directory
+        meta : dictionary of run parameters
+
+        """
+        self.path = path
+        os.makedirs(os.path.join(path, 'points'), exist_ok=True)
+
+        self.meta = dict(meta)
+        self.meta['complete'] = False
+        _write_atomic(os.path.join(path, 'meta.pk'), self.meta)
+
+        self.n = len(point_files(path))
+
+    def append(self, point):
+        """
+        Writes one gate point (a dictionary) to its own segment.
+        """
+        _write_atomic(os.path.join(self.path, 'points', '%06d.pk' % self.n), point)
+        self.n += 1
+
+    def checkpoint(self, **state):
+        """
+        Records the state after the last appended point (e.g. its gate
+        voltage), so an interrupted run can be resumed from it.
+        """
+        state['index'] = self.n - 1
+        _write_atomic(os.path.join(self.path, 'checkpoint.pk'), state)
+
+    def finish(self, **extra):
+        """
+        Marks the run as complete, adding any extra end-of-run entries to
+        the metadata.
+        """
+        self.meta.update(extra)
+        self.meta['complete'] = True
+        _write_atomic(os.path.join(self.path, 'meta.pk'), self.meta)
+
+def resume_run(path, meta):
+    """
+    Reopens an interrupted run to continue it from its last checkpoint.
+    The run must have been started with the same parameters.
+
+    Returns
+    -------
+    run        : RunWriter appending after the last checkpointed point
+    points     : list of the points completed so far
+    checkpoint : state recorded with the last completed point (None if no
+                 point was completed)
+
+    """
+    stored, points = read_run(path)
+    for key in meta:
+        if(not key in stored or pickle.dumps(stored[key]) != pickle.dumps(meta[key])):
+            raise Exception("Cannot resume " + path + ": parameter '" + key + "' has changed")
+
+    checkpoint = None
+    filename = os.path.join(path, 'checkpoint.pk')
+    if(os.path.exists(filename)):
+        checkpoint = pickle.load(open(filename, 'rb'))
+
+    # Points written after the last checkpoint are acquired again
+    num_points = checkpoint['index'] + 1 if checkpoint else 0
+    for f in point_files(path)[num_points:]:
+        os.remove(os.path.join(path, 'points', f))
+
+    run = RunWriter(path, stored)
+    return run, points[:num_points], checkpoint
+
+def point_files(path):
+    files = os.listdir(os.path.join(path, 'points'))
+    return sorted(f for f in files if f.endswith('.pk'))
+
+def read_run(path):
+    """
+    Reads a run directory, complete or not.
+
+    Returns
+    -------
+    meta   : dictionary of run parameters
+    points : list of point dictionaries, in acquisition order
+
+    """
+    meta = pickle.load(open(os.path.join(path, 'meta.pk'), 'rb'))
+
+    points = []
+    for f in point_files(path):
+        points.append(pickle.load(open(os.path.join(path, 'points', f), 'rb')))
+
+    return meta, points
+
+def collect(points, key):
+    """
+    Stacks one entry of every point into a numpy array.
+    """
+    return np.array([point[key] for point in points])
@@ -0,0 +1,152 @@
+"""
+Adaptive gate voltage point placement.
+
+Starts with a coarse uniform pass between Vgi and Vgf, then adds points in the
+intervals where the measured signal (Rg, current, lock-in amplitude...) has
+the largest gradient or curvature, until a point budget or an error threshold
+is reached. Gate moves still go through the usual ramp helpers, and each pass
+is ordered to continue from where the previous one finished so the gate
+never ramps back and forth across the sweep.
+
+Usage:
+    grid = AdaptiveGrid(Vgi, Vgf, n_coarse=21, n_max=61)
+    for Vg in grid:
+        ...measure y at Vg...
+        grid.add(Vg, y)
+    vg, y = grid.result()
+
+snake orders a 2D (e.g. bias x gate) grid so that consecutive rows are swept
+in opposite directions.
+"""
+import numpy as np
+
+class AdaptiveGrid:
+    def __init__(self, Vgi, Vgf, n_coarse=21, n_max=61, batch=5, tol=0, mode='curvature', dV_min=0):
+        """
+        Parameters
+        ----------
+        Vgi, Vgf : gate voltage range (V)
+        n_coarse : number of points in the first uniform pass
+        n_max    : total point budget
+        batch    : number of points added per refinement pass
+        tol      : stop once the largest interval score is below tol. Scores
+                   are normalised to the signal range, so tol is a fraction
+        mode     : 'gradient' refines where the signal changes the most,
+                   'curvature' where it bends the most
+        dV_min   : never split an interval narrower than this (V)
+
+        """
+        self.Vgi = Vgi
+        self.Vgf = Vgf
+        self.n_coarse = n_coarse
+        self.n_max    = n_max
+        self.batch    = batch
+        self.tol      = tol
+        self.mode     = mode
+        self.dV_min   = dV_min
+
+        self.vg = []
+        self.y  = []
+        self.done = False
+
+    def add(self, Vg, y):
+        """
+        Records the measured value y at gate voltage Vg.
+        """
+        self.vg.append(Vg)
+        self.y.append(y)
+
+    def result(self):
+        """
+        Returns the measured gate voltages and values sorted by gate voltage.
+        """
+        vg = np.array(self.vg)
+        order = np.argsort(vg)
+        return vg[order], np.array(self.y)[order]
+
+    def scores(self):
+        """
+        Returns the left edge of every interval between measured points and
+        its refinement score.
+        """
+        vg, y = self.result()
+        dv = np.diff(vg)
+        dy = np.diff(y)
+
+        y_range = np.ptp(y)
+        if(y_range == 0): y_range = 1
+
+        if(self.mode == 'gradient'):
+            score = np.abs(dy)/y_range
+        else:
+            # Second derivative at each interior point on the non-uniform grid
+            slope = dy/dv
+            curv  = np.zeros_like(y, dtype=float)
+            curv[1:-1] = 2*np.abs(np.diff(slope))/(dv[:-1] + dv[1:])
+
+            # An interval is as curved as its most curved end, weighted by
+            # its width squared so scores are in units of the signal range
+            score = np.maximum(curv[:-1], curv[1:])*dv**2/y_range
+
+        score[dv < 2*self.dV_min] = 0
+        return vg[:-1], dv, score
+
+    def next_points(self):
+        """
+        Returns the next gate voltages to measure, ordered so the gate keeps
+        moving in one direction from the last measured point.
+        """
+        if(not len(self.vg)):
+            return np.linspace(self.Vgi, self.Vgf, self.n_coarse)
+
+        budget = self.n_max - len(self.vg)
+        if(budget <= 0 or len(self.vg) < 3): return np.array([])
+
+        left, dv, score = self.scores()
+        best = np.argsort(score)[::-1][:min(self.batch, budget)]
+        best = best[score[best] > self.tol]
+        new  = np.sort(left[best] + dv[best]/2)
+
+        # Sweep the new points starting from the end closest to the gate
+        if(len(new) and abs(new[-1] - self.vg[-1]) < abs(new[0] - self.vg[-1])):
+            new = new[::-1]
+
+        return new
+
+    def sweep(self, back_sweep=False):
+        """
+        Yields the adaptive forward pass, then the measured points in reverse
+        order if back_sweep. Only the forward pass should be added back.
+        """
+        for Vg in self:
+            yield Vg
+
+        if(back_sweep):
+            for Vg in self.result()[0][::-1]:
+                yield Vg
+
+    def __iter__(self):
+        while(True):
+            points = self.next_points()
+            if(not len(points)): break
+            for Vg in points:
+                yield Vg
+
+        self.done = True
+
+def snake(outer, inner):
+    """
+    Boustrophedon order over an outer x inner grid: the inner axis (e.g. the
+    gate voltage) is swept forwards, then backwards on the next outer value,
+    and so on, so it never has to ramp back to its start between rows.
+
+    Returns
+    -------
+    i, j : index arrays into outer and inner, in the order to visit them
+
+    """
+    i = np.repeat(np.arange(len(outer)), len(inner))
+    j = np.tile(np.arange(len(inner)), len(outer))
+    odd = i % 2 == 1
+    j[odd] = len(inner) - 1 - j[odd]
+    return i, j
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from scipy.integrate import trapezoid
+
+from broadening import broaden
+
+def gaussian(x, x0, s):
+    return np.exp(-0.5*((x - x0)/s)**2)/(s*np.sqrt(2*np.pi))
+
+def test_broaden_conserves_the_integral():
+    x = np.linspace(-1, 1, 2001)
+    y = gaussian(x, 0.1, 0.02) + 0.5*gaussian(x, -0.3, 0.01)
+    for sigma in [5e-3, 0.02, 0.05]:
+        assert trapezoid(broaden(x, y, sigma), x) == pytest.approx(trapezoid(y, x), rel=1e-4)
+
+def test_broaden_nonuniform_grid():
+    # Dense near the peak, V ~ E^2 style
+    u = np.linspace(-1, 1, 1501)
+    x = np.sign(u)*u**2
+    y = gaussian(x, 0, 0.02)
+    yb = broaden(x, y, 0.03)
+    assert trapezoid(yb, x) == pytest.approx(1, rel=1e-3)
+    # Gaussians add in quadrature
+    assert yb == pytest.approx(gaussian(x, 0, np.hypot(0.02, 0.03)), abs=2e-3*np.max(yb))
+
+def test_broaden_many_sigmas_and_edges():
+    x = np.linspace(0, 1, 501)
+    y = np.ones((2, len(x)))
+    yb = broaden(x, y, np.array([0.01, 0.1, 0.3]))
+    assert yb.shape == (3, 2, len(x))
+    # Edge padding: a constant stays constant, ends included
+    assert yb == pytest.approx(np.ones_like(yb))
+
+def test_broaden_sigma_derivative():
+    x = np.linspace(-1, 1, 1001)
+    y = gaussian(x, 0, 0.05)
+    sigma, h = 0.04, 1e-6
+    yb, dy = broaden(x, y, sigma, sigma_derivative=True)
+    numeric = (broaden(x, y, sigma + h) - broaden(x, y, sigma - h))/(2*h)
+    assert dy == pytest.approx(numeric, abs=1e-3*np.max(np.abs(numeric)))
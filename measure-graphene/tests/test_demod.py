@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from demod import demodulate, optimal_phase, rotate
+
+f, dt, n = 1000, 1e-5, 20000     # A whole number of periods, so phases are from t = 0
+t = np.arange(n)*dt
+
+def signal(A1, phi1, A2, phi2, shift=0):
+    return (A1*np.sin(2*np.pi*f*(t + shift) + np.deg2rad(phi1))
+            + A2*np.sin(2*2*np.pi*f*(t + shift) + np.deg2rad(phi2)) + 0.3)
+
+def test_recovers_amplitude_and_phase_at_1f_and_2f():
+    X, Y, R, phase = demodulate(signal(2e-3, 30, 5e-4, -60), dt, f, harmonics=(1, 2))
+    assert R == pytest.approx([2e-3, 5e-4], rel=1e-3)
+    assert phase == pytest.approx([30, -60], abs=0.1)
+    assert X == pytest.approx(R*np.cos(np.deg2rad(phase)))
+
+@pytest.mark.parametrize('harmonics', [(1, 2), (2,), (2, 1)])
+def test_reference_phase_from_fundamental(harmonics):
+    # The same signal measured from another start: phases relative to the
+    # reference do not change
+    shift = 0.37/f
+    reference = np.sin(2*np.pi*f*(t + shift))
+    X, Y, R, phase = demodulate(signal(2e-3, 30, 5e-4, -60, shift), dt, f, harmonics=harmonics,
+                                reference=reference)
+    expected = {1 : 30, 2 : -60}
+    assert phase == pytest.approx([expected[h] for h in harmonics], abs=0.1)
+
+def test_optimal_phase_puts_signal_in_phase():
+    r = np.linspace(1, 2, 20)
+    X, Y = r*np.cos(np.deg2rad(40)), r*np.sin(np.deg2rad(40))
+    phase = optimal_phase(X, Y)
+    Xr, Yr = rotate(X, Y, phase)
+    assert Yr == pytest.approx(np.zeros(20), abs=1e-12)
+    assert np.all(Xr > 0)
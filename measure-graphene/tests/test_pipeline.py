@@ -0,0 +1,29 @@
+import pytest
+
+from pipeline import Pipeline
+
+def test_failed_derive_keeps_persisting():
+    saved, derived = [], []
+    def derive(item):
+        if(item == 1): raise ValueError("bad spectrum")
+        derived.append(item)
+
+    pipeline = Pipeline(saved.append, derive=derive)
+    for item in range(4):
+        try:
+            pipeline.submit(item)
+        except ValueError:
+            pass                # Raised once the worker has failed
+    with pytest.raises(ValueError):
+        pipeline.close()
+
+    assert saved == [0, 1, 2, 3]    # Every item is persisted
+    assert derived == [0]           # Derived work stops at the first error
+
+def test_items_in_order():
+    saved = []
+    pipeline = Pipeline(saved.append)
+    for item in range(100):
+        pipeline.submit(item)
+    pipeline.close()
+    assert saved == list(range(100))
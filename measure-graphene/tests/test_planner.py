@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from planner import SweepModel, Transport1Sweep, propose, predict, schedule
+
+class FixedRampSweep(SweepModel):
+    # A script with neither a step size nor a delay parameter
+    script = 'fixed.py'
+
+    def points(self):
+        return np.linspace(-1, 1, 5)
+
+    def move(self, V_start, V_end):
+        return np.linspace(V_start, V_end, 4)[1:], 0.1
+
+    def start(self, V0, V_first):
+        return [(V0, *self.move(V0, V_first))]
+
+    def end(self, V_last):
+        return [(V_last, *self.move(V_last, 0))]
+
+    def settle(self, point=None):
+        return 0.5
+
+def test_propose_without_ramp_parameters():
+    changes, model = propose(FixedRampSweep({}), max_step=0.1, max_slew=0.5)
+    assert changes == {}
+
+def test_propose_transport1_within_limits():
+    parameters = dict(Vgi=-1, Vgf=1, nVg=21, dt=0.15, ns=10, back_sweep=False,
+                      keithley_step_size=50e-3, keithley_step_delay=0.1)
+    changes, model = propose(Transport1Sweep(parameters), max_step=20e-3, max_slew=0.1)
+    assert changes['keithley_step_size'] == 20e-3
+    assert changes['keithley_step_delay'] == pytest.approx(0.2)
+
+def test_predict_counts_every_point():
+    plan = predict(FixedRampSweep({}))
+    assert plan['points'] == 5
+    assert plan['settle'] == pytest.approx(2.5)
+    assert len(schedule(FixedRampSweep({}))) == 1 + 5 + 1    # start, a move to every point, end
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from ramp import ramp_schedule
+
+@pytest.mark.parametrize('V_start, V_end, step_size', [
+    (0, 1, 0.1), (1, 0, 0.1), (-0.5, 0.73, 0.05), (1.95, 1.99, 0.01),
+    (0.3, -0.3, 0.1), (0, 0.25, 0.1), (0.2, 0.2, 0.05)])
+def test_ramp_schedule_endpoints(V_start, V_end, step_size):
+    v = ramp_schedule(V_start, V_end, step_size)
+    assert v[-1] == V_end
+    if(V_start != V_end):
+        assert v[0] == V_start
+        steps = np.diff(v)
+        assert np.all(np.sign(steps) == np.sign(V_end - V_start))
+        assert np.all(np.abs(steps) <= step_size + 1e-12)
+        assert len(v) == int(np.ceil(abs(V_end - V_start)/step_size - 1e-9)) + 1
+    else:
+        assert len(v) == 1
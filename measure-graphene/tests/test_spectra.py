@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from spectra import derivative, average_sweeps, bwd_name
+
+def nonuniform(n=201, lo=-1, hi=1):
+    # Up to four times denser near the ends, like adaptive gate points
+    u = np.linspace(-1, 1, n)
+    return lo + (hi - lo)*(u + 0.2*np.sin(np.pi*u) + 1)/2
+
+def interior(x, margin=0.1):
+    # Away from the ends, where the Savitzky-Golay window is one-sided
+    lo, hi = np.min(x, axis=-1, keepdims=True), np.max(x, axis=-1, keepdims=True)
+    return (x > lo + margin) & (x < hi - margin)
+
+@pytest.mark.parametrize('method', ['savgol', 'regularised'])
+def test_derivative_nonuniform_shared_grid(method):
+    x = nonuniform()
+    y = np.sin(2*x) + x**2
+    d = derivative(y, x, method=method, lam=1e-4)
+    inner = interior(x)
+    assert d[inner] == pytest.approx((2*np.cos(2*x) + 2*x)[inner], abs=1e-3)
+
+@pytest.mark.parametrize('method', ['savgol', 'regularised'])
+def test_derivative_nonuniform_grid_per_curve(method):
+    x = np.array([nonuniform(), nonuniform(lo=-0.5, hi=1.5)[::-1], np.unique(np.r_[np.linspace(-1, 1, 150), np.linspace(-0.1, 0.15, 51)])[:201]])
+    a = np.array([[1], [2], [0.5]])
+    y = a*np.sin(2*x)
+    d = derivative(y, x, method=method, lam=1e-4)
+    inner = interior(x)
+    assert d[inner] == pytest.approx((2*a*np.cos(2*x))[inner], abs=1e-3)
+    assert d[0] == pytest.approx(derivative(y[0], x[0], method=method, lam=1e-4))
+
+def test_derivative_uniform_matches_per_curve():
+    x = np.linspace(0, 1, 101)
+    y = np.array([x**2, x**3])
+    assert derivative(y, x) == pytest.approx(np.array([derivative(yi, x) for yi in y]))
+    assert derivative(y, x)[:, 5:-5] == pytest.approx(np.array([2*x, 3*x**2])[:, 5:-5], abs=1e-3)
+
+def test_average_sweeps():
+    data = {'Bias calc (V)' : np.arange(3.0), 'Current (A)' : np.ones(3),
+            bwd_name('Current (A)') : 3*np.ones(3)}
+    averaged = average_sweeps(data)
+    assert set(averaged) == {'Bias calc (V)', 'Current (A)'}
+    assert averaged['Current (A)'] == pytest.approx(2*np.ones(3))
@@ -0,0 +1,46 @@
+import os
+import pytest
+
+from storage import RunWriter, resume_run, read_run, collect
+
+META = {'Vgi' : -1.0, 'Vgf' : 1.0}
+
+def test_points_readable_while_running(tmp_path):
+    run = RunWriter(str(tmp_path/'run'), META)
+    for n in range(3):
+        run.append({'vg' : n})
+    meta, points = read_run(run.path)
+    assert meta['complete'] is False
+    assert list(collect(points, 'vg')) == [0, 1, 2]
+
+    run.finish(note='done')
+    meta, points = read_run(run.path)
+    assert meta['complete'] is True and meta['note'] == 'done'
+
+def test_resume_discards_points_after_the_last_checkpoint(tmp_path):
+    run = RunWriter(str(tmp_path/'run'), META)
+    for n in range(3):
+        run.append({'vg' : n})
+        run.checkpoint(vg=n)
+    run.append({'vg' : 3})      # Written, but interrupted before its checkpoint
+
+    run, points, checkpoint = resume_run(str(tmp_path/'run'), META)
+    assert [point['vg'] for point in points] == [0, 1, 2]
+    assert checkpoint['vg'] == 2 and checkpoint['index'] == 2
+    assert len(read_run(run.path)[1]) == 3
+
+    # Appending continues the numbering where the checkpoint left off
+    run.append({'vg' : 3.5})
+    assert [point['vg'] for point in read_run(run.path)[1]] == [0, 1, 2, 3.5]
+
+def test_resume_without_checkpoint_starts_over(tmp_path):
+    run = RunWriter(str(tmp_path/'run'), META)
+    run.append({'vg' : 0})
+    run, points, checkpoint = resume_run(str(tmp_path/'run'), META)
+    assert points == [] and checkpoint is None
+    assert os.listdir(os.path.join(run.path, 'points')) == []
+
+def test_resume_refuses_changed_parameters(tmp_path):
+    RunWriter(str(tmp_path/'run'), META)
+    with pytest.raises(Exception, match='Vgf'):
+        resume_run(str(tmp_path/'run'), dict(META, Vgf=2.0))
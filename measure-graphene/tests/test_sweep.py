@@ -0,0 +1,58 @@
+import numpy as np
+
+from sweep import AdaptiveGrid, snake
+
+def peak(Vg):
+    return 1/(1 + ((Vg - 0.1)/0.05)**2)
+
+def run(grid):
+    order = []
+    for Vg in grid:
+        order.append(Vg)
+        grid.add(Vg, peak(Vg))
+    return np.array(order)
+
+def test_coarse_pass_first_then_refines_near_the_peak():
+    grid  = AdaptiveGrid(-1, 1, n_coarse=21, n_max=41, batch=5)
+    order = run(grid)
+    assert np.allclose(order[:21], np.linspace(-1, 1, 21))
+    assert len(order) == 41
+    refined = order[21:]
+    assert np.all(np.abs(refined - 0.1) < 0.3)
+    assert len(np.unique(order)) == len(order)
+
+def test_passes_continue_from_the_last_point():
+    grid  = AdaptiveGrid(-1, 1, n_coarse=21, n_max=41, batch=5)
+    order = run(grid)
+    for start in range(21, 41, 5):
+        batch = order[start:start + 5]
+        steps = np.diff(batch)
+        assert np.all(steps > 0) or np.all(steps < 0)
+        # Starts from the end of the batch nearest the previous point
+        assert abs(batch[0] - order[start - 1]) <= abs(batch[-1] - order[start - 1])
+
+def test_done_only_after_the_last_point():
+    grid = AdaptiveGrid(-1, 1, n_coarse=11, n_max=20, batch=3)
+    for Vg in grid:
+        assert not grid.done
+        grid.add(Vg, peak(Vg))
+    assert grid.done
+    assert len(grid.vg) == 20
+
+def test_done_early_below_tolerance():
+    grid = AdaptiveGrid(-1, 1, n_coarse=11, n_max=50, tol=0.5)
+    for Vg in grid:
+        grid.add(Vg, 2*Vg)      # A straight line needs no refinement
+    assert grid.done
+    assert len(grid.vg) == 11
+
+def test_dV_min_stops_refinement():
+    grid = AdaptiveGrid(-1, 1, n_coarse=21, n_max=500, dV_min=0.05)
+    run(grid)
+    vg, y = grid.result()
+    assert np.min(np.diff(vg)) >= 0.05 - 1e-12
+
+def test_snake_alternates_rows():
+    i, j = snake([1, 2, 3], [0, 1])
+    assert list(i) == [0, 0, 1, 1, 2, 2]
+    assert list(j) == [0, 1, 1, 0, 0, 1]
@@ -0,0 +1,30 @@
+import numpy as np
+
+from transport_analysis import sweep_segments, analyse
+
+def back_sweep(vg):
+    # As transport1.py: the turning point is measured twice
+    return np.concatenate((vg, vg[::-1]))
+
+def test_sweep_segments_back_sweep_with_repeated_endpoint():
+    vg = back_sweep(np.linspace(-1, 1, 11))
+    forward, backward = sweep_segments(vg)
+    assert np.array_equal(forward, np.arange(11))
+    assert np.array_equal(backward, np.arange(11, 22))
+    for s in (forward, backward):
+        assert np.all(np.abs(np.diff(vg[s])) > 0)
+
+def test_sweep_segments_repeated_start():
+    vg = np.concatenate(([-1, -1], np.linspace(-1, 1, 11)))
+    segments = sweep_segments(vg)
+    assert len(segments) == 1
+    assert np.all(np.diff(vg[segments[0]]) > 0)
+
+def test_analyse_back_sweep_finds_dirac_point():
+    vg = back_sweep(np.linspace(-1, 1, 41))
+    Rg = 500 + 5e3/(1 + ((vg - 0.1)/0.15)**2)
+    Ig = 1e-9*vg
+    arrays, summary = analyse(vg, Rg, Ig)
+    assert abs(summary['dirac'] - 0.1) < 0.02
+    assert abs(summary['hysteresis']) < 0.02
+    assert np.all(np.isfinite(arrays['dIgdVg']))
@@ -0,0 +1,155 @@
+"""
+Opt-in tracing of instrument calls.
+
+Wraps the calls the sweep scripts make (Signals.ValGet, UserOut.ValSet,
+BiasSpectr.Start, the session read/settle/ramp helpers, Keithley properties
+and the ramp.py helpers) and records the start time, duration, thread and
+arguments of every call in a fixed-size ring buffer. Nothing is wrapped
+unless tracing is switched on, so a normal run pays nothing for it.
+
+The buffer is written as Chrome trace JSON, which opens in ui.perfetto.dev or
+chrome://tracing, with nested calls (e.g. every Keithley write inside a ramp)
+shown under their caller.
+
+Usage:
+    tracer = Tracer()
+    tracer.instrument_session(session)
+    kth = tracer.keithley(kth)
+    ramp_to_voltage = tracer.wrap(ramp_to_voltage)
+    tracer.dump_on_exit('run.trace.json')
+"""
+import os
+import json
+import time
+import atexit
+import threading
+import collections
+
+class Tracer:
+    def __init__(self, capacity=200000):
+        """
+        Parameters
+        ----------
+        capacity : number of calls kept. Once full, the oldest are dropped
+
+        """
+        self.events   = collections.deque(maxlen=capacity)
+        self.t0       = time.perf_counter()
+        self.filename = None
+
+    def wrap(self, func, name=None, cat='call'):
+        """
+        Returns func recording every call to the trace.
+        """
+        name   = name or func.__name__
+        events = self.events
+        def traced(*args, **kwargs):
+            t = time.perf_counter()
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                events.append((name, cat, t, time.perf_counter(), threading.get_ident(), args, kwargs, error))
+        traced.__name__ = func.__name__
+        traced.__doc__  = func.__doc__
+        return traced
+
+    def instrument(self, obj, methods, cat):
+        """
+        Replaces the given methods of obj with traced ones.
+        """
+        for method in methods:
+            setattr(obj, method, self.wrap(getattr(obj, method), type(obj).__name__ + '.' + method, cat))
+
+    def instrument_session(self, session):
+        """
+        Traces the Nanonis module calls and the session helpers.
+        """
+        self.instrument(session.signals,  ['ValGet', 'NamesGet'], 'nanonis')
+        self.instrument(session.userOut,  ['ValSet'], 'nanonis')
+        self.instrument(session.lockin,   ['ModOnOffSet', 'ModAmpSet', 'ModPhasFreqSet'], 'nanonis')
+        self.instrument(session.biasSpec, ['Start', 'PropsGet'], 'nanonis')
+        self.instrument(session, ['read', 'average', 'settle', 'ramp_output'], 'session')
+
+    def keithley(self, keithley):
+        """
+        Returns a stand-in for the Keithley that traces source_voltage,
+        current and SCPI writes and queries. Pass it wherever the Keithley
+        was used (including the ramp helpers).
+        """
+        return TracedKeithley(keithley, self)
+
+    def record(self, name, cat, t, args=()):
+        self.events.append((name, cat, t, time.perf_counter(), threading.get_ident(), args, {}, None))
+
+    def summary(self):
+        """
+        Returns {call name : (number of calls, total time, longest call)} in
+        seconds, sorted by total time.
+        """
+        stats = {}
+        for name, _, t_start, t_end, _, _, _, _ in list(self.events):
+            count, total, longest = stats.get(name, (0, 0, 0))
+            stats[name] = (count + 1, total + t_end - t_start, max(longest, t_end - t_start))
+        return dict(sorted(stats.items(), key=lambda item: -item[1][1]))
+
+    def dump(self, filename=None):
+        """
+        Writes the buffer as Chrome trace JSON.
+        """
+        filename = filename or self.filename
+        threads  = {thread.ident : thread.name for thread in threading.enumerate()}
+
+        trace = []
+        for name, cat, t_start, t_end, tid, args, kwargs, error in list(self.events):
+            event_args = {'args' : [_jsonable(arg) for arg in args]}
+            event_args.update({key : _jsonable(value) for key, value in kwargs.items()})
+            if(error is not None): event_args['error'] = repr(error)
+
+            trace.append({'name' : name, 'cat' : cat, 'ph' : 'X', 'pid' : os.getpid(), 'tid' : tid,
+                          'ts'   : 1e6*(t_start - self.t0), 'dur' : 1e6*(t_end - t_start),
+                          'args' : event_args})
+
+        for tid in set(event['tid'] for event in trace):
+            trace.append({'name' : 'thread_name', 'ph' : 'M', 'pid' : os.getpid(), 'tid' : tid,
+                          'args' : {'name' : threads.get(tid, str(tid))}})
+
+        json.dump({'traceEvents' : trace, 'displayTimeUnit' : 'ms'}, open(filename, 'w'))
+
+    def dump_on_exit(self, filename):
+        """
+        Writes the trace to filename when the script exits, including when it
+        is interrupted or fails.
+        """
+        if(self.filename is None): atexit.register(self.dump)
+        self.filename = filename
+
+class TracedKeithley:
+    def __init__(self, keithley, tracer):
+        object.__setattr__(self, '_keithley', keithley)
+        object.__setattr__(self, '_tracer', tracer)
+
+    def __getattr__(self, name):
+        t = time.perf_counter()
+        value = getattr(self._keithley, name)
+        if(callable(value)):
+            return self._tracer.wrap(value, 'Keithley.' + name, 'gpib')
+
+        self._tracer.record('Keithley.' + name, 'gpib', t)
+        return value
+
+    def __setattr__(self, name, value):
+        t = time.perf_counter()
+        setattr(self._keithley, name, value)
+        self._tracer.record('Keithley.' + name + ' =', 'gpib', t, (value,))
+
+def _jsonable(value):
+    if(isinstance(value, (bool, int, float, str)) or value is None): return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        text = repr(value)
+        return text if len(text) <= 100 else text[:97] + '...'
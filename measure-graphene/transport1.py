@@ -11,19 +11,28 @@ import pickle
 from datetime import datetime
 import matplotlib.pyplot as plt
 
-from nanonisTCP import nanonisTCP
-from nanonisTCP.Bias import Bias
-from nanonisTCP.UserOut import UserOut
-from nanonisTCP.Signals import Signals
-from nanonisTCP.LockIn  import LockIn
+from ramp import ramp_gate_voltage
+from acquisition import sample_variance
+from session import NanonisSession
+from sweep import AdaptiveGrid, snake
+from planner import sweep_model, predict, print_plan
+from storage import RunWriter
+from demod import PhaseTracker, optimal_phase, rotate
+from live_view import LiveView
 
 try:
     from pymeasure.instruments.keithley import Keithley2400
 except:
     from pymeasure.instruments.keithley import Keithley2400
 
-IP   = '127.0.0.1'
-NTCP = nanonisTCP(IP,6501)
+simulate = False    # Run against the offline simulator (simulator.py) instead of the instruments
+
+IP      = '127.0.0.1'
+PORT    = 6501
+if simulate:
+    from simulator import simulated_setup
+    IP, PORT, Keithley2400 = simulated_setup()
+session = NanonisSession(IP,PORT)
 
 # Set parameters
 DeviceID = "IDS001" # Device ID for run name
@@ -33,54 +42,85 @@ Vgi = -2            # Initial gate voltage (V)
 Vgf = 2.0           # Final gate voltage (V)
 nVg = 10            # Number of gate voltage steps
 dt  = 0.15          # Time to wait for gate voltage to settle before measuring current (s)
-ns  = 10            # Number of samples to average for each measurement
+ns  = 10            # Number of samples to average for each measurement (the saved variance is NaN with 1)
+
+adaptive_vg  = False # Refine the gate voltage points around features in Rg (nVg is the coarse pass)
+nVg_max      = 40    # Total gate voltage point budget when adaptive_vg is on
+adaptive_tol = 0.01  # Stop refining once no interval deviates more than this fraction of the Rg range
+
+adaptive_ns = False # Average until the standard error of X and Y reaches sem_tol (ns is then the minimum)
+sem_tol     = 2e-7  # Target standard error of the mean for X and Y (V)
+ns_max      = 100   # Maximum number of samples per point when adaptive_ns is on
 
 R1 = 1e5            # Resistance in series with the device (Ohm)
 
 lockinAmp = 10e-3   # Set the amplitude of the lock-in oscillation (V)
 lockinFrq = 977     # Set the frequency of the lock-in oscillation (Hz)
 
+map_mode  = False   # Measure a lock-in amplitude (Vb) x Vg map, one Vg sweep per amplitude, instead of one sweep
+Vb_values = np.linspace(2e-3, 20e-3, 10)    # Lock-in amplitudes of the map rows (V). Rows alternate direction in Vg
+
+dmodX_signal = 'LI Demod 1 X (V)'   # Name of the lock-in X signal in the Nanonis signal list
+dmodY_signal = 'LI Demod 1 Y (V)'   # Name of the lock-in Y signal in the Nanonis signal list
+
+software_lockin  = False    # Demodulate one oscilloscope block of the raw signal per point instead of polling X and Y
+lockin_harmonics = (1, 2)   # Harmonics of lockinFrq to demodulate (the first gives Rg)
+lockin_bandwidth = None     # Software lock-in filter bandwidth (Hz), None averages the whole block
+osci_signal_slot    = 0     # Signals Manager slot of the voltage across R1 (oscilloscope channel A)
+osci_reference_slot = 1     # Signals Manager slot of the lock-in modulation (oscilloscope channel B)
+
+adaptive_settle = False     # Move on once the lock-in signal has converged (dt becomes the upper limit)
+settle_tol      = 1e-6      # Converged when X and Y vary less than this over the settle window (V)
+
 keithley_step_delay = 0.10  # Delay between voltage steps when ramping (s)
 keithley_step_size  = 50e-3 # Voltage step size when ramping (V)
 
-back_sweep = True   # Perform backward sweep?
+back_sweep = True   # Perform backward sweep? (not in map mode, where rows alternate direction instead)
 save = True         # Save the data?
+trace = False       # Record every instrument call to a Chrome trace (open in ui.perfetto.dev)
+live_plot = False   # Plot every point as it arrives, in a separate window (see live_view.py)
 
 # ###############################################################
 # Initialise Nanonis modules
 # ###############################################################
-userOut = UserOut(NTCP)
-signals = Signals(NTCP)
-lockin  = LockIn(NTCP)
-
-# ###############################################################
-# Helper functions
-# ###############################################################
-
-# Ramp the gate voltage applied via the Keithley
-def ramp_gate_voltage(keithley, V_start, V_end, step_size, delay):
-    if V_end > V_start:
-        V_range = np.arange(V_start, V_end + step_size, step_size)
-    else:
-        V_range = np.arange(V_start, V_end - step_size, -step_size)
-    
-    for V in V_range:
-        keithley.source_voltage = V
-        time.sleep(delay)
-    keithley.source_voltage = V_end  # Ensure final voltage is set
+userOut = session.userOut
+signals = session.signals
+lockin  = session.lockin
 
 # ###############################################################
 # Initialise instruments
 # ###############################################################
 
 # Set lock-in parameters
+if map_mode:
+    lockinAmp = Vb_values[0]
 lockin.ModAmpSet(1,lockinAmp)
 lockin.ModPhasFreqSet(1,lockinFrq)
 lockin.ModOnOffSet(modulator_number=1, lockin_onoff=1)
 
+if software_lockin:
+    session.osci.ChsSet(osci_signal_slot, osci_reference_slot)
+    session.osci.Run()
+
 # Ramp gate voltage to initial value
 keithley = Keithley2400("GPIB::25")
+if trace:
+    # Record every instrument call (see tracing.py)
+    from tracing import Tracer
+    tracer = Tracer()
+    tracer.instrument_session(session)
+    keithley = tracer.keithley(keithley)
+    ramp_gate_voltage = tracer.wrap(ramp_gate_voltage)
+    tracer.dump_on_exit(datetime.now().strftime("%Y%m%d_%H%M%S") + "_trace.json")
 Vg_current = keithley.source_voltage
+
+# Predicted run time (see planner.py; the adaptive point budget is an upper bound)
+sweep_plan = sweep_model('transport1.py', globals())
+print_plan(predict(sweep_plan, V0=Vg_current), "Map" if map_mode else "Sweep")
+if map_mode:
+    raster = np.tile(np.linspace(Vgi, Vgf, nVg), len(Vb_values))
+    print_plan(predict(sweep_plan, V0=Vg_current, Vg=raster), "Same map in raster order")
+
 ramp_gate_voltage(keithley, Vg_current, Vgi, keithley_step_size, keithley_step_delay)
 time.sleep(1)  # Wait a second to stabilise
 
@@ -89,33 +129,109 @@ time.sleep(1)  # Wait a second to stabilise
 # ###############################################################
 print("Starting measurement...")
 
+# Write the parameters up front and every point as it arrives, so nothing is
+# lost if the run is interrupted
+parameters = {
+    'DeviceID': DeviceID,
+    'Temperature': Temperature,
+    'Vgi': Vgi,
+    'Vgf': Vgf,
+    'nVg': nVg,
+    'adaptive_vg': adaptive_vg,
+    'nVg_max': nVg_max,
+    'adaptive_tol': adaptive_tol,
+    'dt': dt,
+    'adaptive_settle': adaptive_settle,
+    'settle_tol': settle_tol,
+    'ns': ns,
+    'adaptive_ns': adaptive_ns,
+    'sem_tol': sem_tol,
+    'ns_max': ns_max,
+    'R1': R1,
+    'lockinAmp': lockinAmp,
+    'lockinFrq': lockinFrq,
+    'dmodX_signal': dmodX_signal,
+    'dmodY_signal': dmodY_signal,
+    'software_lockin': software_lockin,
+    'lockin_harmonics': lockin_harmonics,
+    'lockin_bandwidth': lockin_bandwidth,
+    'keithley_step_delay': keithley_step_delay,
+    'keithley_step_size': keithley_step_size,
+    'back_sweep': back_sweep,
+    'map_mode': map_mode,
+    'Vb_values': Vb_values
+}
+
+if save:
+    run_name = f"{DeviceID}_{Temperature}K"
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    run = RunWriter(f"{timestamp}_{run_name}", {'parameters': parameters})
+
 I_values = []
 Rg_values = [] # Graphene resistance values
 dmodX_values = []
 dmodY_values = []
-Vg_range = np.linspace(Vgi, Vgf, nVg) if Vgf > Vgi else np.linspace(Vgi, Vgf, nVg)
-if back_sweep:
-    Vg_range = np.concatenate((Vg_range, Vg_range[::-1]))
-    
-for Vg in Vg_range:
+settle_times = []
+dmod_variances = [] # Sample variance of X and Y at each point
+dmod_counts = []    # Number of samples averaged at each point
+phase_tracker = PhaseTracker()  # Lock-in phase maximising X over the points so far
+harmonics = []      # X, Y, R and phase at each harmonic (software_lockin)
+if live_plot:
+    live = LiveView([['Rg'], ['I'], ['X', 'Y']], xlim=(min(Vgi, Vgf), max(Vgi, Vgf)))
+Vg_values = []
+Vb_measured = []    # Lock-in amplitude at each point
+if map_mode:
+    if back_sweep:
+        print("back_sweep is ignored in map mode: rows alternate direction in Vg instead")
+    # Snake through the map so the gate never ramps back to Vgi between rows
+    Vg_grid = np.linspace(Vgi, Vgf, nVg)
+    map_i, map_j = snake(Vb_values, Vg_grid)
+    Vg_points = Vg_grid[map_j]
+    Vb_points = np.asarray(Vb_values)[map_i]
+elif adaptive_vg:
+    grid = AdaptiveGrid(Vgi, Vgf, n_coarse=nVg, n_max=nVg_max, tol=adaptive_tol, dV_min=keithley_step_size)
+    Vg_points = grid.sweep(back_sweep)
+else:
+    Vg_points = np.linspace(Vgi, Vgf, nVg) if Vgf > Vgi else np.linspace(Vgi, Vgf, nVg)
+    if back_sweep:
+        Vg_points = np.concatenate((Vg_points, Vg_points[::-1]))
+
+session.refresh_signals()  # Signal indexes as of this sweep
+for n, Vg in enumerate(Vg_points):
+    if map_mode and Vb_points[n] != lockinAmp:
+        # Next row of the map
+        lockinAmp = Vb_points[n]
+        lockin.ModAmpSet(1, lockinAmp)
+    Vg_values.append(Vg)
+    Vb_measured.append(lockinAmp)
+
     # Set gate voltage
     ramp_gate_voltage(keithley, keithley.source_voltage, Vg, keithley_step_size, keithley_step_delay)
     _ = keithley.current
 
-    # Wait for dt seconds
-    time.sleep(dt)
+    # Wait for dt seconds (or until the lock-in signal converges)
+    if adaptive_settle:
+        settle_time = session.settle([dmodX_signal, dmodY_signal], tolerance=settle_tol, timeout=dt)
+    else:
+        time.sleep(dt)
+        settle_time = dt
+    settle_times.append(settle_time)
     
     # Read voltage across R1 from lockin (sum and square components)
-    dmodX_idx = 86
-    dmodY_idx = 87
-
-    # Take ns samples and average
-    dmodX = 0
-    dmoxY = 0
-    for _ in range(ns):
-        time.sleep(0.01)
-        dmodX += signals.ValGet(dmodX_idx) / ns
-        dmoxY += signals.ValGet(dmodY_idx) / ns
+    # Take ns samples of X and Y together and average (or until sem_tol is reached),
+    # or demodulate one block of the raw signal
+    if software_lockin:
+        X, Y, R, phase = session.demodulate(lockinFrq, lockin_harmonics, lockin_bandwidth)
+        harmonics.append(np.array([X, Y, R, phase]))
+        mean, variance, count = np.array([X[0], Y[0]]), np.full(2, np.nan), 1
+    elif adaptive_ns:
+        mean, variance, count = session.average([dmodX_signal, dmodY_signal], sem_tol, ns_min=ns, ns_max=ns_max)
+    else:
+        samples = session.read([dmodX_signal, dmodY_signal], ns=ns)
+        mean, variance, count = samples.mean(axis=0), sample_variance(samples), ns
+    dmodX, dmoxY = mean
+    dmod_variances.append(variance)
+    dmod_counts.append(count)
 
     V_R1 = np.sqrt(dmodX**2 + dmoxY**2)  # Voltage across R1
     V_graphene = lockinAmp - V_R1  # Voltage across graphene device
@@ -126,40 +242,82 @@ for Vg in Vg_range:
     I_values.append(I)
     dmodX_values.append(dmodX)
     dmodY_values.append(dmoxY)
-    print(f"Vg: {Vg:.3f} V, I: {I*1e9:.3f} nA")
+    phase_tracker.add(dmodX, dmoxY)
+    if save:
+        run.append({'Vg': Vg, 'Vb': lockinAmp, 'I': I, 'Rg': Rg, 'dmodX': dmodX, 'dmodY': dmoxY,
+                    'settle_time': settle_time, 'dmod_variance': variance, 'dmod_count': count,
+                    'harmonics': harmonics[-1] if software_lockin else None,
+                    'lockin_phase': phase_tracker.phase})
+    if live_plot:
+        live.add(Vg=Vg, Rg=Rg, I=I, X=dmodX, Y=dmoxY)
+    if adaptive_vg and not grid.done:
+        grid.add(Vg, Rg)
+    print(f"Vg: {Vg:.3f} V, I: {I*1e9:.3f} nA, settled in {settle_time:.3f} s, {count} samples, phase {phase_tracker.phase:.1f} deg")
 
 
+if live_plot:
+    live.close()
 lockin.ModOnOffSet(modulator_number=1, lockin_onoff=0)
 ramp_gate_voltage(keithley, keithley.source_voltage, 0, keithley_step_size, keithley_step_delay)
 
-NTCP.close_connection()
+session.close()
+if save:
+    run.finish()
+if trace:
+    tracer.dump()
+
+settle_times = np.array(settle_times)
+print(f"Total settle time: {np.sum(settle_times):.1f} s (fixed dt would take {dt*len(settle_times):.1f} s)")
 
 # ###############################################################
 # Plot and save data
 # ###############################################################
 
+Vg_range = np.array(Vg_values)   # Gate voltages in the order they were measured
 I_values = np.array(I_values)
 dmodX_values = np.array(dmodX_values)
 dmodY_values = np.array(dmodY_values)
+dmod_variances = np.array(dmod_variances)
+dmod_counts = np.array(dmod_counts)
+lockin_phase = optimal_phase(dmodX_values, dmodY_values)   # Phase maximising the in-phase signal (deg)
+dmodX_rotated, dmodY_rotated = rotate(dmodX_values, dmodY_values, lockin_phase)
+harmonics = np.array(harmonics)
+Vb_measured = np.array(Vb_measured)
+
+maps = {}
+if map_mode:
+    # (Vb, Vg) arrays with both axes, rows in Vb_values order and columns in Vg order
+    done = len(Vg_range)
+    for name, values in [('Rg', Rg_values), ('I', I_values), ('dmodX', dmodX_values), ('dmodY', dmodY_values)]:
+        maps[name] = np.full((len(Vb_values), len(Vg_grid)), np.nan)
+        maps[name][map_i[:done], map_j[:done]] = values
+    maps['Vb'] = np.asarray(Vb_values)
+    maps['Vg'] = Vg_grid
+
+    plt.figure()
+    plt.pcolormesh(maps['Vg'], maps['Vb']*1e3, maps['Rg'], shading='nearest')
+    plt.xlabel('Gate Voltage Vg (V)')
+    plt.ylabel('Lock-in amplitude Vb (mV)')
+    plt.colorbar(label='Graphene Resistance Rg (Ohm)')
+
 plt.figure()
 # plot the I-Vg curve on the left axis and Rg-Vg curve on the right axis
 fig, ax1 = plt.subplots()
 color = 'tab:blue'
 ax1.set_xlabel('Gate Voltage Vg (V)')
 ax1.set_ylabel('Current I (uA)', color=color)
-ax1.plot(Vg_range, I_values*1e6, marker='o', color=color)
+order = np.argsort(Vg_range, kind='stable') if adaptive_vg else np.arange(len(Vg_range))
+ax1.plot(Vg_range[order], I_values[order]*1e6, marker='o', color=color)
 ax1.tick_params(axis='y', labelcolor=color)
 ax2 = ax1.twinx()  # instantiate a second axes that shares the same x-axis
 color = 'tab:red'
 ax2.set_ylabel('Graphene Resistance Rg (Ohm)', color=color)  # we already handled the x-label with ax1
-ax2.plot(Vg_range, Rg_values, marker='s', color=color)
+ax2.plot(Vg_range[order], np.array(Rg_values)[order], marker='s', color=color)
 ax2.tick_params(axis='y', labelcolor=color)
 fig.tight_layout()  # otherwise the right y-label is slightly clipped
 
 if save:
-    run_name = f"{DeviceID}_{Temperature}K"
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{timestamp}_{run_name}.pkl"
+    filename = f"{run.path}.pkl"
     with open(filename, 'wb') as f:
         # dump the curve along with all measurement parameters
         pickle.dump({
@@ -168,19 +326,14 @@ if save:
             'Rg_values': Rg_values,
             'dmodX_values': dmodX_values,
             'dmodY_values': dmodY_values,
-            'parameters': {
-                'DeviceID': DeviceID,
-                'Temperature': Temperature,
-                'Vgi': Vgi,
-                'Vgf': Vgf,
-                'nVg': nVg,
-                'dt': dt,
-                'ns': ns,
-                'R1': R1,
-                'lockinAmp': lockinAmp,
-                'lockinFrq': lockinFrq,
-                'keithley_step_delay': keithley_step_delay,
-                'keithley_step_size': keithley_step_size,
-                'back_sweep': back_sweep
-            }
+            'settle_times': settle_times,
+            'dmod_variances': dmod_variances,
+            'dmod_counts': dmod_counts,
+            'lockin_phase': lockin_phase,
+            'dmodX_rotated': dmodX_rotated,
+            'dmodY_rotated': dmodY_rotated,
+            'harmonics': harmonics,
+            'Vb_measured': Vb_measured,
+            'map': maps,
+            'parameters': parameters
         }, f)
\ No newline at end of file
@@ -0,0 +1,272 @@
+"""
+Batch analysis of R(Vg) runs.
+
+Every run in a directory (RvsVg.py .pk or transport1.py .pkl pickles) is
+reduced to its derived arrays (Ig, dIg/dVg, normalised Rg) and a row of
+summary quantities:
+    dirac       gate voltage of the resistance peak (V)
+    Rmax        peak resistance (ohm)
+    asymmetry   (electron - hole)/(electron + hole) conductance slope, over the
+                same distance from the Dirac point on both sides
+    hysteresis  Dirac point of the back sweep minus that of the forward sweep
+                (V), for runs that sweep the gate there and back (else NaN)
+
+The results are cached next to each source file (<file>.analysis.npz), keyed
+by a hash of its contents and of the analysis settings, so rerunning over a
+growing anneal series only analyses new or modified runs. Stale runs are
+analysed in parallel worker processes.
+
+Usage:
+    python transport_analysis.py <directory> [table.csv]
+
+    table = analyse_runs(directory)
+    arrays = load_analysis(filename)   # vg, Rg, Ig, dIgdVg, Rg_norm
+"""
+import os
+import sys
+import csv
+import glob
+import pickle
+import hashlib
+import numpy as np
+from scipy.signal import savgol_filter
+from concurrent.futures import ProcessPoolExecutor
+
+from spectra import derivative
+
+VERSION = 1     # Bump when the analysis changes, to invalidate every cache
+
+SUMMARY = ['dirac', 'Rmax', 'asymmetry', 'hysteresis', 'points']
+
+def file_hash(filename, settings=()):
+    """
+    Hash of a file's contents and the analysis settings (the cache key).
+    """
+    h = hashlib.sha1(repr((VERSION,) + tuple(settings)).encode())
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def cache_name(filename):
+    return filename + '.analysis.npz'
+
+def load_run(filename):
+    """
+    Reads the gate voltage, resistance and gate current of a run, in the
+    order they were measured.
+
+    Returns
+    -------
+    vg, Rg, Ig : numpy arrays
+
+    """
+    pk = pickle.load(open(filename, 'rb'))
+    if('Vg_range' in pk):   # transport1.py
+        vg = np.asarray(pk['Vg_range'], dtype=float)
+        Rg = np.asarray(pk['Rg_values'], dtype=float)
+        Ig = np.asarray(pk['I_values'], dtype=float)
+    else:                   # RvsVg.py
+        vg = np.asarray(pk['vg'], dtype=float)
+        Rg = np.asarray(pk['Rg'], dtype=float)
+        Ig = pk['Vb']/Rg
+    return vg, Rg, Ig
+
+def sweep_segments(vg, min_points=5):
+    """
+    Splits gate voltages (in measurement order) into strictly monotonic
+    sweeps. A repeated gate voltage (e.g. the turning point of a back sweep,
+    measured twice) continues the current direction and is left out of the
+    sweep it repeats in.
+
+    Returns
+    -------
+    segments : list of index arrays, one per sweep of at least min_points
+
+    """
+    direction = np.sign(np.diff(vg))
+    moving = np.flatnonzero(direction)
+    if(not len(moving)): return [np.arange(len(vg))]
+    # Zero steps take the direction of the last step that moved
+    last = np.clip(np.searchsorted(moving, np.arange(len(direction)), 'right') - 1, 0, None)
+    direction = direction[moving[last]]
+
+    turns = np.flatnonzero(direction[1:]*direction[:-1] < 0) + 1
+    bounds = np.concatenate(([0], turns, [len(vg) - 1]))
+    segments = [np.arange(a, b + 1) for a, b in zip(bounds[:-1], bounds[1:])]
+    segments = [s[np.concatenate(([True], np.diff(vg[s]) != 0))] for s in segments]
+    return [s for s in segments if len(s) >= min_points] or [np.arange(len(vg))]
+
+def dirac_point(vg, Rg, sg_pts=5, sg_poly=1):
+    """
+    Dirac point and peak resistance of one sweep: the vertex of a parabola
+    through the points around the maximum of the smoothed resistance.
+    """
+    order = np.argsort(vg, kind='stable')
+    vg, Rg = vg[order], Rg[order]
+
+    window = min(sg_pts, len(vg) - (1 - len(vg) % 2))
+    smooth = savgol_filter(Rg, window, min(sg_poly, window - 1)) if window > sg_poly else Rg
+    peak = np.argmax(smooth)
+
+    near = slice(max(peak - 2, 0), min(peak + 3, len(vg)))
+    if(near.stop - near.start >= 3):
+        a, b, c = np.polyfit(vg[near], smooth[near], 2)
+        if(a < 0 and vg[near][0] <= -b/(2*a) <= vg[near][-1]):
+            return -b/(2*a), c - b**2/(4*a)
+    return vg[peak], smooth[peak]
+
+def asymmetry(vg, Rg, dirac):
+    """
+    Electron/hole asymmetry of the conductance slope, fitted over the outer
+    half of the distance from the Dirac point reached on both sides.
+    """
+    d = vg - dirac
+    reach = min(np.max(d, initial=0), -np.min(d, initial=0))
+    slopes = []
+    for side in [d > 0, d < 0]:
+        fit = side & (np.abs(d) >= reach/2)
+        if(reach <= 0 or np.count_nonzero(fit) < 3): return np.nan
+        slopes.append(np.polyfit(np.abs(d[fit]), 1/Rg[fit], 1)[0])
+    return (slopes[0] - slopes[1])/(slopes[0] + slopes[1])
+
+def analyse(vg, Rg, Ig, sg_pts=5, sg_poly=1):
+    """
+    Derived arrays and summary quantities of one run.
+
+    Parameters
+    ----------
+    vg, Rg, Ig : gate voltage, resistance and gate current in measurement order
+    sg_pts, sg_poly : Savitzky-Golay window and order for dIg/dVg and the peak
+
+    Returns
+    -------
+    arrays  : dictionary of vg, Rg, Ig, dIgdVg and Rg_norm (measurement order)
+    summary : dictionary of the SUMMARY quantities
+
+    """
+    keep = np.isfinite(vg) & np.isfinite(Rg)
+    vg, Rg, Ig = vg[keep], Rg[keep], Ig[keep]
+
+    segments = sweep_segments(vg)
+    dIgdVg = np.full(len(vg), np.nan)
+    for s in segments:
+        if(len(s) > sg_pts):
+            dIgdVg[s] = derivative(Ig[s], vg[s], sg_pts=sg_pts, sg_poly=sg_poly)
+
+    Rg_norm  = Rg - np.min(Rg)
+    Rg_norm /= np.max(Rg_norm) or 1
+
+    forward = segments[0]
+    dirac, Rmax = dirac_point(vg[forward], Rg[forward], sg_pts, sg_poly)
+    hysteresis = np.nan
+    if(len(segments) > 1):
+        hysteresis = dirac_point(vg[segments[1]], Rg[segments[1]], sg_pts, sg_poly)[0] - dirac
+
+    arrays  = {'vg' : vg, 'Rg' : Rg, 'Ig' : Ig, 'dIgdVg' : dIgdVg, 'Rg_norm' : Rg_norm}
+    summary = {'dirac'      : float(dirac),
+               'Rmax'       : float(Rmax),
+               'asymmetry'  : float(asymmetry(vg[forward], Rg[forward], dirac)),
+               'hysteresis' : float(hysteresis),
+               'points'     : len(vg)}
+    return arrays, summary
+
+def analyse_file(filename, sg_pts=5, sg_poly=1, key=None):
+    """
+    Analyses one run and writes its cache. Returns its summary row.
+    """
+    key = key or file_hash(filename, (sg_pts, sg_poly))
+    row = {'file' : os.path.basename(filename)}
+    try:
+        arrays, summary = analyse(*load_run(filename), sg_pts, sg_poly)
+    except Exception as error:
+        row['error'] = repr(error)
+        return row
+
+    tmp = cache_name(filename) + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, key=key, **arrays, **{'summary_' + k : v for k, v in summary.items()})
+    os.replace(tmp, cache_name(filename))
+
+    row.update(summary)
+    return row
+
+def _cached_row(filename, key):
+    try:
+        with np.load(cache_name(filename)) as f:
+            if(str(f['key']) != key): return None
+            row = {'file' : os.path.basename(filename)}
+            row.update({k : f['summary_' + k].item() for k in SUMMARY})
+            return row
+    except (OSError, KeyError, ValueError):
+        return None
+
+def load_analysis(filename, sg_pts=5, sg_poly=1):
+    """
+    Returns the cached derived arrays of a run (analysing it first if the
+    cache is missing, stale or was made with other settings).
+    """
+    key = file_hash(filename, (sg_pts, sg_poly))
+    if(_cached_row(filename, key) is None):
+        row = analyse_file(filename, sg_pts, sg_poly, key)
+        if('error' in row): raise Exception("Cannot analyse " + filename + ": " + row['error'])
+    with np.load(cache_name(filename)) as f:
+        return {k : f[k] for k in ['vg', 'Rg', 'Ig', 'dIgdVg', 'Rg_norm']}
+
+def analyse_runs(files, sg_pts=5, sg_poly=1, workers=None):
+    """
+    Analyses every run that has no up-to-date cache, in parallel.
+
+    Parameters
+    ----------
+    files   : list of pickles, or a directory (every .pk and .pkl in it)
+    workers : number of processes (default: one per CPU). 1 analyses in this
+              process. On Windows, call this from under
+              if __name__ == '__main__' when using more than one process
+
+    Returns
+    -------
+    table : list of summary rows, one per file, in file name order
+
+    """
+    if(isinstance(files, str)):
+        files = glob.glob(os.path.join(files, '*.pk')) + glob.glob(os.path.join(files, '*.pkl'))
+    files = sorted(files, key=os.path.basename)
+
+    keys  = [file_hash(f, (sg_pts, sg_poly)) for f in files]
+    table = [_cached_row(f, k) for f, k in zip(files, keys)]
+    stale = [n for n, row in enumerate(table) if row is None]
+
+    if(workers == 1 or len(stale) < 2):
+        for n in stale:
+            table[n] = analyse_file(files[n], sg_pts, sg_poly, keys[n])
+        return table
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {n : pool.submit(analyse_file, files[n], sg_pts, sg_poly, keys[n]) for n in stale}
+        for n, future in futures.items():
+            table[n] = future.result()
+    return table
+
+def write_table(table, filename):
+    """
+    Writes analyse_runs results to a csv file.
+    """
+    columns = ['file'] + SUMMARY + ['error']
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(table)
+
+if __name__ == '__main__':
+    path   = sys.argv[1] if len(sys.argv) > 1 else '.'
+    output = sys.argv[2] if len(sys.argv) > 2 else os.path.join(path, 'Rg_analysis.csv')
+
+    table = analyse_runs(path)
+    write_table(table, output)
+    for row in table:
+        if('error' in row):
+            print("%-70s failed %s" % (row['file'], row['error']))
+        else:
+            print("%-70s Dirac %7.3f V, Rmax %8.1f ohm, asymmetry %6.3f, hysteresis %7.3f V" % (row['file'], row['dirac'], row['Rmax'], row['asymmetry'], row['hysteresis']))
+    print("Saved", output)
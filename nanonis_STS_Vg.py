@@ -1,15 +1,19 @@
 # %%
+import os
+import sys
 import numpy as np
 import time
 import pickle
 from datetime import datetime
 
-from nanonisTCP import nanonisTCP
-from nanonisTCP.Bias import Bias
-from nanonisTCP.UserOut import UserOut
-from nanonisTCP.Signals import Signals
-from nanonisTCP.LockIn  import LockIn
-from nanonisTCP.BiasSpectr import BiasSpectr
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'measure-graphene'))
+from session import NanonisSession
+from storage import RunWriter, resume_run, read_run, collect
+from pipeline import Pipeline
+from spectra import reduce_spectrum
+from spectrum_map import SpectrumMap
+from live_view import LiveView
+from planner import sweep_model, predict, print_plan, spectrum_time
 
 """
 To use this code:
@@ -25,99 +29,170 @@ To use this code:
 This script will acquire spectra at different gate voltages.
 Note that it assumes the UserOut channels have been configured correctly.
 """
-IP   = '127.0.0.1'
-NTCP = nanonisTCP(IP,6503)
+simulate = False    # Run against the offline simulator (measure-graphene/simulator.py) instead of Nanonis
+
+IP      = '127.0.0.1'
+PORT    = 6503
+if(simulate):
+    from simulator import simulated_setup
+    IP, PORT, _ = simulated_setup()
+session = NanonisSession(IP,PORT)
 
 # %%
 # Parameters
 run_name = "Test"
+resume   = ""       # Run directory of an interrupted run to continue ("" starts a new run)
 Vgi = -1.0          # Initial gate voltage (V) 
 Vgf = 1.0           # Final gate voltage (V)
 dVg = 500e-3        # Gate voltage step size (V)
 dt  = 0.15          # Time to wait before changing gate voltage by dVg (s)
 
 gateChannel = 8     # UserOutput channel that controls the gate voltage 
+ts  = 1             # Time to settle before each spectrum (s)
+
+adaptiveSettle = False          # Move on once the current has converged (ts becomes the upper limit)
+settleSignal   = 'Current (A)'  # Signal watched while settling
+settleTol      = 5e-12          # Converged when the current varies less than this over the settle window (A)
 
 useLockin = True    # Turn the lock-in on for measurements
 lockinAmp = 5e-3    # Set the amplitude of the lock-in oscillation
 lockinFrq = 977     # Set the frequency of the lock-in oscillation
 
 save = True         # Save the data independently of nanonis?
-# %%
-# Functions
-def rampGate(NTCP,bias,dt=0.5,db=0.01,userOutput=8):
-    userOut = UserOut(NTCP)
-    signals = Signals(NTCP)
-
-    signalNames = signals.NamesGet()
-    outputIndex = signalNames.index('Output ' + str(userOutput) + ' (V)')
-    startBias   = signals.ValGet(outputIndex,wait_for_newest_data=True)
-
-    if(abs(startBias - bias) < db):
-        userOut.ValSet(userOutput,bias)
-        return
-        
-    bb = np.arange(startBias,bias,np.sign(bias-startBias)*db)
-    bb[-1] = bias
-    for b in bb:
-        time.sleep(dt)
-        userOut.ValSet(userOutput,b)
-        
-    userOut.ValSet(userOutput,bias)
-
+sgPts  = 5          # Savitzky-Golay window for the dI/dV saved with each spectrum
+sgPoly = 1          # Savitzky-Golay polynomial order
+trace  = False      # Record every Nanonis call to <run>.trace.json (open in ui.perfetto.dev)
+livePlot = False    # Show the (Vg, Vb) map growing, in a separate window (see measure-graphene/live_view.py)
 # %%
 # Initialisation
-bias    = Bias(NTCP)
-userOut = UserOut(NTCP)
-signals = Signals(NTCP)
-lockin  = LockIn(NTCP)
-bSpec   = BiasSpectr(NTCP)
+if(trace):
+    # Record every Nanonis call (see measure-graphene/tracing.py)
+    from tracing import Tracer
+    tracer = Tracer()
+    tracer.instrument_session(session)
+
+bias    = session.bias
+userOut = session.userOut
+signals = session.signals
+lockin  = session.lockin
+bSpec   = session.biasSpec
 
-rampGate(NTCP=NTCP,bias=0,dt=dt,userOutput=gateChannel)
+session.ramp_output(gateChannel,0,dt=dt)
 
-dmodX_idx = 86
-dmodY_idx = 87
 if(useLockin):
     lockin.ModPhasFreqSet(modulator_number=1,   frequency=lockinFrq)
     lockin.ModAmpSet(modulator_number=1,        amplitude=lockinAmp)
     lockin.ModOnOffSet(modulator_number=1,      lockin_onoff=1)
 
 # %%
-# Step 1: ramp gate voltage to initial bias, Vgi
-rampGate(NTCP=NTCP,bias=Vgi,dt=dt,userOutput=gateChannel)
+# Step 1: ramp gate voltage to initial bias, Vgi (or to the last completed
+# gate voltage when resuming an interrupted run)
+# When saving, parameters are written to the run directory up front and every
+# spectrum is written as it arrives, so nothing is lost if the run is interrupted
+print_plan(predict(sweep_model('nanonis_STS_Vg.py',globals()),{'t_spectrum' : spectrum_time(bSpec)}),run_name)   # Predicted run time (see measure-graphene/planner.py)
+experiment = {
+    "Vgi" : Vgi,        # Initial gate voltage (V) 
+    "Vgf" : Vgf,        # Final gate voltage (V)
+    "dVg" : dVg,        # Gate voltage step size (V)
+    "dt"  : dt,         # Time to wait before changing gate voltage by dVg (s)
+    "ts"  : ts,         # Time to settle before each spectrum (s)
+    "gateChannel" : gateChannel, # UserOutput channel that controls the gate voltage
+    "save"        : save,        # Spectra saved independently of nanonis?
+
+    "adaptiveSettle" : adaptiveSettle, # Settle until converged instead of a fixed ts?
+    "settleTol"      : settleTol,      # Convergence tolerance on settleSignal
+}
+
+points = []
+run    = None   # Run directory (None when not saving)
+time_string = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S').replace(':','-')
+if(resume):
+    run, points, checkpoint = resume_run(resume, experiment)
+    print("Resuming",resume,"after",len(points),"spectra")
+elif(save):
+    run = RunWriter(time_string + '_' + run_name, experiment)
+runPath = run.path if run is not None else time_string + '_' + run_name
+if(trace): tracer.dump_on_exit(runPath + ".trace.json")
+
+if(len(points)):
+    session.ramp_output(gateChannel,checkpoint["vg"],dt=dt)
+else:
+    session.ramp_output(gateChannel,Vgi,dt=dt)
 
 # %%
 # Step 2: Sweep the gate voltage while measuring the flake resistance
 N  = int((Vgf - Vgi)/dVg) + 1
 vg = np.linspace(Vgi,Vgf,N)
-bSpecData = []
-
-for n,Vg in enumerate(vg):
-    print(n+1,"/",N)
-    rampGate(NTCP=NTCP,bias=Vg,dt=dt,userOutput=gateChannel)
-    time.sleep(1)
-    
-    if(save):
-        bSpecData.append(bSpec.Start(get_data=True))
-    else:
-        bSpec.Start(get_data=False)
-    
-    
-rampGate(NTCP=NTCP,bias=0,dt=dt,userOutput=gateChannel)
-
-NTCP.close_connection()
+
+# Each spectrum is written and then reduced (dI/dV, forward/backward average)
+# and added to the (Vg, Vb) map in the background while the gate is ramped and
+# settled for the next one. The map is rewritten to <run>.map.npz after every
+# spectrum
+stsMap = SpectrumMap(N)
+if(livePlot): live = LiveView([['map']], xlim=(Vgi,Vgf), rows=N, title=runPath)
+def savePoint(point):
+    if(run is None): return
+    Vg, spectrum, settleTime = point
+    run.append({"vg"         : Vg,          # Gate voltage
+                "spec"       : spectrum,    # Data (None if not saved)
+                "settleTime" : settleTime}) # Time spent settling (s)
+    run.checkpoint(vg=Vg)
+
+def mapPoint(point):
+    Vg, spectrum = point[:2]
+    if(spectrum is None): return
+    row = stsMap.add(Vg,reduce_spectrum(spectrum,sg_pts=sgPts,sg_poly=sgPoly))
+    stsMap.save(run.path + ".map.npz")
+    if(livePlot): live.add(Vg=Vg, map=stsMap.maps[stsMap.channels[0]][row], bias=stsMap.bias)
+
+for point in points:
+    mapPoint((point["vg"],point["spec"]))
+
+session.refresh_signals()   # Signal indexes as of this sweep
+pipeline = Pipeline(savePoint,derive=mapPoint)
+try:
+    for n,Vg in enumerate(vg):
+        if(n < len(points)): continue   # Already acquired before the run was interrupted
+
+        session.ramp_output(gateChannel,Vg,dt=dt)
+        if(adaptiveSettle):
+            settleTime = session.settle([settleSignal],tolerance=settleTol,timeout=ts)
+        else:
+            time.sleep(ts)
+            settleTime = ts
+        print(n+1,"/",N,"settled in %.2f s" % settleTime)
+
+        spectrum = None
+        if(save):
+            spectrum = bSpec.Start(get_data=True)
+        else:
+            bSpec.Start(get_data=False)
+
+        pipeline.submit((Vg, spectrum, settleTime))
+except:
+    pipeline.close(raise_error=False)   # Write the queued points, then raise the loop's own error
+    raise
+else:
+    pipeline.close()
+finally:
+    if(livePlot): live.close()
+
+session.ramp_output(gateChannel,0,dt=dt)
+
+session.close()
+if(run is not None): run.finish()
+if(trace): tracer.dump()
 
 # %%
 # Save the experiment
-experiment = {
-    "Vgi" : Vgi,        # Initial gate voltage (V) 
-    "Vgf" : Vgf,        # Final gate voltage (V)
-    "dVg" : dVg,        # Gate voltage step size (V)
-    "dt"  : dt,         # Time to wait before changing gate voltage by dVg (s)
+if(run is not None):
+    experiment, points = read_run(run.path)
+    settleTimes = collect(points,"settleTime")
+    print("Total settle time: %.1f s (fixed ts would take %.1f s)" % (np.sum(settleTimes),ts*N))
 
-    "vg"  : vg,         # Gate voltage (x axis)
-    "spec": bSpecData   # Data
-}
+    experiment["settleTimes"] = settleTimes  # Time spent settling at each gate voltage (s)
+    experiment["vg"]   = collect(points,"vg") # Gate voltage (x axis)
+    experiment["spec"] = [point["spec"] for point in points if point["spec"] is not None] # Data
+    experiment["reduced"] = [reduce_spectrum(spec,sg_pts=sgPts,sg_poly=sgPoly) for spec in experiment["spec"]] # Averaged sweeps and dI/dV
 
-time_string = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S').replace(':','-')
-pickle.dump(experiment,open(time_string + '_' + run_name + ".pk",'wb'))
\ No newline at end of file
+    pickle.dump(experiment,open(run.path + ".pk",'wb'))
\ No newline at end of file